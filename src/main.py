@@ -1,5 +1,9 @@
+# Keep the time at which the application started loading
+import time
+start_time = time.perf_counter()
 import sys
 import multiprocessing
+import logging
 import PyQt5
 from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
 
@@ -14,7 +18,18 @@ from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
 from pyfmgui.main_window import MainWindow
 from pyfmgui.session import Session
 
+def report_startup_time(app, measure_startup):
+	# Called once the event loop processes the first events
+	startup_time = time.perf_counter() - start_time
+	logging.getLogger().info(f'Application started in {startup_time:.2f} s')
+	# With --measure-startup print the startup time and exit
+	if measure_startup:
+		print(f'Startup time: {startup_time:.3f} s')
+		app.quit()
+
 def main():
+	# Check if only the startup time should be measured
+	measure_startup = '--measure-startup' in sys.argv
 	# Create PyQT5 application object
 	app = QtWidgets.QApplication(sys.argv)
 	
@@ -46,6 +61,7 @@ def main():
 	# Create and show main MDI window
 	ex = MainWindow(session)
 	ex.show()
+	QtCore.QTimer.singleShot(0, lambda: report_startup_time(app, measure_startup))
 	sys.exit(app.exec())
 	
 if __name__ == '__main__':
@@ -0,0 +1,454 @@
+# Benchmark of the compute pipeline using synthetic force maps.
+# Usage: python -m pyfmgui.benchmark --sizes 16 32 --methods HertzFit TingFit
+import argparse
+import concurrent.futures
+import copy
+import json
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+import time
+import numpy as np
+from scipy.special import beta, betainc
+# Import objects used to build the synthetic curves
+from pyfmreader.utils.forcecurve import ForceCurve
+from pyfmreader.utils.segment import Segment
+from pyfmrheo.models.geom_coeffs import get_coeff
+# Import the pipeline to benchmark
+from pyfmgui.session import Session
+from pyfmgui import compute
+from pyfmgui import export
+from pyfmgui.methods import get_method
+from pyfmgui.memory_budget import get_rss_bytes
+
+methods = ("HertzFit", "TingFit", "PiezoChar", "VDrag", "Microrheo", "MicrorheoSine")
+# Methods analysing the modulation segments of the curves
+modulation_methods = ("PiezoChar", "VDrag", "Microrheo", "MicrorheoSine")
+
+def ting_force(t, tm, v, E0, betaE, coeff, n, t0=1):
+    # Force of the Ting model for a triangular ramp of speed v
+    # with the maximum indentation reached at tm. For betaE = 0
+    # the approach follows the Hertz model.
+    t = np.asarray(t, float)
+    F = np.zeros_like(t)
+    pos = t > 0
+    tt = t[pos]
+    t1 = np.where(tt <= tm, tt, tt - 2 ** (1 / (1 - betaE)) * (tt - tm))
+    x = np.clip(t1 / tt, 0, 1)
+    F[pos] = coeff * E0 * t0**betaE * n * v**n * tt**(n - betaE) * beta(n, 1 - betaE) * betainc(n, 1 - betaE, x)
+    return F
+
+def make_segment(file_id, segment_id, segment_type, zheight, vdeflection, time, metadata, velocity=0):
+    segment = Segment(file_id, segment_id, segment_type)
+    segment.segment_formated_data = {'vDeflection': vdeflection, 'measuredHeight': zheight, 'time': time}
+    segment.segment_metadata = dict(baseline_measured=False, **metadata)
+    segment.nb_point = len(zheight)
+    # Piezo velocity in nm/s, negative when approaching the sample
+    segment.velocity = velocity
+    return segment
+
+class SyntheticFile:
+    '''
+    Force volume map of size x size curves following the Ting model
+    with known parameters. Behaves like the files loaded by pyfmreader
+    and generates its curves on demand, so it is cheap to send to the
+    worker processes.
+
+    :param size: number of curves along each side of the map
+    :param npts: number of points of the approach and retract segments
+    :param E0: mean Young's modulus in Pa, it varies along the map
+    :param betaE: fluidity exponent, 0 gives Hertzian curves
+    :param mod_freqs: frequencies in Hz of the modulation segments
+    :param mod_npts: number of points of each modulation segment
+    :param retract_steps: precede each modulation segment by a retract step,
+                          as in the viscous drag measurements
+    '''
+    def __init__(self, size=16, npts=1000, E0=2000., betaE=0.2, k=0.1, tip_radius=5e-6, defl_sens=50e-9,
+                 mod_freqs=(), mod_npts=2000, retract_steps=False, noise=2e-11, seed=0):
+        self.size = size
+        self.npts = npts
+        self.E0 = E0
+        self.betaE = betaE
+        self.k = k
+        self.tip_radius = tip_radius
+        self.defl_sens = defl_sens
+        self.mod_freqs = tuple(mod_freqs)
+        self.mod_npts = mod_npts
+        self.retract_steps = retract_steps
+        self.noise = noise
+        self.seed = seed
+        self.isFV = size * size > 1
+        self.piezoimg = np.random.default_rng(seed).normal(size=(size, size)) * 1e-7
+        self.imagedata = {'Height(measured)': self.piezoimg}
+        self.filemetadata = {
+            'Entry_filename': f'synthetic_{size}x{size}_{npts}pts', 'file_type': 'synthetic',
+            'file_path': '', 'Entry_tot_nb_curve': size * size, 'spring_const_Nbym': k,
+            'defl_sens_nmbyV': defl_sens * 1e9, 'height_channel_key': 'measuredHeight',
+            'Experimental_instrument': 'synthetic'
+        }
+
+    def get_E0(self, curve_idx):
+        # Known Young's modulus of the curve
+        return self.E0 * (1 + 0.2 * np.sin(curve_idx / 7))
+
+    def getcurve(self, curve_idx):
+        file_id = self.filemetadata['Entry_filename']
+        rng = np.random.default_rng((self.seed, curve_idx))
+        E0 = self.get_E0(curve_idx)
+        coeff, n = get_coeff('paraboloid', self.tip_radius, 0.5)
+        # Ramp of 1 s reaching the contact at 2 um
+        duration = 1.0
+        time = np.linspace(0, duration, self.npts, endpoint=False)
+        zc, zmax = 2e-6, 3e-6
+        v = zmax / duration
+        tc = zc / v
+        tm = duration - tc
+        # Get force and indentation of the approach and retract segments
+        F_app = ting_force(time - tc, tm, v, E0, self.betaE, coeff, n)
+        F_ret = ting_force(time + tm, tm, v, E0, self.betaE, coeff, n)
+        d_app = F_app / self.k + rng.normal(0, self.noise, self.npts)
+        d_ret = F_ret / self.k + rng.normal(0, self.noise, self.npts)
+        z_app = zc + v * (time - tc) + F_app / self.k
+        z_ret = zc + v * (tm - time) + F_ret / self.k
+        fdc = ForceCurve(curve_idx, file_id)
+        seg_id = 0
+        fdc.extend_segments.append((seg_id, make_segment(
+            file_id, seg_id, 'Approach', z_app, d_app / self.defl_sens, time, {'duration': duration}, -v * 1e9)))
+        # Add a modulation segment of 10 periods for each frequency
+        for frequency in self.mod_freqs:
+            seg_id += 1
+            if self.retract_steps:
+                # Move 500 nm away from the sample before the modulation
+                z_step = np.linspace(zmax, zmax - 500e-9, 100)
+                t_step = np.linspace(0, 0.1, 100, endpoint=False)
+                fdc.retract_segments.append((seg_id, make_segment(
+                    file_id, seg_id, 'Retract', z_step, np.zeros(100), t_step, {'duration': 0.1, 'ramp_size': 500})))
+                seg_id += 1
+                zmax = z_step[-1]
+            t_mod = np.linspace(0, 10 / frequency, self.mod_npts, endpoint=False)
+            z_mod = zmax + 10e-9 * np.sin(2 * np.pi * frequency * t_mod) + 1e-9 * t_mod
+            d_mod = 0.5e-9 * np.sin(2 * np.pi * frequency * t_mod + 0.3) + 0.2e-9 + rng.normal(0, 1e-12, self.mod_npts)
+            fdc.modulation_segments.append((seg_id, make_segment(
+                file_id, seg_id, 'Modulation', z_mod, d_mod / self.defl_sens, t_mod,
+                {'frequency': frequency, 'duration': t_mod[-1]})))
+        seg_id += 1
+        fdc.retract_segments.append((seg_id, make_segment(
+            file_id, seg_id, 'Retract', z_ret, d_ret / self.defl_sens, time,
+            {'duration': duration, 'ramp_size': 3000}, v * 1e9)))
+        return fdc
+
+def get_benchmark_params(method, file):
+    # Parameters matching the synthetic data, with the widget defaults otherwise
+    params = {
+        'compute_all_curves': True, 'method': method, 'height_channel': 'measuredHeight',
+        'def_sens': file.defl_sens, 'k': file.k
+    }
+    if method in modulation_methods:
+        params.update(max_freq=0, corr_amp=False, piezo_char_data=None)
+    if method in ("PiezoChar", "VDrag"):
+        return params
+    params.update(
+        contact_model='paraboloid', tip_param=file.tip_radius, curve_seg='extend', correct_tilt=False,
+        offset_type='percentage', min_offset=0, max_offset=0.2, poisson=0.5, poc_method='RegulaFalsi',
+        poc_win=350e-9, sigma=0, downsample_flag=False, pts_downsample=300,
+        adaptive_downsample=False, downsample_tol=0.01, auto_init_E0=True, E0=1000, d0=0, f0=0, slope=0, fit_range_type='full', max_ind=0, min_ind=0, max_force=0,
+        min_force=0, fit_line=False
+    )
+    if method in ("Microrheo", "MicrorheoSine"):
+        params.update(bcoef=0, wc=None)
+    elif method == "TingFit":
+        params.update(
+            vdragcorr=False, polyordr=2, rampspeed=0, compute_v_flag=False, t0=1, tc=0,
+            auto_init_betaE=True, fluid_exp=0.2, vdrag=0, model_type='analytical',
+            smoothing_win=5, contact_offset=1e-6
+        )
+    return params
+
+# Spans of each stage of the compute pipeline. The reading threads and
+# the fit workers run at the same time, their spans are summed over the
+# threads and workers, in seconds of a thread or worker.
+stage_spans = {'preprocess': ('getcurve', 'preprocess'), 'fit': ('fit',), 'save': ('save',)}
+
+def get_stage_times(profile_stats):
+    return {
+        stage: float(sum(sum(profile_stats.spans.get(name, ())) for name in names))
+        for stage, names in stage_spans.items()
+    }
+
+class NullCallback:
+    def emit(self, value):
+        pass
+
+class RssSampler:
+    '''
+    Samples the resident memory of this process and of its workers in a
+    thread while a case runs, to get the peaks of that case only.
+
+    :param interval: seconds between two samples
+    '''
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_self = None
+        self.peak_children = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        # The resident memory can only be read on Linux
+        rss = get_rss_bytes()
+        if rss is None:
+            return
+        self.peak_self = max(self.peak_self or 0, rss)
+        # Keep the peak of the largest worker
+        for child in multiprocessing.active_children():
+            child_rss = get_rss_bytes(child.pid)
+            if child_rss is not None:
+                self.peak_children = max(self.peak_children or 0, child_rss)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+    def get_peaks(self):
+        # Peaks in MB of this process and of its largest worker, if any
+        if self.peak_self is None:
+            return None, None
+        return self.peak_self / 1e6, (self.peak_children or 0) / 1e6
+
+class CountingExecutor(concurrent.futures.Executor):
+    '''
+    Executor passing the tasks to another executor and counting the
+    bytes pickled to send the tasks and to get their results back.
+    The arrays sent through shared memory are not pickled, only their
+    references. The agents of a cluster get the shared arguments of the
+    tasks once, the count is the one of a pool of processes.
+
+    :param executor: executor running the tasks
+    '''
+    def __init__(self, executor):
+        self.executor = executor
+        self.pickled_bytes = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Tell compute the capacity of the executor and whether it is remote
+        return getattr(self.executor, name)
+
+    def count(self, value):
+        nbytes = len(pickle.dumps(value))
+        with self.lock:
+            self.pickled_bytes += nbytes
+
+    def count_result(self, future):
+        if not future.cancelled():
+            self.count(future.exception() or future.result())
+
+    def submit(self, fn, *args):
+        # The workers get the function and its arguments pickled together
+        self.count((fn, args))
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self.count_result)
+        return future
+
+def get_fit_error(file, method, results):
+    # Median relative error of the fitted E0 with respect to the known values
+    errors = []
+    for curve_idx, result in results:
+        if method == "TingFit" and isinstance(result, tuple):
+            result = result[0]
+        E0 = getattr(result, 'E0', None)
+        if E0 is not None:
+            errors.append(abs(E0 - file.get_E0(curve_idx)) / file.get_E0(curve_idx))
+    return float(np.median(errors)) if errors else None
+
+def get_mean_nfev(results):
+    # Mean number of model evaluations of the fits run with the model cache
+    nfevs = []
+    for _, result in results:
+        if type(result) is tuple:
+            result = result[0]
+        nfev = getattr(result, 'nfev', None)
+        if nfev is not None:
+            nfevs.append(nfev)
+    return float(np.mean(nfevs)) if nfevs else None
+
+def run_benchmark(
+    method, size=16, npts=1000, mod_freqs=(1, 10, 100), mod_npts=2000, export_results=True, profile_dir=None,
+    model_cache=True, warm_start=False, nb_files=1, shared_memory=True, memory_budget=None, cluster_agents=None
+):
+    '''
+    Compute nb_files synthetic maps of size x size curves with a method
+    and return a dictionary with the measured performance.
+    If profile_dir is given the cProfile stats of the workers are saved there.
+    If memory_budget is given the maps are computed out-of-core with that budget in MB.
+    If cluster_agents is given the curves are fitted by the agents at these addresses.
+    '''
+    # Curves without fluidity for the Hertz fit
+    betaE = 0 if method == "HertzFit" else 0.2
+    if method not in modulation_methods:
+        mod_freqs = ()
+    # Create a session holding the synthetic files
+    session = Session()
+    for i in range(nb_files):
+        file = SyntheticFile(
+            size, npts, betaE=betaE, mod_freqs=mod_freqs, mod_npts=mod_npts, retract_steps=method == "VDrag", seed=i
+        )
+        if i > 0:
+            file.filemetadata['Entry_filename'] += f'_{i}'
+        session.loaded_files[file.filemetadata['Entry_filename']] = file
+    # The accuracy is measured on the first file, displayed in the widgets
+    file_id, file = next(iter(session.loaded_files.items()))
+    session.current_file = file
+    session.current_curve_index = 0
+    params = get_benchmark_params(method, file)
+    params['profile'] = profile_dir is not None
+    params['model_cache'] = model_cache
+    params['warm_start'] = warm_start
+    params['shared_memory'] = shared_memory
+    params['out_of_core'] = memory_budget is not None
+    params['memory_budget'] = memory_budget
+    params['cluster_agents'] = cluster_agents
+    callback = NullCallback()
+    # Sample the memory used by this case only
+    with RssSampler() as sampler:
+        # Compute all the curves of the map, counting the bytes sent to the workers
+        t0 = time.perf_counter()
+        with compute.get_fit_executor(params) as executor:
+            fit_executor = CountingExecutor(executor)
+            compute.compute(session, params, dict(session.loaded_files), method, callback, callback, callback, fit_executor)
+        compute_time = time.perf_counter() - t0
+        stage_times = get_stage_times(session.profile_stats)
+        results = compute.get_method_to_session_vars(session)[method].get(file_id, [])
+        if profile_dir is not None:
+            session.profile_stats.dump_stats(os.path.join(profile_dir, f'{method}_{size}x{size}_{npts}pts.prof'))
+        # Prepare and write the results as done by the export dialog
+        if export_results:
+            t0 = time.perf_counter()
+            export.prepare_export_results(session, callback, callback, callback)
+            with tempfile.TemporaryDirectory() as dirname:
+                export.export_results(session.prepared_results, dirname, 'benchmark')
+            stage_times['export'] = time.perf_counter() - t0
+    peak_rss, peak_rss_children = sampler.get_peaks()
+    nb_curves = file.filemetadata['Entry_tot_nb_curve'] * nb_files
+    return {
+        'method': method, 'size': f'{size}x{size}', 'npts': npts, 'nb_files': nb_files, 'nb_curves': nb_curves,
+        'nb_errors': sum(1 for _, result in results if isinstance(result, Exception)),
+        'compute_time': compute_time, 'curves_per_second': nb_curves / compute_time,
+        'stage_times': stage_times,
+        'peak_rss_mb': peak_rss, 'peak_rss_children_mb': peak_rss_children,
+        'pickled_bytes': fit_executor.pickled_bytes,
+        'E0_median_rel_error': get_fit_error(file, method, results),
+        'mean_nfev': get_mean_nfev(results), 'memory_usage': session.memory_usage
+    }
+
+def run_fit_overhead(method, npts=1000, nb_curves=20):
+    '''
+    Fit curves of a synthetic map in this process, with and without
+    reusing the lmfit models, and return the fit time per curve in seconds.
+    '''
+    file = SyntheticFile(4, npts, betaE=0 if method == "HertzFit" else 0.2)
+    params = get_benchmark_params(method, file)
+    fdcs = []
+    for curve_idx in range(nb_curves):
+        fdc = file.getcurve(curve_idx % file.filemetadata['Entry_tot_nb_curve'])
+        fdc.preprocess_force_curve(params['def_sens'], params['height_channel'])
+        fdcs.append(fdc)
+    times = {}
+    for model_cache in (False, True):
+        params['model_cache'] = model_cache
+        # Fit a first curve to prepare the cached models
+        compute.analyze_fdc(params, copy.deepcopy(fdcs[0]))
+        curves = copy.deepcopy(fdcs)
+        t0 = time.perf_counter()
+        for fdc in curves:
+            compute.analyze_fdc(params, fdc)
+        times[model_cache] = (time.perf_counter() - t0) / nb_curves
+    return {'method': method, 'npts': npts, 'fit_time': times[False], 'fit_time_model_cache': times[True]}
+
+def format_result(result):
+    stages = ' '.join(f'{stage}={t:.2f}s' for stage, t in result['stage_times'].items())
+    line = (
+        f"{result['method']:<14}{result['size']:>8}{result['npts']:>7} pts{result['nb_files']:>4} files "
+        f"{result['curves_per_second']:9.1f} curves/s  {stages}  "
+        f"pickled={result['pickled_bytes'] / 1e6:.1f}MB"
+    )
+    if result['peak_rss_mb'] is not None:
+        line += f"  peak RSS={result['peak_rss_mb']:.0f}MB (worker {result['peak_rss_children_mb']:.0f}MB)"
+    if result['E0_median_rel_error'] is not None:
+        line += f"  E0 error={100 * result['E0_median_rel_error']:.2f}%"
+    if result['mean_nfev'] is not None:
+        line += f"  nfev={result['mean_nfev']:.1f}"
+    if result['memory_usage'] is not None:
+        line += f"  out-of-core peak={result['memory_usage']['peak_data_mb']:.1f}MB"
+    if result['nb_errors']:
+        line += f"  failed={result['nb_errors']}"
+    return line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the compute pipeline using synthetic force maps.')
+    parser.add_argument('--methods', nargs='+', default=list(methods), choices=methods)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[16], help='curves along each side of the map')
+    parser.add_argument('--points', nargs='+', type=int, default=[1000], help='points of the approach and retract segments')
+    parser.add_argument('--mod-freqs', nargs='+', type=float, default=[1, 10, 100], help='frequencies of the modulation segments')
+    parser.add_argument('--mod-points', type=int, default=2000, help='points of each modulation segment')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--no-export', action='store_true', help='do not benchmark the export of the results')
+    parser.add_argument('--json', help='file to save the results')
+    parser.add_argument('--profile-dir', help='directory to save the cProfile stats of each case')
+    parser.add_argument('--no-model-cache', action='store_true', help='create new lmfit models for each curve')
+    parser.add_argument('--warm-start', action='store_true', help='start the fits from the neighbouring curves')
+    parser.add_argument('--files', type=int, default=1, help='number of maps computed together')
+    parser.add_argument('--no-shared-memory', action='store_true', help='pickle the curves sent to the workers')
+    parser.add_argument('--memory-budget', type=int, help='compute the maps out-of-core with this budget in MB')
+    parser.add_argument('--agents', help='comma separated host:port of the agents fitting the curves')
+    parser.add_argument(
+        '--fit-overhead', action='store_true',
+        help='only compare the fit time per curve with and without reusing the lmfit models'
+    )
+    args = parser.parse_args(argv)
+    results = []
+    if args.fit_overhead:
+        for method in args.methods:
+            if get_method(method).cached_routine is None:
+                continue
+            for npts in args.points:
+                result = run_fit_overhead(method, npts)
+                print(
+                    f"{method:<14}{npts:>7} pts  fit={1e3 * result['fit_time']:.1f}ms/curve  "
+                    f"with model cache={1e3 * result['fit_time_model_cache']:.1f}ms/curve", flush=True
+                )
+                results.append(result)
+        return results
+    for method in args.methods:
+        for size in args.sizes:
+            for npts in args.points:
+                for _ in range(args.repeat):
+                    result = run_benchmark(
+                        method, size, npts, args.mod_freqs, args.mod_points, not args.no_export, args.profile_dir,
+                        not args.no_model_cache, args.warm_start, args.files, not args.no_shared_memory,
+                        args.memory_budget, args.agents
+                    )
+                    print(format_result(result), flush=True)
+                    results.append(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == '__main__':
+    # Use the same start method as the application
+    multiprocessing.set_start_method('spawn')
+    multiprocessing.freeze_support()
+    main()
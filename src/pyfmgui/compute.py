@@ -1,57 +1,148 @@
 # Import for multiprocessing
 import concurrent.futures
 import contextlib
-from functools import partial
+import os
+import time
+import numpy as np
 # Import logging and get global logger
 import logging
 logger = logging.getLogger()
 # Import constants
 import pyfmgui.const as cts
-# Import predefined routines from PyFMRheo
-from pyfmrheo.routines.HertzFit import doHertzFit
-from pyfmrheo.routines.TingFit import doTingFit
-from pyfmrheo.routines.PiezoCharacterization import doPiezoCharacterization
-from pyfmrheo.routines.ViscousDragSteps import doViscousDragSteps
-from pyfmrheo.routines.MicrorheologyFFT import doMicrorheologyFFT
-from pyfmrheo.routines.MicrorheologySine import doMicrorheologySine
+# Import the registry of analysis methods
+from pyfmgui.methods import analysis_methods, get_method
+from pyfmgui.map_geometry import get_map_geometry
+from pyfmgui.scheduler import TaskQueue, iter_results
+from pyfmgui.shared_arrays import SharedMemoryTransport, run_shared_task
+from pyfmgui.memory_budget import MemoryBudget, get_task_nbytes
+from pyfmgui.journal import open_journal
+# Import timing spans
+from pyfmgui import profiling
+from pyfmgui.profiling import span, run_timed
 
 def prepare_map_fdc(file, params, curve_idx):
     try:
         # Do fdc preprocessing
-        fdc_at_indx = file.getcurve(curve_idx)
-        fdc_at_indx.preprocess_force_curve(params['def_sens'], params['height_channel'])
-        if file.filemetadata['file_type'] in cts.jpk_file_extensions:
-            fdc_at_indx.shift_height()
+        with span('getcurve'):
+            fdc_at_indx = file.getcurve(curve_idx)
+        with span('preprocess'):
+            fdc_at_indx.preprocess_force_curve(params['def_sens'], params['height_channel'])
+            if file.filemetadata['file_type'] in cts.jpk_file_extensions:
+                fdc_at_indx.shift_height()
         return fdc_at_indx
     except Exception as error:
         return (file.filemetadata['Entry_filename'], curve_idx, error)
 
 def analyze_fdc(param_dict, fdc):
-    # Create map relating methods to compute routine
-    method_routines = {
-        "HertzFit":doHertzFit,
-        "TingFit":doTingFit,
-        "PiezoChar":doPiezoCharacterization,
-        "VDrag":doViscousDragSteps,
-        "Microrheo":doMicrorheologyFFT,
-        "MicrorheoSine":doMicrorheologySine
-    }
     # Process FDC with routine
     try:
-        routine = method_routines.get(param_dict['method'])
-        return (fdc.file_id, fdc.curve_index, routine(fdc, param_dict))
+        method = get_method(param_dict['method'])
+        routine = method.routine
+        # Reuse the lmfit models prepared in this worker if enabled
+        if param_dict.get('model_cache', True) and method.cached_routine is not None:
+            routine = method.cached_routine
+        with span('fit'):
+            result = routine(fdc, param_dict)
+        return (fdc.file_id, fdc.curve_index, result)
     except Exception as error:
         return (fdc.file_id, fdc.curve_index, error, 'error')
 
+def analyze_fdc_batch(param_dict, fdcs):
+    # Process a list of FDCs with the batch routine of the method
+    try:
+        batch_routine = get_method(param_dict['method']).batch_routine
+        with span('fit'):
+            results = batch_routine(fdcs, param_dict)
+        return [(fdc.file_id, fdc.curve_index, result) for fdc, result in zip(fdcs, results)]
+    except Exception:
+        # Process the curves one by one to get the error of each curve
+        return [analyze_fdc(param_dict, fdc) for fdc in fdcs]
+
+def get_neighbour_seed(seeds, pixel):
+    # Get the median of the params converged in the fitted neighbours of the pixel
+    if pixel is None:
+        return None
+    row, col = pixel
+    neighbours = [
+        seeds[(row + drow, col + dcol)] for drow in (-1, 0, 1) for dcol in (-1, 0, 1)
+        if (row + drow, col + dcol) in seeds
+    ]
+    if not neighbours:
+        return None
+    return {name: float(np.median([seed[name] for seed in neighbours])) for name in neighbours[0]}
+
+def analyze_fdc_tile(param_dict, tile):
+    # Process the FDCs of a tile of the map in order, starting
+    # each fit from the params converged in its neighbours
+    method = get_method(param_dict['method'])
+    # Only the routine reusing the lmfit models takes initial values
+    use_cache = param_dict.get('model_cache', True) and method.cached_routine is not None
+    seeds = {}
+    tile_results = []
+    for pixel, fdc in tile:
+        try:
+            with span('fit'):
+                if use_cache:
+                    result = method.cached_routine(fdc, param_dict, get_neighbour_seed(seeds, pixel))
+                else:
+                    result = method.routine(fdc, param_dict)
+            if pixel is not None:
+                seeds[pixel] = {name: get_value(result) for name, get_value in method.seed_fields.items()}
+            tile_results.append((fdc.file_id, fdc.curve_index, result))
+        except Exception as error:
+            tile_results.append((fdc.file_id, fdc.curve_index, error, 'error'))
+    return tile_results
+
+def get_tile_size(nb_curves):
+    # Use tiles of up to 8x8 curves, keeping about 4 tiles per worker
+    nb_workers = os.cpu_count() or 1
+    return int(np.clip(np.sqrt(nb_curves / (4 * nb_workers)), 2, 8))
+
+def get_tile_layout(geometry, curve_indices):
+    # Group the curves in square tiles of the map, giving the
+    # pixel of each curve to find its neighbours in the tile
+    remaining = set(curve_indices)
+    tile_size = get_tile_size(len(remaining))
+    rows, cols = geometry.curve_coords.shape
+    tiles = []
+    for row0 in range(0, rows, tile_size):
+        for col0 in range(0, cols, tile_size):
+            tile = []
+            for row in range(row0, min(row0 + tile_size, rows)):
+                for col in range(col0, min(col0 + tile_size, cols)):
+                    curve_idx = int(geometry.curve_coords[row, col])
+                    if curve_idx in remaining:
+                        remaining.discard(curve_idx)
+                        tile.append(((row, col), curve_idx))
+            if tile:
+                tiles.append(tile)
+    # Curves not found in the map are fitted without neighbours
+    tiles.extend([[(None, curve_idx)] for curve_idx in sorted(remaining)])
+    return tiles
+
+def get_map_tiles(geometry, fdc_to_process):
+    # Get the tiles of the map with the FDC of each pixel
+    fdc_by_index = {fdc.curve_index: fdc for fdc in fdc_to_process}
+    return [
+        [(pixel, fdc_by_index[curve_idx]) for pixel, curve_idx in tile]
+        for tile in get_tile_layout(geometry, fdc_by_index.keys())
+    ]
+
+def get_fit_tasks(params, fdc_to_process, geometry=None):
+    method_info = get_method(params['method'])
+    # Fit the map by tiles if the fits should start from the neighbouring curves
+    if params.get('warm_start', False) and geometry is not None and method_info.seed_fields:
+        return [(analyze_fdc_tile, tile) for tile in get_map_tiles(geometry, fdc_to_process)]
+    # Send the curves in batches if the method has a batch routine
+    if method_info.batch_routine is None:
+        return [(analyze_fdc, fdc) for fdc in fdc_to_process]
+    batch_size = method_info.batch_size
+    return [
+        (analyze_fdc_batch, fdc_to_process[i:i+batch_size]) for i in range(0, len(fdc_to_process), batch_size)
+    ]
+
 def get_method_to_session_vars(session):
-    return {
-        "HertzFit":session.hertz_fit_results,
-        "TingFit":session.ting_fit_results,
-        "PiezoChar":session.piezo_char_results,
-        "VDrag":session.vdrag_results,
-        "Microrheo":session.microrheo_results,
-        "MicrorheoSine":session.microrheo_results
-    }
+    return {name: getattr(session, method.session_var) for name, method in analysis_methods.items()}
 
 def clear_file_results(session, method, file_id):
     # Create map relating methods to where they should be saved in the session
@@ -64,7 +155,10 @@ def clear_file_results(session, method, file_id):
         return
     # Remove results for file
     if file_id in session_save_var:
-        session_save_var.pop(file_id)
+        file_results = session_save_var.pop(file_id)
+        # Delete the results stored on disk
+        if hasattr(file_results, 'delete'):
+            file_results.delete()
 
 def save_file_results(session, params, file_results):
     # Create map relating methods to where they should be saved in the session
@@ -86,10 +180,22 @@ def save_file_results(session, params, file_results):
         else:
             session_save_var[file_id] = [(curve_idx, analysis_result)]
 
-def process_sfc(session, params, filedict, method, progress_callback, range_callback, step_callback):
+def get_fit_executor(params, fit_executor=None):
+    # Use the executor given, left running, else the agents of the
+    # cluster given in the params or a new pool of processes
+    if fit_executor is not None:
+        return contextlib.nullcontext(fit_executor)
+    if params.get('cluster_agents'):
+        # Import the cluster only when it is used
+        from pyfmgui.distributed import ClusterExecutor, get_agent_addresses
+        return ClusterExecutor(get_agent_addresses(params['cluster_agents']))
+    return concurrent.futures.ProcessPoolExecutor()
+
+def process_sfc(session, params, filedict, method, progress_callback, range_callback, step_callback, fit_executor=None):
     # Get curves to process for each file to process
     file_ids = filedict.keys()
     fdc_to_process = []
+    profile = params.get('profile', False)
     step_callback.emit('Step 1/2: Preprocessing')
     for file_id in file_ids:
         # Get fileid
@@ -100,11 +206,13 @@ def process_sfc(session, params, filedict, method, progress_callback, range_call
         curve_idx = session.current_curve_index
         try:
             # Get force distance curve at index
-            fdc_at_indx = file.getcurve(curve_idx)
+            with span('getcurve'):
+                fdc_at_indx = file.getcurve(curve_idx)
             # Do fdc preprocessing
-            fdc_at_indx.preprocess_force_curve(params['def_sens'], params['height_channel'])
-            if session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
-                fdc_at_indx.shift_height()
+            with span('preprocess'):
+                fdc_at_indx.preprocess_force_curve(params['def_sens'], params['height_channel'])
+                if session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
+                    fdc_at_indx.shift_height()
             fdc_to_process.append(fdc_at_indx)
         except Exception as error:
             logger.info(f"Failed to preprocess curve {curve_idx} in file {file.filemetadata['Entry_filename']}: {error}")
@@ -114,76 +222,324 @@ def process_sfc(session, params, filedict, method, progress_callback, range_call
     count = 0
     range_callback.emit(len(fdc_to_process))
     step_callback.emit('Step 2/2: Computing')
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        futures = [executor.submit(analyze_fdc, params, fdc) for fdc in fdc_to_process]
+    with get_fit_executor(params, fit_executor) as executor:
+        # Keep the submission time of each task to know how long it waited
+        futures = {
+            executor.submit(run_timed, profile, routine, params, task): time.time()
+            for routine, task in get_fit_tasks(params, fdc_to_process)
+        }
         with contextlib.suppress(concurrent.futures.TimeoutError):
             for future in concurrent.futures.as_completed(futures):
-                file_results.append(future.result())
-                count+=1
+                task_results, timing = future.result()
+                profiling.record_task(futures[future], timing)
+                # Batch tasks return the results of several curves
+                if type(task_results) is not list:
+                    task_results = [task_results]
+                file_results.extend(task_results)
+                count+=len(task_results)
                 progress_callback.emit(count)
     # Save results
-    save_file_results(session, params, file_results)
+    with span('save'):
+        save_file_results(session, params, file_results)
+
+class FitTaskBuilder:
+    '''
+    Groups the curves of a file in fit tasks as they are preprocessed,
+    as done by get_fit_tasks once all the curves are available. A tile
+    is ready when all its curves are preprocessed or failed, and is fitted
+    in the order of its pixels.
+
+    :param params: analysis params
+    :param nb_curves: number of curves of the file
+    :param geometry: MapGeometry of the file, used to fit the map by tiles
+    '''
+    def __init__(self, params, nb_curves, geometry=None):
+        method_info = get_method(params['method'])
+        self.batch_size = None
+        self.batch = []
+        self.tiles = None
+        if params.get('warm_start', False) and geometry is not None and method_info.seed_fields:
+            self.tiles = get_tile_layout(geometry, range(nb_curves))
+            self.tile_of_curve = {
+                curve_idx: (tile_idx, order)
+                for tile_idx, tile in enumerate(self.tiles) for order, (_, curve_idx) in enumerate(tile)
+            }
+            self.tile_fdcs = [[None] * len(tile) for tile in self.tiles]
+            self.tile_missing = [len(tile) for tile in self.tiles]
+        elif method_info.batch_routine is not None:
+            self.batch_size = method_info.batch_size
+
+    def get_read_order(self, nb_curves):
+        # Read the curves tile by tile, so that each tile is fitted as soon as possible
+        if self.tiles is None:
+            return range(nb_curves)
+        return [curve_idx for tile in self.tiles for _, curve_idx in tile]
 
-def process_maps(session, params, filedict, method, progress_callback, range_callback, step_callback):
-    # Process files and curves
-    for file_id, file in filedict.items():
-        logger.info(f"Processing file: {file_id}")
+    def add(self, curve_idx, fdc=None):
+        # Add a preprocessed FDC, or None if it failed, and get the tasks ready to run
+        if self.tiles is not None:
+            tile_idx, order = self.tile_of_curve[curve_idx]
+            self.tile_fdcs[tile_idx][order] = fdc
+            self.tile_missing[tile_idx] -= 1
+            if self.tile_missing[tile_idx] > 0:
+                return []
+            # Keep the order of the pixels of the tile
+            tile = [
+                (pixel, fdc) for (pixel, _), fdc in zip(self.tiles[tile_idx], self.tile_fdcs[tile_idx])
+                if fdc is not None
+            ]
+            self.tile_fdcs[tile_idx] = None
+            return [(analyze_fdc_tile, tile)] if tile else []
+        if fdc is None:
+            return []
+        if self.batch_size is None:
+            return [(analyze_fdc, fdc)]
+        self.batch.append(fdc)
+        if len(self.batch) < self.batch_size:
+            return []
+        return self.flush()
+
+    def flush(self):
+        # Get the last batch once all the curves are preprocessed
+        tasks = [(analyze_fdc_batch, self.batch)] if self.batch else []
+        self.batch = []
+        return tasks
+
+class FileJob:
+    '''
+    State of a force map file processed by process_maps.
+
+    :param file_id: id of the file in the session
+    :param file: file to process
+    :param priority: position of the file in the queues, lower first
+    :param task_builder: FitTaskBuilder grouping the curves of the file
+    :param store: StoredFileResults where the results are written in
+                  out-of-core mode, None to keep them in the session
+    '''
+    def __init__(self, file_id, file, priority, task_builder, store=None):
+        self.file_id = file_id
+        self.file = file
+        self.priority = priority
+        self.task_builder = task_builder
+        self.store = store
+        self.nb_curves = file.filemetadata['Entry_tot_nb_curve']
+        self.to_read = self.nb_curves
+        self.fits_pending = 0
+        self.errors = []
+        self.results = []
+
+    def is_done(self):
+        return self.to_read == 0 and self.fits_pending == 0
+
+def get_file_priority(session, file_order, file):
+    # Process the files displayed in the widgets first, then in order
+    return (0 if file is session.current_file else 1, file_order)
+
+def get_max_pending_tasks(fit_executor=None):
+    # Keep enough tasks in the workers to never leave a core idle,
+    # without sending the curves of all the files at once. A cluster
+    # tells the number of tasks its agents run at once.
+    capacity = getattr(fit_executor, 'capacity', None)
+    if capacity:
+        return 2 * capacity
+    return 4 * (os.cpu_count() or 1)
+
+def get_read_threads():
+    # Reading waits on the disk and the decompression releases the GIL,
+    # a few threads are enough to keep the fit workers busy
+    return 4
+
+def get_result_chunk_size():
+    # Number of curve results written at once in out-of-core mode
+    return 512
+
+def write_job_results(job):
+    # Write the results of a file processed out-of-core to its store
+    for file_result in job.results:
+        if 'error' in file_result:
+            logger.info(f"Failed to process curve {file_result[1]} in file {file_result[0]}: {file_result[2]}")
+    with span('save'):
+        job.store.append([(file_result[1], file_result[2]) for file_result in job.results])
+    job.results = []
+
+def finish_file_job(session, params, job):
+    # Save the results of a file once all its curves are processed
+    if job.store is not None:
+        job.results.extend(job.errors)
+        write_job_results(job)
+        logger.info(f"Completed file: {job.file_id}")
+        return
+    for file_result in job.results:
+        if 'error' in file_result:
+            logger.info(f"Failed to process curve {file_result[1]} in file {file_result[0]}: {file_result[2]}")
+    # Extend file results with the errors encountered in preprocessing
+    job.results.extend(job.errors)
+    with span('save'):
+        save_file_results(session, params, job.results)
+    logger.info(f"Completed file: {job.file_id}")
+    job.results = []
+
+def process_maps(session, params, filedict, method, progress_callback, range_callback, step_callback, fit_executor=None):
+    '''
+    Read and preprocess the curves of all the files with a pool of threads
+    and fit them with a pool of processes. The fits of the curves read are
+    queued as soon as they are available and reading pauses while enough
+    fits wait, so that both stages run at the same time. The tasks of
+    the files displayed in the widgets go first and the results of each
+    file are saved as soon as its curves are done.
+
+    In out-of-core mode reading also pauses while the curves in process
+    exceed the memory budget, and the results are written to the result
+    store of the session by chunks instead of being kept in memory.
+
+    The results are checkpointed to a journal, deleted when the run
+    completes. When resuming the journal of an interrupted run, its
+    results are restored and only the missing curves are computed.
+    '''
+    profile = params.get('profile', False)
+    budget = MemoryBudget(params.get('memory_budget', 1024)) if params.get('out_of_core', False) else None
+    journal, restored_results = open_journal(method, params, filedict)
+    jobs = {}
+    for file_order, (file_id, file) in enumerate(filedict.items()):
         # Delete previous results for the file
         clear_file_results(session, method, file_id)
-        # Prepare all fdc to process
-        fdc_to_process = []
-        errors = []
-        # Prepare curves
-        # Not sure if paralelization helps much, it is mostly limited
-        # by file access (opening / closing file)
-        raw_fdc_to_process = []
-        count = 0
-        nb_curves = file.filemetadata['Entry_tot_nb_curve']
-        range_callback.emit(nb_curves)
-        step_callback.emit('Step 1/2: Preprocessing')
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            futures = [executor.submit(prepare_map_fdc, file, params, curveidx) for curveidx in range(nb_curves)]
-            with contextlib.suppress(concurrent.futures.TimeoutError):
-                for future in concurrent.futures.as_completed(futures):
-                    raw_fdc_to_process.append(future.result())
-                    count+=1
-                    progress_callback.emit(count)
-        # Check for errors
-        for item in raw_fdc_to_process:
-            if type(item) is tuple:
-                errors.append(item)
-                logger.info(f"Failed to preprocess curve {item[1]} in file {item[0]}: {item[2]}")
-            else: fdc_to_process.append(item)
-        progress_callback.emit(0)
-        # Process curves
-        file_results = []
-        count = 0
-        range_callback.emit(len(fdc_to_process))
-        step_callback.emit('Step 2/2: Computing')
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            # file_results = executor.map(partial(analyze_fdc, params), fdc_to_process)
-            futures = [executor.submit(analyze_fdc, params, fdc) for fdc in fdc_to_process]
-            with contextlib.suppress(concurrent.futures.TimeoutError):
-                for future in concurrent.futures.as_completed(futures):
-                    file_results.append(future.result())
-                    count+=1
-                    progress_callback.emit(count)
-        file_results = list(file_results)
-        for file_result in file_results:
-            if 'error' in file_result:
-                logger.info(f"Failed to process curve {file_result[1]} in file {file_result[0]}: {file_result[2]}")
-        # Extend file results with the errors encountered in preprocessing
-        file_results.extend(errors)
-        # Save results
-        save_file_results(session, params, file_results)
-        # Reset pbar
-        progress_callback.emit(0)
+        task_builder = FitTaskBuilder(params, file.filemetadata['Entry_tot_nb_curve'], get_map_geometry(session, file))
+        store = None
+        if budget is not None:
+            # The results written are available in the session while computing
+            store = session.result_store.create(method, file_id)
+            get_method_to_session_vars(session)[method][file_id] = store
+        job = FileJob(file_id, file, get_file_priority(session, file_order, file), task_builder, store)
+        # Restore the results of the curves computed before the run was interrupted
+        for curve_idx, result in restored_results.get(file_id, {}).items():
+            job.results.append((file_id, curve_idx, result))
+            job.task_builder.add(curve_idx)
+            job.to_read -= 1
+        jobs[file_id] = job
+    # Each curve is preprocessed and then fitted
+    count = 2 * sum(len(curve_results) for curve_results in restored_results.values())
+    range_callback.emit(2 * sum(job.nb_curves for job in jobs.values()))
+    step_callback.emit('Step 1/2: Preprocessing')
+    nb_reading = len(jobs)
+    # Send the arrays of the curves to the workers through shared memory.
+    # The blocks left are released when leaving, after the workers stop.
+    # The agents of a cluster run on other machines, they get the arrays pickled
+    if fit_executor is None:
+        remote = bool(params.get('cluster_agents'))
+    else:
+        remote = getattr(fit_executor, 'remote', False)
+    transport = SharedMemoryTransport() if params.get('shared_memory', True) and not remote else None
+    # The reading threads record their spans in the recorder of the computation
+    recorder = profiling.current_recorder.get()
+    with transport or contextlib.nullcontext(), journal or contextlib.nullcontext(), \
+            concurrent.futures.ThreadPoolExecutor(get_read_threads()) as read_executor, \
+            get_fit_executor(params, fit_executor) as fit_executor:
+        max_pending = get_max_pending_tasks(fit_executor)
+        fit_queue = TaskQueue(fit_executor, max_pending, transport=transport)
+        # Pause reading while the curves in process and being read exceed the memory
+        # budget, unless no reads or fits are left to free memory, a tile needs all its curves
+        gate = None
+        if budget is not None:
+            gate = lambda: budget.is_exceeded(len(read_queue.pending)) and bool(
+                read_queue.pending or fit_queue.pending or fit_queue.queue
+            )
+        # The curves read wait in the fit queue, limit them to a round of fits
+        read_queue = TaskQueue(read_executor, 2 * get_read_threads(), fit_queue, max_pending, gate=gate)
+        for job in sorted(jobs.values(), key=lambda job: job.priority):
+            logger.info(f"Processing file: {job.file_id}")
+            restored_curves = restored_results.get(job.file_id, {})
+            for curveidx in job.task_builder.get_read_order(job.nb_curves):
+                if curveidx not in restored_curves:
+                    read_queue.put(
+                        job.priority, (job.file_id, curveidx), profiling.run_recorded, recorder,
+                        prepare_map_fdc, job.file, params, curveidx
+                    )
+            if job.to_read == 0:
+                nb_reading -= 1
+                finish_file_job(session, params, job)
+        # Read tasks are tagged with the file and the curve index,
+        # fit tasks with the file and the bytes of their curves
+        for task_queue, (file_id, tag_value), task_results, submit_time in iter_results([read_queue, fit_queue]):
+            job = jobs[file_id]
+            if task_queue is read_queue:
+                curveidx = tag_value
+                # Check for errors
+                if type(task_results) is tuple:
+                    job.errors.append(task_results)
+                    logger.info(f"Failed to preprocess curve {task_results[1]} in file {task_results[0]}: {task_results[2]}")
+                    # The curve will not be fitted
+                    count += 1
+                    fit_tasks = job.task_builder.add(curveidx)
+                else:
+                    fit_tasks = job.task_builder.add(curveidx, task_results)
+                    if budget is not None:
+                        budget.add(get_task_nbytes(task_results))
+                        # Fit the curves of an incomplete batch instead of reading past the budget
+                        if budget.is_exceeded(len(read_queue.pending)):
+                            fit_tasks += job.task_builder.flush()
+                job.to_read -= 1
+                count += 1
+                if job.to_read == 0:
+                    fit_tasks += job.task_builder.flush()
+                    nb_reading -= 1
+                    if nb_reading == 0:
+                        step_callback.emit('Step 2/2: Computing')
+                for routine, task in fit_tasks:
+                    nbytes = get_task_nbytes(task) if budget is not None else 0
+                    fit_queue.put(
+                        job.priority, (file_id, nbytes), run_timed, profile, run_shared_task, routine, params, task
+                    )
+                job.fits_pending += len(fit_tasks)
+            else:
+                task_results, timing = task_results
+                profiling.record_task(submit_time, timing)
+                # Batch tasks return the results of several curves
+                if type(task_results) is not list:
+                    task_results = [task_results]
+                job.results.extend(task_results)
+                job.fits_pending -= 1
+                count += len(task_results)
+                if journal is not None:
+                    journal.append(task_results)
+                if budget is not None:
+                    # Free the curves fitted and write the results by chunks
+                    budget.remove(tag_value)
+                    if len(job.results) >= get_result_chunk_size():
+                        write_job_results(job)
+            if budget is not None:
+                budget.sample_rss()
+            progress_callback.emit(count)
+            if job.is_done():
+                finish_file_job(session, params, job)
+    if budget is not None:
+        session.memory_usage = budget.get_report()
+        logger.info(budget.format_report())
+    # Reset pbar
+    progress_callback.emit(0)
 
-def compute(session, params, filedict, method, progress_callback, range_callback, step_callback):
+def compute(session, params, filedict, method, progress_callback, range_callback, step_callback, fit_executor=None):
+    '''
+    Compute the method for the files. The curves are fitted in fit_executor
+    if given, as done by the job server, else on the agents given in the
+    cluster_agents param or in a new pool of processes.
+    If the job_server param is set the files are computed by that server.
+    '''
+    if params.get('job_server'):
+        # Import the client only when a job server is used
+        from pyfmgui.job_client import run_on_job_server
+        run_on_job_server(session, params, filedict, method, progress_callback, range_callback, step_callback)
+        return
     # Check if the file is a force map
     fv_flag = any(file.isFV for file in filedict.values())
-    # Call the proper method to process the file
-    if not params['compute_all_curves'] or not fv_flag:
-        process_sfc(session, params, filedict, method, progress_callback, range_callback, step_callback)
-    else:
-        process_maps(session, params, filedict, method, progress_callback, range_callback, step_callback)
+    # Drop the spans recorded outside of a computation, like the fits of the plots
+    profiling.pop_spans()
+    # Call the proper method to process the file, recording the spans
+    # apart from the other computations running in this process
+    with profiling.recording() as recorder:
+        if not params['compute_all_curves'] or not fv_flag:
+            process_sfc(session, params, filedict, method, progress_callback, range_callback, step_callback, fit_executor)
+        else:
+            process_maps(session, params, filedict, method, progress_callback, range_callback, step_callback, fit_executor)
+    # Summarize the time spent in each stage
+    session.profile_stats = recorder.collect()
+    logger.info(f'Timing summary for {method}:\n{session.profile_stats.format_summary()}')
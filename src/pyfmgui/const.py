@@ -11,6 +11,11 @@ pyFM_VERSION = "PyFMLab v.1.0.2"
 # FILE CONSTANTS ##################################################
 jpk_file_extensions = ('jpk-force', 'jpk-force-map', 'jpk-qi-data')
 nanoscope_file_extensions = ('spm', 'pfc')
+# Glob patterns of the files loaded from a folder
+dataset_file_patterns = (
+    '*.jpk-force', '*.jpk-force-map', '*.jpk-qi-data', '*.jpk-force.zip', '*.jpk-force-map.zip',
+    '*.jpk-qi-data.zip', '*.spm', '*.pfc', '*.tdms'
+)
 
 # ANALYSIS CONSTANTS ##############################################
 available_geometries = ['paraboloid', 'cone', 'pyramid']
@@ -103,6 +108,8 @@ class HertzFitParams(pTypes.GroupParameter):
             {'name': 'Max Force', 'type': 'float', 'value': None, 'units':'nN'},
             {'name': 'Downsample Signal', 'type': 'bool', 'value':False},
             {'name': 'Downsample Pts.', 'type': 'int', 'value': 300},
+            {'name': 'Adaptive Downsample', 'type': 'bool', 'value':False},
+            {'name': 'Downsample Tol.', 'type': 'float', 'value': 1, 'units':'%'},
             {'name': 'Auto Init E0', 'type': 'bool', 'value':True},
             {'name': 'Init E0', 'type': 'int', 'value': 1000, 'units':'Pa'},
             {'name': 'Init d0', 'type': 'float', 'value': 0, 'units':'nm'},
@@ -177,6 +184,7 @@ class TingFitParams(pTypes.GroupParameter):
             {'name': 'Estimate V0t & V0r', 'type': 'bool', 'value': False},
             {'name': 't0', 'type': 'int', 'value': 1, 'units':'s'},
             {'name': 'Downsample Pts.', 'type': 'int', 'value': 300},
+            {'name': 'Downsample Hertz Fit', 'type': 'bool', 'value':False},
             {'name': 'Fit Line to non contact', 'type': 'bool', 'value':False},
             {'name': 'Init Slope', 'type': 'float', 'value': 0},
             {'name': 'Init d0', 'type': 'float', 'value': 0, 'units':'nm'},
@@ -286,7 +294,16 @@ class CantileverParams(pTypes.GroupParameter):
 
 general_params = {'name': 'General Options', 'type': 'group', 'children': [
         {'name': 'Compute All Curves', 'type': 'bool', 'value': False},
-        {'name': 'Compute All Files', 'type': 'bool', 'value': False}
+        {'name': 'Compute All Files', 'type': 'bool', 'value': False},
+        {'name': 'Profile Computation', 'type': 'bool', 'value': False},
+        {'name': 'Reuse Fit Models', 'type': 'bool', 'value': True},
+        {'name': 'Warm Start Fits', 'type': 'bool', 'value': False},
+        {'name': 'Shared Memory Transport', 'type': 'bool', 'value': True},
+        {'name': 'Out-of-core Processing', 'type': 'bool', 'value': False},
+        {'name': 'Memory Budget', 'type': 'int', 'value': 1024, 'limits': (64, None), 'units': 'MB'},
+        {'name': 'Job Server', 'type': 'str', 'value': ''},
+        {'name': 'Job Priority', 'type': 'int', 'value': 0},
+        {'name': 'Cluster Agents', 'type': 'str', 'value': ''}
     ]}
 
 plot_params = {'name': 'Display Options', 'type': 'group', 'children': [
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import numpy as np
+
+# Rolling average detrending of the modulation segments. Gives
+# the same signals as pyfmrheo's detrend_rolling_average, computing
+# the centered rolling means with cumulative sums over all the
+# signals with the same length and window at once.
+
+def get_points_per_period(frequency, nb_points, time):
+    # Number of points of a period of the modulation
+    sampling_rate = nb_points / np.amax(time)
+    return int(np.round(1 / frequency * sampling_rate))
+
+def rolling_mean_valid(signals, window):
+    # Means of the windows of window points fully inside the signals,
+    # the signals are stacked along the first axis
+    cumsum = np.zeros((signals.shape[0], signals.shape[1] + 1))
+    np.cumsum(signals, axis=-1, out=cumsum[:, 1:])
+    return (cumsum[:, window:] - cumsum[:, :-window]) / window
+
+def detrend_signals(signals, window):
+    '''
+    Detrend a stack of signals of the same length subtracting a centered
+    rolling average forwards and then backwards, as done by
+    detrend_rolling_average with pandas. Only the points where both
+    averages are defined are returned, from window - 1 to n - window.
+    '''
+    # Remove the mean to keep the precision of the cumulative sums
+    signals = signals - signals.mean(axis=-1, keepdims=True)
+    nb_points = signals.shape[-1]
+    # The forward window of point i spans i - window // 2 to i + window - 1 - window // 2
+    left = window // 2
+    right = window - 1 - left
+    detrended = signals[:, left:nb_points - right] - rolling_mean_valid(signals, window)
+    # The backward window is mirrored
+    return detrended[:, right:detrended.shape[-1] - left] - rolling_mean_valid(detrended, window)
+
+def detrend_segments(segments):
+    '''
+    Detrend the in and out signals of several modulation segments.
+
+    :param segments: list of (frequency, in_signal, out_signal, time) tuples
+    :return: list of (detrended in_signal, detrended out_signal, time) tuples
+    '''
+    from scipy.signal import detrend
+    results = [None] * len(segments)
+    # Group the segments by length and window
+    groups = {}
+    for i, (frequency, in_signal, out_signal, time) in enumerate(segments):
+        nb_points = len(in_signal)
+        window = get_points_per_period(frequency, nb_points, time)
+        if window < 1 or nb_points - 2 * window + 2 <= 0:
+            # Too short to detrend with the rolling average
+            results[i] = (detrend(in_signal), detrend(out_signal), time)
+            continue
+        groups.setdefault((nb_points, window), []).append(i)
+    for (nb_points, window), group in groups.items():
+        signals = np.vstack([np.vstack([segments[i][1], segments[i][2]]) for i in group])
+        detrended = detrend_signals(signals, window)
+        for j, i in enumerate(group):
+            time = segments[i][3]
+            results[i] = (detrended[2*j], detrended[2*j+1], time[window - 1:nb_points - window + 1])
+    return results
+
+class DetrendCache:
+    '''
+    Least recently used cache of the detrended zheight and deflection
+    of the modulation segments displayed in the widgets.
+
+    :param maxsize: maximum number of segments kept in the cache
+    '''
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.segments = OrderedDict()
+
+    def clear(self):
+        self.segments.clear()
+
+    def get_detrended_segments(self, file_id, curve_idx, defl_sens, height_channel, segments):
+        '''
+        Get the detrended signals of a list of (seg_id, segment) modulation segments.
+
+        Returns a list with a (zheight, deflection, time) tuple per segment.
+        '''
+        keys = [(file_id, curve_idx, seg_id, defl_sens, height_channel) for seg_id, _ in segments]
+        missing = []
+        for key, (_, segment) in zip(keys, segments):
+            if key in self.segments:
+                self.segments.move_to_end(key)
+            else:
+                missing.append((key, segment))
+        detrended = detrend_segments([
+            (segment.segment_metadata['frequency'], segment.zheight, segment.vdeflection, segment.time)
+            for _, segment in missing
+        ])
+        for (key, _), result in zip(missing, detrended):
+            self.segments[key] = result
+        results = [self.segments[key] for key in keys]
+        # Drop the least recently used segments
+        while len(self.segments) > self.maxsize:
+            self.segments.popitem(last=False)
+        return results
@@ -0,0 +1,341 @@
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import socket
+import threading
+from multiprocessing.connection import Client, Listener
+# Import logging and get global logger
+import logging
+logger = logging.getLogger()
+
+# Execution of the fit tasks on several machines. An agent runs on each
+# machine with a pool of processes and waits for a coordinator, the
+# ClusterExecutor created by compute, to connect over TCP. The files are
+# read and the curves preprocessed on the coordinator, the agents only
+# receive the fit tasks. The objects shared by the tasks, like the
+# analysis params, are sent once to each agent and then referenced.
+#
+# The messages are pickled, which allows running any code on the agent:
+# the connections are authenticated with the key in the environment
+# variable PYFMGUI_CLUSTER_KEY, which must be the same on all machines.
+
+default_port = 8766
+authkey_variable = 'PYFMGUI_CLUSTER_KEY'
+# Seconds between two messages of an agent telling it is alive
+heartbeat_interval = 5.0
+# Seconds without messages after which an agent is considered lost
+agent_timeout = 30.0
+# Times a task is sent again after losing the agents computing it
+max_retries = 2
+
+def get_authkey():
+    authkey = os.environ.get(authkey_variable)
+    if not authkey:
+        raise ValueError(f'Set the key of the cluster in the {authkey_variable} environment variable')
+    return authkey.encode()
+
+def get_agent_address(address):
+    # The address is host:port, or only the host of an agent on the default port
+    host, _, port = address.strip().rpartition(':')
+    if not host:
+        return (port, default_port)
+    return (host, int(port))
+
+def get_agent_addresses(addresses):
+    '''
+    Get the (host, port) of the agents in a string of comma separated addresses.
+    '''
+    return [get_agent_address(address) for address in addresses.split(',') if address.strip()]
+
+class AgentConnection:
+    '''
+    Connection of the coordinator to an agent.
+
+    :param address: (host, port) of the agent
+    :param conn: authenticated connection to the agent
+    :param capacity: tasks sent to the agent at once
+    '''
+    def __init__(self, address, conn, capacity):
+        self.address = address
+        self.conn = conn
+        self.capacity = capacity
+        self.running = set()
+        # Keys of the shared objects already sent
+        self.shared = set()
+        self.alive = True
+
+    @property
+    def name(self):
+        return '{}:{}'.format(*self.address)
+
+class ClusterExecutor(concurrent.futures.Executor):
+    '''
+    Executor running the tasks on the agents of a cluster. The tasks
+    are sent to the agent with the most room left and the tasks of an
+    agent lost are sent again to the others.
+
+    :param addresses: (host, port) of the agents
+    :param authkey: key of the cluster, read from the environment by default
+    :param timeout: seconds without messages after which an agent is lost
+    '''
+    # The tasks run on other machines
+    remote = True
+
+    def __init__(self, addresses, authkey=None, timeout=agent_timeout):
+        authkey = authkey or get_authkey()
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        # Task id -> [future, fn, args, nb_tries]
+        self.tasks = {}
+        self.queue = collections.deque()
+        self.task_ids = itertools.count()
+        # Shared objects by id, kept referenced so that their ids are not reused
+        self.shared_objects = {}
+        self.closed = False
+        self.agents = []
+        for address in addresses:
+            try:
+                conn = Client(address, authkey=authkey)
+                _, capacity, hostname = conn.recv()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as error:
+                logger.info(f'Could not connect to agent {address}: {error}')
+                continue
+            logger.info(f'Connected to agent {hostname} at {address} running {capacity} tasks')
+            self.agents.append(AgentConnection(address, conn, capacity))
+        if not self.agents:
+            raise ConnectionError('Could not connect to any agent of the cluster')
+        for agent in self.agents:
+            threading.Thread(target=self.receive, args=(agent,), daemon=True).start()
+
+    @property
+    def capacity(self):
+        # Tasks run at once by the agents left
+        return sum(agent.capacity for agent in self.agents if agent.alive)
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('Cannot submit tasks after shutdown')
+            if not any(agent.alive for agent in self.agents):
+                raise ConnectionError('All the agents of the cluster were lost')
+            task_id = next(self.task_ids)
+            self.tasks[task_id] = [future, fn, args, 0]
+            self.queue.append(task_id)
+            self.dispatch()
+        return future
+
+    def get_shared_key(self, value):
+        # Small immutable values are sent with the tasks
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return None
+        key, _ = self.shared_objects.setdefault(id(value), (len(self.shared_objects), value))
+        return key
+
+    def send_task(self, agent, task_id):
+        # All the arguments but the last, the curves, are shared between tasks
+        _, fn, args, _ = self.tasks[task_id]
+        refs = []
+        for value in args[:-1]:
+            key = self.get_shared_key(value)
+            if key is not None and key not in agent.shared:
+                agent.conn.send(('share', key, value))
+                agent.shared.add(key)
+            refs.append(('ref', key) if key is not None else ('value', value))
+        agent.conn.send(('task', task_id, fn, refs, args[-1]))
+
+    def dispatch(self):
+        # Send the queued tasks to the agents with the most room left
+        with self.lock:
+            while self.queue:
+                agents = [agent for agent in self.agents if agent.alive and len(agent.running) < agent.capacity]
+                if not agents:
+                    return
+                agent = min(agents, key=lambda agent: len(agent.running) / agent.capacity)
+                task_id = self.queue.popleft()
+                task = self.tasks[task_id]
+                # Only the first try starts the future, skip the cancelled tasks
+                if task[3] == 0 and not task[0].set_running_or_notify_cancel():
+                    del self.tasks[task_id]
+                    continue
+                task[3] += 1
+                agent.running.add(task_id)
+                try:
+                    self.send_task(agent, task_id)
+                except (OSError, ValueError) as error:
+                    self.agent_lost(agent, error)
+                except Exception as error:
+                    # The task can not be pickled
+                    agent.running.discard(task_id)
+                    del self.tasks[task_id]
+                    task[0].set_exception(error)
+
+    def receive(self, agent):
+        # Get the results of the tasks sent to an agent until it is lost
+        try:
+            while True:
+                if not agent.conn.poll(self.timeout):
+                    raise TimeoutError(f'No message for {self.timeout}s')
+                message = agent.conn.recv()
+                if message[0] == 'result':
+                    self.task_done(agent, message[1], result=message[2])
+                elif message[0] == 'error':
+                    self.task_done(agent, message[1], error=message[2])
+        except Exception as error:
+            # Does nothing if the connection was closed by shutdown
+            self.agent_lost(agent, error)
+
+    def task_done(self, agent, task_id, result=None, error=None):
+        with self.lock:
+            agent.running.discard(task_id)
+            task = self.tasks.pop(task_id, None)
+            self.dispatch()
+        if task is None:
+            return
+        if error is not None:
+            task[0].set_exception(error)
+        else:
+            task[0].set_result(result)
+
+    def agent_lost(self, agent, error):
+        failed = []
+        with self.lock:
+            if not agent.alive:
+                return
+            agent.alive = False
+            logger.info(f'Lost agent {agent.name} running {len(agent.running)} tasks: {error!r}')
+            agent.conn.close()
+            # Send the tasks of the agent again, first, unless they were tried too many times
+            for task_id in sorted(agent.running, reverse=True):
+                if self.tasks[task_id][3] > max_retries:
+                    failed.append(self.tasks.pop(task_id))
+                else:
+                    self.queue.appendleft(task_id)
+            agent.running.clear()
+            if not any(agent.alive for agent in self.agents):
+                failed.extend(self.tasks.pop(task_id) for task_id in self.queue)
+                self.queue.clear()
+            self.dispatch()
+        for future, _, _, _ in failed:
+            future.set_exception(ConnectionError(f'Lost the agents computing the task: {error!r}'))
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.lock:
+            self.closed = True
+            if cancel_futures:
+                for task_id in self.queue:
+                    self.tasks.pop(task_id)[0].cancel()
+                self.queue.clear()
+            futures = [task[0] for task in self.tasks.values()]
+        if wait:
+            concurrent.futures.wait(futures)
+        for agent in self.agents:
+            if agent.alive:
+                agent.alive = False
+                try:
+                    agent.conn.send(('close',))
+                except OSError:
+                    pass
+                agent.conn.close()
+
+class ClusterAgent:
+    '''
+    Agent computing the tasks sent by the coordinators in a pool of processes.
+
+    :param address: (host, port) to listen to
+    :param authkey: key of the cluster, read from the environment by default
+    :param max_workers: processes of the pool, one per core by default
+    '''
+    def __init__(self, address, authkey=None, max_workers=None):
+        self.listener = Listener(address, authkey=authkey or get_authkey())
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+        # Keep a couple of tasks per process so that they never wait for the network
+        self.capacity = 2 * (max_workers or os.cpu_count() or 1)
+
+    def serve_forever(self):
+        logger.info(f'Agent listening on {self.listener.address} running {self.capacity} tasks')
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as error:
+                logger.info(f'Refused connection: {error!r}')
+                continue
+            threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+
+    def handle_connection(self, conn):
+        send_lock = threading.Lock()
+        stopped = threading.Event()
+        shared = {}
+        futures = set()
+
+        def send(message):
+            try:
+                with send_lock:
+                    conn.send(message)
+            except OSError:
+                stopped.set()
+
+        def send_result(task_id, future):
+            futures.discard(future)
+            if future.cancelled():
+                return
+            try:
+                send(('result', task_id, future.result()))
+            except Exception as error:
+                send(('error', task_id, error))
+
+        def send_heartbeats():
+            while not stopped.wait(heartbeat_interval):
+                send(('heartbeat',))
+
+        send(('hello', self.capacity, socket.gethostname()))
+        threading.Thread(target=send_heartbeats, daemon=True).start()
+        try:
+            while not stopped.is_set():
+                message = conn.recv()
+                if message[0] == 'share':
+                    shared[message[1]] = message[2]
+                elif message[0] == 'task':
+                    _, task_id, fn, refs, last_arg = message
+                    args = [shared[value] if kind == 'ref' else value for kind, value in refs]
+                    future = self.executor.submit(fn, *args, last_arg)
+                    futures.add(future)
+                    future.add_done_callback(lambda future, task_id=task_id: send_result(task_id, future))
+                elif message[0] == 'close':
+                    break
+        except (OSError, EOFError) as error:
+            logger.info(f'Lost the coordinator: {error!r}')
+        finally:
+            stopped.set()
+            # The tasks of a lost coordinator are sent to the other agents
+            for future in list(futures):
+                future.cancel()
+            conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=f'Run an agent computing the fits of PyFMGUI on this machine. '
+                    f'The key of the cluster is read from {authkey_variable}.'
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen to, 0.0.0.0 for all of them')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--workers', type=int, help='processes of the pool, one per core by default')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    agent = ClusterAgent((args.host, args.port), max_workers=args.workers)
+    try:
+        agent.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.listener.close()
+        agent.executor.shutdown(cancel_futures=True)
+
+if __name__ == '__main__':
+    # Use the same start method as the application
+    multiprocessing.set_start_method('spawn')
+    multiprocessing.freeze_support()
+    main()
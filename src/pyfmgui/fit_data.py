@@ -0,0 +1,76 @@
+import numpy as np
+
+# Preparation of the force vs indentation data before the fit,
+# shared by the fit routines and the preview of the widgets.
+
+def get_downsample_step(nb_points, pts_downsample):
+    # Keep at least pts_downsample points, never skip points of short signals
+    return max(nb_points // max(pts_downsample, 1), 1)
+
+def get_interpolation_error(x, y, idx):
+    # Error of the linear interpolation between the points at idx
+    # and the maximum error between each pair of consecutive points
+    seg = np.clip(np.searchsorted(idx, np.arange(len(y)), side='right') - 1, 0, len(idx) - 2)
+    start, end = idx[seg], idx[seg + 1]
+    dx = x[end] - x[start]
+    frac = np.divide(x - x[start], dx, out=np.zeros(len(x)), where=dx != 0)
+    error = np.abs(y - (y[start] + (y[end] - y[start]) * frac))
+    return np.maximum.reduceat(error, idx[:-1])
+
+def get_adaptive_downsample_idx(x, y, step, tol):
+    '''
+    Indices of the points kept when downsampling a signal, one point
+    every step points plus the points needed so that the linear
+    interpolation between the kept points deviates from y by less
+    than tol. Segments exceeding tol are split in halves until they
+    respect tol or contain no points to remove.
+
+    :param x: x values of the signal
+    :param y: y values of the signal
+    :param step: distance in points between the points always kept
+    :param tol: maximum interpolation error, in the units of y
+    '''
+    nb_points = len(y)
+    if nb_points < 3 or step <= 1:
+        return np.arange(nb_points)
+    keep = np.zeros(nb_points, dtype=bool)
+    keep[::step] = True
+    keep[-1] = True
+    while True:
+        idx = np.flatnonzero(keep)
+        # Split the segments with points to remove exceeding the tolerance
+        split = (get_interpolation_error(x, y, idx) > tol) & (np.diff(idx) > 1)
+        if not split.any():
+            return idx
+        keep[(idx[:-1][split] + idx[1:][split]) // 2] = True
+
+def slice_fit_range(indentation, force, param_dict):
+    # Keep the non contact part and the contact part within the fit range
+    contact_mask = indentation >= 0
+    if param_dict['fit_range_type'] == 'indentation':
+        range_mask = (indentation >= param_dict['min_ind']) & (indentation <= param_dict['max_ind'])
+    elif param_dict['fit_range_type'] == 'force':
+        range_mask = (force >= param_dict['min_force']) & (force <= param_dict['max_force'])
+    else:
+        range_mask = np.ones(len(indentation), dtype=bool)
+    cont_idx = np.flatnonzero(contact_mask & range_mask)
+    ncont_idx = np.flatnonzero(~contact_mask)
+    idx = np.r_[ncont_idx, cont_idx]
+    return indentation[idx], force[idx]
+
+def prepare_hertz_fit_data(indentation, force, param_dict):
+    '''
+    Slice the force vs indentation data of a curve to the fit range
+    and downsample it if requested, so that the points removed by
+    the fit range do not count in the points kept by the downsampling.
+    '''
+    indentation, force = slice_fit_range(indentation, force, param_dict)
+    if not param_dict['downsample_flag']:
+        return indentation, force
+    step = get_downsample_step(len(indentation), param_dict['pts_downsample'])
+    if param_dict.get('adaptive_downsample', False):
+        # Add points where the uniform downsampling would not follow the curve
+        tol = param_dict['downsample_tol'] * np.ptp(force) if len(force) else 0
+        idx = get_adaptive_downsample_idx(indentation, force, step, tol)
+        return indentation[idx], force[idx]
+    return indentation[::step], force[::step]
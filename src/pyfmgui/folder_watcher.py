@@ -0,0 +1,95 @@
+import glob
+import os
+# Import logging and get global logger
+import logging
+logger = logging.getLogger()
+
+# Watch mode: the files written by the instrument in a folder are
+# loaded and analyzed as soon as they are complete. The folder is
+# polled, which works the same on every platform and network drive.
+
+# Seconds between two polls of the watched folder
+poll_interval = 5.0
+
+class FolderWatcher:
+    '''
+    Finds the new dataset files written in a folder and its subfolders.
+    A file is complete when its size and modification time did not
+    change during stable_polls polls, before that the instrument may
+    still be writing it.
+
+    :param dirname: folder to watch
+    :param patterns: glob patterns of the dataset files
+    :param known_paths: paths of the files already loaded, never returned
+    :param stable_polls: polls without changes needed to return a file
+    '''
+    def __init__(self, dirname, patterns, known_paths=(), stable_polls=2):
+        self.dirname = dirname
+        self.patterns = patterns
+        self.stable_polls = stable_polls
+        self.done = set(os.path.abspath(path) for path in known_paths)
+        # Last size and modification time of the files being written
+        # and the number of polls they did not change
+        self.pending = {}
+
+    def list_files(self):
+        paths = set()
+        for pattern in self.patterns:
+            paths.update(glob.glob(os.path.join(self.dirname, '**', pattern), recursive=True))
+        return [os.path.abspath(path) for path in paths]
+
+    def poll(self):
+        '''
+        Get the paths of the files completed since the last poll, oldest first.
+        '''
+        completed = []
+        for path in self.list_files():
+            if path in self.done:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Moved or deleted meanwhile
+                self.pending.pop(path, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            last_signature, nb_stable = self.pending.get(path, (None, 0))
+            nb_stable = nb_stable + 1 if signature == last_signature else 0
+            if nb_stable >= self.stable_polls and stat.st_size > 0:
+                self.pending.pop(path)
+                self.done.add(path)
+                completed.append((stat.st_mtime_ns, path))
+            else:
+                self.pending[path] = (signature, nb_stable)
+        return [path for _, path in sorted(completed)]
+
+def load_and_compute(session, filelist, method, params, progress_callback, range_callback, step_callback):
+    '''
+    Load the files completed in the watched folder and compute them
+    with the analysis of the watch mode. The results of each file are
+    saved in the session as soon as its curves are done.
+    '''
+    # Import the file readers and the computation when the first files are found
+    from pyfmgui.loadfiles import loadfiles
+    from pyfmgui.compute import compute
+    known_files = dict(session.loaded_files)
+    step_callback.emit(f'Loading {len(filelist)} new files')
+    loadfiles(session, filelist, progress_callback, range_callback, step_callback)
+    filedict = {file_id: file for file_id, file in session.loaded_files.items() if file_id not in known_files}
+    # The files are identified by their entry name, keep the loaded file
+    # and its results when a new file has the same name
+    for file_id, file in known_files.items():
+        new_file = session.loaded_files[file_id]
+        if new_file is not file:
+            logger.info(
+                f"Watch mode: skipped {new_file.filemetadata['file_path']}, a file named {file_id} "
+                f"is already loaded from {file.filemetadata['file_path']}"
+            )
+            session.loaded_files[file_id] = file
+    if not filedict:
+        return
+    logger.info(f'Watch mode: computing {method} for {len(filedict)} new files')
+    compute(session, params, filedict, method, progress_callback, range_callback, step_callback)
+    # Show the last file acquired
+    session.current_file = list(filedict.values())[-1]
+    session.current_curve_index = 0
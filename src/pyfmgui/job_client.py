@@ -0,0 +1,205 @@
+import hmac
+import json
+import os
+import pickle
+import secrets
+import urllib.error
+import urllib.request
+import numpy as np
+# Import logging and get global logger
+import logging
+logger = logging.getLogger()
+
+# Client of the job server. The jobs are sent as JSON, the params
+# holding tables, like the piezo characterization, are converted to
+# lists. The results are received pickled to restore them in the
+# session, or as the rows of the exported tables.
+#
+# The requests carry a key stored in a file readable only by the user
+# running the server, and the server signs the pickled results with it,
+# so that other users or web pages can not use the server and the
+# client never unpickles data from another program listening on the port.
+#
+# To share the server between the users of a group, start it with a key
+# file in a folder of the group and the name of the group, for example
+#
+#   python -m pyfmgui.job_server --key-file /srv/pyfmgui/job_server.key serve --group afm
+#
+# The key is then readable by the members of the group, which give the
+# same --key-file or set its path in the PYFMGUI_JOB_SERVER_KEY variable.
+# The files of the jobs are read by the user running the server.
+
+default_port = 8765
+# Environment variable with the path of the key file
+key_path_variable = 'PYFMGUI_JOB_SERVER_KEY'
+
+# Params of the client not sent to the server
+client_params = ('job_server', 'job_priority')
+
+def get_key_path():
+    # Key file given in the environment, or the key of this user
+    return os.environ.get(key_path_variable) or os.path.join(os.path.expanduser('~'), '.pyfmgui', 'job_server.key')
+
+def get_key(create=False, path=None, group=None):
+    '''
+    Read the key of the job server, creating it if asked.
+
+    :param create: create the key file if it does not exist
+    :param path: path of the key file, see get_key_path by default
+    :param group: name of the group allowed to read the created key,
+                  only the owner can read it by default
+    '''
+    path = path or get_key_path()
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            if group is not None:
+                # Give the key to the group before writing it
+                import grp
+                os.fchown(f.fileno(), -1, grp.getgrnam(group).gr_gid)
+                os.fchmod(f.fileno(), 0o640)
+            f.write(secrets.token_hex(32))
+    if not os.path.exists(path):
+        raise RuntimeError(f'No job server key in {path}, start the job server first')
+    with open(path) as f:
+        return f.read().strip()
+
+def sign(key, data):
+    return hmac.new(key.encode(), data, 'sha256').hexdigest()
+
+def encode_value(value):
+    # Convert the tables and numpy values in the params to JSON types
+    if hasattr(value, 'to_dict') and hasattr(value, 'columns'):
+        return {'__dataframe__': value.to_dict(orient='list')}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    return value
+
+def decode_value(value):
+    if isinstance(value, dict) and '__dataframe__' in value:
+        import pandas as pd
+        return pd.DataFrame(value['__dataframe__'])
+    return value
+
+def encode_params(params):
+    params = {key: encode_value(value) for key, value in params.items() if key not in client_params}
+    # The server only resumes the journals of its own folder, send the name
+    if params.get('resume_journal'):
+        params['resume_journal'] = os.path.basename(params['resume_journal'])
+    return params
+
+def decode_params(params):
+    return {key: decode_value(value) for key, value in params.items()}
+
+def get_server_url(address):
+    # The address is host:port, or only the port of a server on this machine
+    address = str(address or default_port)
+    if ':' not in address:
+        address = f'localhost:{address}'
+    return address if address.startswith('http') else f'http://{address}'
+
+class JobClient:
+    '''
+    Submits analysis jobs to a job server and follows them.
+
+    :param address: host:port of the server, or its port on this machine
+    :param key: key of the server, read from the key file by default
+    :param key_path: path of the key file, see get_key_path by default
+    '''
+    def __init__(self, address=None, key=None, key_path=None):
+        self.url = get_server_url(address)
+        self.key = key or get_key(path=key_path)
+
+    def request(self, method, path, body=None, timeout=30):
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(
+            self.url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {self.key}'}
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as error:
+            # Raise the error message sent by the server
+            raise RuntimeError(f'Job server error {error.code}: {error.read().decode()}') from None
+
+    def submit(self, files, method, params, priority=0, name=None, curve_index=0):
+        '''
+        Submit the computation of a method for a list of file paths and get the job id.
+        '''
+        body = {
+            'files': list(files), 'method': method, 'params': encode_params(params),
+            'priority': priority, 'name': name, 'curve_index': curve_index
+        }
+        with self.request('POST', '/jobs', body) as response:
+            return json.load(response)['id']
+
+    def list_jobs(self):
+        with self.request('GET', '/jobs') as response:
+            return json.load(response)
+
+    def get_job(self, job_id):
+        with self.request('GET', f'/jobs/{job_id}') as response:
+            return json.load(response)
+
+    def cancel(self, job_id):
+        with self.request('DELETE', f'/jobs/{job_id}') as response:
+            return json.load(response)
+
+    def iter_progress(self, job_id):
+        '''
+        Iterate over the states of a job streamed by the server until it finishes.
+        '''
+        with self.request('GET', f'/jobs/{job_id}/progress', timeout=None) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+    def get_results(self, job_id, pickled=True):
+        '''
+        Get the results of a finished job by file path, pickled as the
+        list of (curve_idx, result) of each file, or as exported rows.
+        '''
+        with self.request('GET', f'/jobs/{job_id}/results?format={"pickle" if pickled else "json"}') as response:
+            data = response.read()
+            signature = response.headers.get('X-Signature', '')
+        if not pickled:
+            return json.loads(data)
+        # Only unpickle the results sent by the server holding the key
+        if not hmac.compare_digest(signature, sign(self.key, data)):
+            raise RuntimeError('The results are not signed with the key of the job server')
+        return pickle.loads(data)
+
+def run_on_job_server(session, params, filedict, method, progress_callback, range_callback, step_callback):
+    '''
+    Compute the files on the job server given in the job_server param
+    and save the results in the session, as done by compute.
+    '''
+    from pyfmgui.compute import clear_file_results, save_file_results
+    client = JobClient(params['job_server'])
+    file_ids = {file.filemetadata['file_path']: file_id for file_id, file in filedict.items()}
+    job_id = client.submit(
+        file_ids.keys(), method, params, params.get('job_priority', 0),
+        name=f'{method} of {len(filedict)} files', curve_index=session.current_curve_index or 0
+    )
+    logger.info(f'Submitted job {job_id} to the job server at {client.url}')
+    state = None
+    for state in client.iter_progress(job_id):
+        range_callback.emit(state['total'])
+        progress_callback.emit(state['progress'])
+        step_callback.emit(f"Job {job_id} {state['state']}: {state['step']}")
+    if state is None or state['state'] != 'done':
+        raise RuntimeError(f"Job {job_id} did not complete: {state and state['error']}")
+    file_results = []
+    for file_path, curve_results in client.get_results(job_id).items():
+        file_id = file_ids[file_path]
+        clear_file_results(session, method, file_id)
+        file_results.extend((file_id, curve_idx, result) for curve_idx, result in curve_results)
+    save_file_results(session, params, file_results)
+    progress_callback.emit(0)
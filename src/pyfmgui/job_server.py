@@ -0,0 +1,444 @@
+import argparse
+import concurrent.futures
+import heapq
+import hmac
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+# Import logging and get global logger
+import logging
+logger = logging.getLogger()
+
+from pyfmgui.scheduler import FairScheduler
+from pyfmgui.job_client import JobClient, decode_params, encode_value, default_port, get_key, sign
+
+# Job server owning the pool of processes of the analyses of a user.
+# The jobs are submitted over HTTP on localhost and the fits of the
+# running jobs share the pool, see FairScheduler.
+#
+#   POST   /jobs                 submit a job, returns its id
+#   GET    /jobs                 state of all the jobs
+#   GET    /jobs/<id>            state of a job
+#   GET    /jobs/<id>/progress   states of a job as NDJSON until it finishes
+#   GET    /jobs/<id>/results    results, format=pickle or json
+#   DELETE /jobs/<id>            cancel a queued job
+#
+# The requests must carry the key of the server, see job_client for the
+# key shared by a group of users, and the jobs are sent as JSON. Paths to pickled data are not accepted, the
+# journal of a resumed run is looked up by name in the journal folder.
+
+# Jobs computed at the same time, the other jobs wait in the queue
+max_running_jobs = 4
+# Seconds between two progress lines streamed for a job
+progress_interval = 0.2
+# States of the jobs that will not change anymore
+finished_states = ('done', 'failed', 'cancelled')
+# Seconds the finished jobs and their results are kept
+finished_job_ttl = 3600.0
+# Seconds the results are kept once fetched, to fetch them in another format
+fetched_job_ttl = 60.0
+
+def load_job_file(path):
+    # Load a file of a job, returns (file_id, file) or None if it failed
+    from pyfmgui.loadfiles import load_single_file
+    return load_single_file(path)
+
+class JobSignal:
+    '''
+    Callback of compute updating a field of the state of a job.
+    '''
+    def __init__(self, job, field):
+        self.job = job
+        self.field = field
+
+    def emit(self, value):
+        self.job.update(**{self.field: value})
+
+class Job:
+    '''
+    Analysis job of the server.
+
+    :param job_id: id of the job
+    :param files: paths of the files to compute
+    :param method: method to compute
+    :param params: analysis params
+    :param priority: jobs with higher priorities run first
+    :param name: description of the job
+    :param curve_index: curve computed when not computing all the curves
+    '''
+    def __init__(self, job_id, files, method, params, priority=0, name=None, curve_index=0):
+        self.job_id = job_id
+        self.files = files
+        self.method = method
+        self.params = params
+        self.priority = priority
+        self.name = name or f'{method} of {len(files)} files'
+        self.curve_index = curve_index
+        self.state = 'queued'
+        self.progress = 0
+        self.total = 0
+        self.step = ''
+        self.error = None
+        self.submit_time = time.time()
+        self.finish_time = None
+        self.fetch_time = None
+        self.results = None
+        self.filemetadata = {}
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def update(self, **fields):
+        # Change the state and wake up the clients following the job
+        with self.condition:
+            for field, value in fields.items():
+                setattr(self, field, value)
+            if self.state in finished_states and self.finish_time is None:
+                self.finish_time = time.time()
+            self.version += 1
+            self.condition.notify_all()
+
+    def get_state(self):
+        return {
+            'id': self.job_id, 'name': self.name, 'method': self.method, 'priority': self.priority,
+            'state': self.state, 'progress': self.progress, 'total': self.total, 'step': self.step,
+            'error': self.error, 'submit_time': self.submit_time
+        }
+
+class JobServer:
+    '''
+    Queue of the analysis jobs, computed in a shared pool of processes.
+
+    :param max_workers: processes of the pool, one per core by default
+    :param max_jobs: jobs computed at the same time
+    '''
+    def __init__(self, max_workers=None, max_jobs=max_running_jobs):
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+        # Keep a couple of tasks per process so that they never wait
+        self.scheduler = FairScheduler(self.executor, 2 * (max_workers or os.cpu_count() or 1))
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.queue = []
+        self.nb_running = 0
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+
+    def submit(self, files, method, params, priority=0, name=None, curve_index=0):
+        self.evict_jobs()
+        with self.lock:
+            job_id = next(self.counter)
+            job = Job(job_id, files, method, params, priority, name, curve_index)
+            self.jobs[job_id] = job
+            heapq.heappush(self.queue, (-priority, job_id))
+        logger.info(f'Queued job {job_id}: {job.name}')
+        self.start_jobs()
+        return job
+
+    def evict_jobs(self):
+        # Forget the finished jobs once their results are fetched or too old
+        now = time.time()
+        with self.lock:
+            for job_id, job in list(self.jobs.items()):
+                if job.finish_time is None:
+                    continue
+                if now - job.finish_time > finished_job_ttl or \
+                        (job.fetch_time is not None and now - job.fetch_time > fetched_job_ttl):
+                    del self.jobs[job_id]
+
+    def start_jobs(self):
+        # Start the queued jobs with the highest priorities
+        with self.lock:
+            while self.queue and self.nb_running < self.max_jobs:
+                _, job_id = heapq.heappop(self.queue)
+                job = self.jobs[job_id]
+                if job.state != 'queued':
+                    continue
+                self.nb_running += 1
+                job.update(state='running')
+                threading.Thread(target=self.run_job, args=(job,), daemon=True).start()
+
+    def run_job(self, job):
+        # Import the computation in the thread, it imports the routines
+        from pyfmgui.compute import compute
+        from pyfmgui.methods import get_method
+        from pyfmgui.session import Session
+        job_executor = self.scheduler.create_executor(job.priority)
+        try:
+            job.update(step='Loading files')
+            session = Session()
+            file_paths = {}
+            for path in job.files:
+                loaded_file = load_job_file(path)
+                if loaded_file is None:
+                    raise ValueError(f'Could not load {path}')
+                file_id, file = loaded_file
+                session.loaded_files[file_id] = file
+                file_paths[file_id] = path
+                job.filemetadata[path] = file.filemetadata
+            session.current_file = next(iter(session.loaded_files.values()), None)
+            session.current_curve_index = job.curve_index
+            compute(
+                session, job.params, dict(session.loaded_files), job.method,
+                JobSignal(job, 'progress'), JobSignal(job, 'total'), JobSignal(job, 'step'),
+                fit_executor=job_executor
+            )
+            results = getattr(session, get_method(job.method).session_var)
+            job.results = {file_paths[file_id]: list(file_results) for file_id, file_results in results.items()}
+            job.update(state='done', step='Completed', progress=job.total)
+            logger.info(f'Completed job {job.job_id}')
+        except Exception as error:
+            logger.info(f'Job {job.job_id} failed: {traceback.format_exc()}')
+            job.update(state='failed', error=str(error))
+        finally:
+            job_executor.close()
+            with self.lock:
+                self.nb_running -= 1
+            self.start_jobs()
+
+    def cancel(self, job):
+        # Only the queued jobs can be cancelled
+        with self.lock:
+            if job.state != 'queued':
+                return False
+            job.update(state='cancelled')
+            return True
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+def get_journal_path(journal_name):
+    # Path of a journal of the journal folder given by its file name
+    from pyfmgui.journal import get_journal_dir
+    if os.path.basename(journal_name) != journal_name or not journal_name.endswith('.journal'):
+        raise ValueError(f'{journal_name} is not the name of a journal')
+    path = os.path.join(get_journal_dir(), journal_name)
+    if not os.path.isfile(path):
+        raise ValueError(f'Journal {journal_name} not found')
+    return path
+
+def get_result_rows(job):
+    # Rows of the exported table of the results of a job
+    from pyfmgui.export import get_file_results
+    from pyfmgui.methods import get_method
+    result_type = get_method(job.method).result_type
+    rows = []
+    for path, curve_results in job.results.items():
+        filemetadata = job.filemetadata[path]
+        rows.extend(get_file_results(result_type, (filemetadata['Entry_filename'], filemetadata, curve_results)))
+    return rows
+
+def encode_json(value):
+    # Convert the values of the exported rows not supported by json
+    value = encode_value(value)
+    return value if isinstance(value, (list, dict)) else str(value)
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    '''
+    HTTP interface of the JobServer held by the HTTP server.
+    '''
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def is_authorized(self):
+        # Check the key of the user, sent by the clients in every request
+        authorization = self.headers.get('Authorization', '')
+        if hmac.compare_digest(authorization.encode(), f'Bearer {self.server.key}'.encode()):
+            return True
+        self.send_json({'error': 'Unauthorized'}, 401)
+        return False
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, default=encode_json).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_job(self, job_id):
+        try:
+            return self.server.job_server.jobs.get(int(job_id))
+        except ValueError:
+            return None
+
+    def parse_path(self):
+        # Get the job and the action of /jobs/<id>/<action>
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts or parts[0] != 'jobs' or len(parts) > 3:
+            return None, None, None, url
+        job = self.get_job(parts[1]) if len(parts) > 1 else None
+        action = parts[2] if len(parts) > 2 else None
+        return parts, job, action, url
+
+    def do_POST(self):
+        if not self.is_authorized():
+            return
+        parts, _, _, _ = self.parse_path()
+        if parts != ['jobs']:
+            return self.send_json({'error': 'Not found'}, 404)
+        if self.headers.get_content_type() != 'application/json':
+            return self.send_json({'error': 'Jobs must be sent as application/json'}, 415)
+        from pyfmgui.methods import get_method
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            files, method = list(body['files']), body['method']
+            params = decode_params(body['params'])
+            priority = int(body.get('priority', 0))
+            if params.get('resume_journal'):
+                params['resume_journal'] = get_journal_path(params['resume_journal'])
+        except (ValueError, KeyError, TypeError) as error:
+            return self.send_json({'error': f'Invalid job: {error}'}, 400)
+        if get_method(method) is None:
+            return self.send_json({'error': f'Unknown method {method}'}, 400)
+        params['method'] = method
+        job = self.server.job_server.submit(
+            files, method, params, priority, body.get('name'), int(body.get('curve_index') or 0)
+        )
+        self.send_json({'id': job.job_id}, 201)
+
+    def do_GET(self):
+        if not self.is_authorized():
+            return
+        self.server.job_server.evict_jobs()
+        parts, job, action, url = self.parse_path()
+        if parts == ['jobs']:
+            return self.send_json([job.get_state() for job in list(self.server.job_server.jobs.values())])
+        if job is None:
+            return self.send_json({'error': 'Not found'}, 404)
+        if action is None:
+            return self.send_json(job.get_state())
+        if action == 'progress':
+            return self.stream_progress(job)
+        if action == 'results':
+            if job.state != 'done':
+                return self.send_json({'error': f'Job is {job.state}'}, 409)
+            job.fetch_time = time.time()
+            if parse_qs(url.query).get('format', ['json'])[0] == 'pickle':
+                body = pickle.dumps(job.results)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                # The clients only unpickle the results signed with the key
+                self.send_header('X-Signature', sign(self.server.key, body))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            return self.send_json(get_result_rows(job))
+        self.send_json({'error': 'Not found'}, 404)
+
+    def do_DELETE(self):
+        if not self.is_authorized():
+            return
+        parts, job, action, _ = self.parse_path()
+        if job is None or action is not None:
+            return self.send_json({'error': 'Not found'}, 404)
+        if not self.server.job_server.cancel(job):
+            return self.send_json({'error': f'Job is {job.state}'}, 409)
+        self.send_json(job.get_state())
+
+    def stream_progress(self, job):
+        # Send a line with the state of the job when it changes, until it finishes
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        version = -1
+        while True:
+            with job.condition:
+                job.condition.wait_for(lambda: job.version != version, timeout=30)
+                version = job.version
+                state = job.get_state()
+            try:
+                self.wfile.write((json.dumps(state) + '\n').encode())
+                self.wfile.flush()
+            except OSError:
+                # The client is gone
+                return
+            if state['state'] in finished_states:
+                return
+            # Merge the updates of the next interval in a single line
+            time.sleep(progress_interval)
+
+def create_server(port=default_port, max_workers=None, max_jobs=max_running_jobs, key=None, key_path=None, group=None):
+    '''
+    Create the HTTP server of a JobServer listening on localhost only.
+    The clients must send the key, by default read from the key file,
+    created if needed and readable by the given group.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), JobRequestHandler)
+    server.daemon_threads = True
+    server.key = key or get_key(create=True, path=key_path, group=group)
+    server.job_server = JobServer(max_workers, max_jobs)
+    return server
+
+def format_state(state):
+    line = f"[{state['id']}] {state['name']}: {state['state']} {state['progress']}/{state['total']} {state['step']}"
+    return f"{line} ({state['error']})" if state['error'] else line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute analysis jobs in a shared pool of processes.')
+    parser.add_argument('--server', default=str(default_port), help='host:port of the job server, or its port')
+    parser.add_argument('--key-file', help='key file of the job server, shared by the users of a group')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='start the job server on localhost')
+    serve.add_argument('--workers', type=int, help='processes of the pool, one per core by default')
+    serve.add_argument('--max-jobs', type=int, default=max_running_jobs, help='jobs computed at the same time')
+    serve.add_argument('--group', help='group of users allowed to read the created key file')
+    submit = commands.add_parser('submit', help='submit a job and follow its progress')
+    submit.add_argument('files', nargs='+', help='files to compute')
+    submit.add_argument('--method', required=True)
+    submit.add_argument('--params', required=True, help='JSON file with the analysis params')
+    submit.add_argument('--priority', type=int, default=0, help='jobs with higher priorities run first')
+    submit.add_argument('--name', help='description of the job')
+    submit.add_argument('--no-wait', action='store_true', help='only print the id of the job')
+    submit.add_argument('--output', help='CSV file to save the results')
+    status = commands.add_parser('status', help='show the state of the jobs')
+    status.add_argument('job_id', nargs='?', type=int)
+    cancel = commands.add_parser('cancel', help='cancel a queued job')
+    cancel.add_argument('job_id', type=int)
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+        port = int(args.server.rsplit(':', 1)[-1])
+        server = create_server(port, args.workers, args.max_jobs, key_path=args.key_file, group=args.group)
+        logger.info(f'Job server listening on 127.0.0.1:{port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            server.job_server.shutdown()
+        return
+    client = JobClient(args.server, key_path=args.key_file)
+    if args.command == 'status':
+        states = [client.get_job(args.job_id)] if args.job_id is not None else client.list_jobs()
+        for state in states:
+            print(format_state(state))
+    elif args.command == 'cancel':
+        print(format_state(client.cancel(args.job_id)))
+    elif args.command == 'submit':
+        with open(args.params) as f:
+            params = json.load(f)
+        job_id = client.submit([os.path.abspath(path) for path in args.files], args.method, params, args.priority, args.name)
+        print(job_id, flush=True)
+        if args.no_wait:
+            return
+        state = None
+        for state in client.iter_progress(job_id):
+            print(format_state(state), flush=True)
+        if state['state'] == 'done' and args.output:
+            import pandas as pd
+            pd.DataFrame(client.get_results(job_id, pickled=False)).to_csv(args.output, index=False)
+
+if __name__ == '__main__':
+    # Use the same start method as the application
+    multiprocessing.set_start_method('spawn')
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,210 @@
+import glob
+import itertools
+import os
+import pickle
+import time
+# Import logging and get global logger
+import logging
+logger = logging.getLogger()
+
+# Append-only journal of the curve results of a map computation. The
+# first record describes the run, the next ones hold the results of the
+# fit tasks as they finish. A run interrupted by a crash leaves its
+# journal on disk, so that the results can be restored and only the
+# missing curves computed when the same run is started again.
+
+# Seconds between two writes of the journal to disk
+sync_interval = 2.0
+
+# Params that do not change the results of the run
+ignored_params = (
+    'profile', 'resume_journal', 'job_server', 'job_priority', 'cluster_agents',
+    'out_of_core', 'memory_budget', 'shared_memory'
+)
+
+# Seconds after which the journals of runs never resumed are deleted
+max_journal_age = 7 * 24 * 3600.0
+
+# Number of the journals created by this process, the job server runs
+# several computations at the same time
+journal_counter = itertools.count()
+
+def get_journal_dir():
+    return os.path.join(os.path.expanduser('~'), '.pyfmgui', 'journals')
+
+def get_run_params(params):
+    return {key: value for key, value in params.items() if key not in ignored_params}
+
+def is_same_value(value, other):
+    # Compare the tables and arrays in the params by their pickled data
+    try:
+        return bool(value == other)
+    except Exception:
+        return pickle.dumps(value) == pickle.dumps(other)
+
+def is_same_run(header, method, params):
+    run_params = get_run_params(params)
+    if header['method'] != method or header['params'].keys() != run_params.keys():
+        return False
+    return all(is_same_value(value, run_params[key]) for key, value in header['params'].items())
+
+class ComputeJournal:
+    '''
+    Journal of the results of a computation, written to path. Used as
+    a context manager, the journal is deleted when the run completes.
+
+    :param path: path of the journal file
+    :param method: method computed
+    :param params: analysis params of the run
+    :param filedict: files computed in the run
+    :param valid_size: bytes of the records read from a resumed journal,
+                       a record cut by a crash after them is removed
+    '''
+    def __init__(self, path, method, params, filedict, valid_size=None):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'ab')
+        if valid_size is not None:
+            self.file.truncate(valid_size)
+        self.last_sync = time.perf_counter()
+        # A resumed journal already holds the description of the run
+        if self.file.tell() == 0:
+            header = {
+                'method': method, 'params': get_run_params(params),
+                'files': {file_id: file.filemetadata['file_path'] for file_id, file in filedict.items()}
+            }
+            pickle.dump(header, self.file)
+            self.sync()
+
+    @classmethod
+    def create(cls, method, params, filedict):
+        prune_journals()
+        path = os.path.join(get_journal_dir(), f'{method}_{time.strftime("%Y%m%d_%H%M%S")}_{os.getpid()}_{next(journal_counter)}.journal')
+        return cls(path, method, params, filedict)
+
+    @classmethod
+    def resume(cls, path, method, params, filedict):
+        '''
+        Open the journal of an interrupted run and get its results.
+        '''
+        _, results, valid_size = read_journal(path)
+        return cls(path, method, params, filedict, valid_size), results
+
+    def append(self, file_results):
+        '''
+        Add the results of a fit task, a list of (file_id, curve_idx, result).
+        The failed curves are not kept, they are computed again when resuming.
+        '''
+        curve_results = [file_result[:3] for file_result in file_results if 'error' not in file_result]
+        if not curve_results:
+            return
+        pickle.dump(curve_results, self.file)
+        if time.perf_counter() - self.last_sync > sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Keep the journal to resume the run if it failed
+        self.close(delete=exc_type is None)
+
+    def close(self, delete=False):
+        # Delete the journal once the results are in the session
+        self.file.close()
+        if delete:
+            os.remove(self.path)
+
+def read_journal_header(path):
+    '''
+    Read only the description of the run of a journal.
+    '''
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def read_journal(path):
+    '''
+    Read the description of a run, its results and the bytes of the
+    records read. The results are a dictionary relating each file id
+    to a dictionary relating curve indices to results. The records
+    after a record cut by a crash are ignored.
+    '''
+    results = {}
+    with open(path, 'rb') as f:
+        header = pickle.load(f)
+        valid_size = f.tell()
+        while True:
+            try:
+                curve_results = pickle.load(f)
+            except EOFError:
+                break
+            except Exception as error:
+                logger.info(f"Stopped reading journal {path} at a damaged record: {error}")
+                break
+            for file_id, curve_idx, result in curve_results:
+                results.setdefault(file_id, {})[curve_idx] = result
+            valid_size = f.tell()
+    return header, results, valid_size
+
+def open_journal(method, params, filedict):
+    '''
+    Get the journal of a run and the results restored from it, resuming
+    the journal given in the resume_journal param if any. The journal is
+    None if it can not be written.
+    '''
+    try:
+        if params.get('resume_journal'):
+            journal, results = ComputeJournal.resume(params['resume_journal'], method, params, filedict)
+            logger.info(f"Resuming run from journal {journal.path}")
+            return journal, results
+        return ComputeJournal.create(method, params, filedict), {}
+    except Exception as error:
+        logger.info(f"Could not open the journal of the run, results will not be checkpointed: {error}")
+        return None, {}
+
+def find_journal(method, params, filedict):
+    '''
+    Get the path of the most recent journal left by an interrupted run
+    of the method with the same params and files, and the number of
+    curves it holds, or (None, 0) if there is none.
+    '''
+    for path in sorted(glob.glob(os.path.join(get_journal_dir(), f'{method}_*.journal')), reverse=True):
+        # Match the runs by their description, the results are only read from the journal found
+        try:
+            header = read_journal_header(path)
+        except Exception as error:
+            logger.info(f"Could not read journal {path}: {error}")
+            continue
+        if not is_same_run(header, method, params):
+            continue
+        same_files = all(
+            file_id in filedict and filedict[file_id].filemetadata['file_path'] == file_path
+            for file_id, file_path in header['files'].items()
+        )
+        if not same_files:
+            continue
+        try:
+            _, results, _ = read_journal(path)
+        except Exception as error:
+            logger.info(f"Could not read journal {path}: {error}")
+            continue
+        return path, sum(len(curve_results) for curve_results in results.values())
+    return None, 0
+
+def prune_journals(max_age=max_journal_age):
+    '''
+    Delete the journals not written for more than max_age seconds.
+    '''
+    now = time.time()
+    for path in glob.glob(os.path.join(get_journal_dir(), '*.journal')):
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                logger.info(f"Deleted old journal {path}")
+        except OSError:
+            pass
@@ -3,18 +3,23 @@ import logging
 logger = logging.getLogger()
 # Import for multiprocessing
 import concurrent.futures
+import time
 # Get loadfile function from PyFMReader
 from pyfmreader import loadfile
 # Get constants
 import pyfmgui.const as const
+# Import timing spans
+from pyfmgui import profiling
+from pyfmgui.profiling import span, run_timed
 
 def load_single_file(filepath):
     try:
-        file = loadfile(filepath)
-        file_id = file.filemetadata['Entry_filename']
-        file_type = file.filemetadata['file_type']
-        if file.isFV and file_type in const.nanoscope_file_extensions:
-            file.getpiezoimg()
+        with span('load_file'):
+            file = loadfile(filepath)
+            file_id = file.filemetadata['Entry_filename']
+            file_type = file.filemetadata['file_type']
+            if file.isFV and file_type in const.nanoscope_file_extensions:
+                file.getpiezoimg()
         return (file_id, file)
     except Exception as error:
         logger.info(f'Failed to load {filepath} with error: {error}')
@@ -23,14 +28,19 @@ def loadfiles(session, filelist, progress_callback, range_callback, step_callbac
     files_to_load = [path for path in filelist if path not in session.loaded_files_paths]
     loaded_files = []
     count = 0
-    with concurrent.futures.ProcessPoolExecutor() as executor:
+    # Record the loading spans apart from the computations
+    with profiling.recording() as recorder, concurrent.futures.ProcessPoolExecutor() as executor:
         # loaded_files = executor.map(load_single_file, files_to_load)
-        futures = [executor.submit(load_single_file, filepath) for filepath in files_to_load]
+        futures = {executor.submit(run_timed, False, load_single_file, filepath): time.time() for filepath in files_to_load}
         for future in concurrent.futures.as_completed(futures):
-            loaded_files.append(future.result())
+            loaded_file, timing = future.result()
+            profiling.record_task(futures[future], timing)
+            loaded_files.append(loaded_file)
             count+=1
             progress_callback.emit(count)
     # loaded_files = list(loaded_files)
+    if files_to_load:
+        logger.info(f'Timing summary for loading the files:\n{recorder.collect().format_summary()}')
     # Loop and save files in the session
     for file_id, file in loaded_files:
         session.loaded_files[file_id] = file
@@ -1,5 +1,7 @@
 # Import glob to find files in os
 import glob
+# Import importlib to load the analysis widgets when opened
+import importlib
 # Import GUI framework
 import PyQt5
 from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
@@ -7,25 +9,37 @@ from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
 import logging
 logger = logging.getLogger()
 # Get methods and objects needed
-from pyfmgui.const import pyFM_VERSION
-from pyfmgui.loadfiles import loadfiles
+from pyfmgui.const import pyFM_VERSION, dataset_file_patterns
 from pyfmgui.threading import Worker
-from pyfmgui.widgets.exportdialog import ExportDialog
-from pyfmgui.widgets.hertzfit_widget import HertzFitWidget
-from pyfmgui.widgets.tingfit_widget import TingFitWidget
-from pyfmgui.widgets.piezochar_widget import PiezoCharWidget
-from pyfmgui.widgets.vdrag_widget import VDragWidget
-from pyfmgui.widgets.microrheo_widget import MicrorheoWidget
-from pyfmgui.widgets.dataviewer_widget import DataViewerWidget
-from pyfmgui.widgets.thermaltune_widget import ThermalTuneWidget
-from pyfmgui.widgets.macro_widget import MacroWidget
 from pyfmgui.widgets.logger_dialog import LoggerDialog
 from pyfmgui.widgets.progress_dialog import ProgressDialog
+from pyfmgui.folder_watcher import FolderWatcher, load_and_compute, poll_interval
+
+# Windows opened from the toolbar: module, class and session variable
+# holding the open window. The modules are imported the first time
+# the window is opened, so their dependencies do not slow down startup.
+analysis_widgets = {
+	"Data Viewer": ('pyfmgui.widgets.dataviewer_widget', 'DataViewerWidget', 'data_viewer_widget'),
+	"Thermal Tune": ('pyfmgui.widgets.thermaltune_widget', 'ThermalTuneWidget', 'thermal_tune_widget'),
+	"Elasticity Fit": ('pyfmgui.widgets.hertzfit_widget', 'HertzFitWidget', 'hertz_fit_widget'),
+	"Viscoelasticity Fit": ('pyfmgui.widgets.tingfit_widget', 'TingFitWidget', 'ting_fit_widget'),
+	"Piezo Characterization": ('pyfmgui.widgets.piezochar_widget', 'PiezoCharWidget', 'piezo_char_widget'),
+	"Viscous Drag": ('pyfmgui.widgets.vdrag_widget', 'VDragWidget', 'vdrag_widget'),
+	"Microrheology": ('pyfmgui.widgets.microrheo_widget', 'MicrorheoWidget', 'microrheo_widget'),
+	"Export Results": ('pyfmgui.widgets.exportdialog', 'ExportDialog', 'export_dialog'),
+	"Macrowidget": ('pyfmgui.widgets.macro_widget', 'MacroWidget', 'macro_widget')
+}
 
 class MainWindow(QtWidgets.QMainWindow):
 	def __init__(self, session, parent = None):
 		super(MainWindow, self).__init__(parent)
 		self.session = session
+		# State of the watch folder mode
+		self.folder_watcher = None
+		self.watch_files = []
+		self.watch_thread = None
+		self.watch_timer = QtCore.QTimer(self)
+		self.watch_timer.timeout.connect(self.poll_watch_folder)
 		self.init_gui()
 		
 	def init_gui(self):
@@ -40,6 +54,8 @@ class MainWindow(QtWidgets.QMainWindow):
 		file.addAction("Load Folder")
 		#file.addAction("Export Results")
 		file.addAction("Remove All Files And Results")
+		file.addAction("Watch Folder")
+		file.addAction("Stop Watching Folder")
 		view = bar.addMenu("View")
 		view.addAction("Cascade")
 		view.addAction("Tiled")
@@ -102,7 +118,7 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.toolbar.addAction(openLoggerDialog)
 
 		# Setup the logger widget
-		self.session.logger_wiget = LoggerDialog(self)
+		self.session.logger_wiget = LoggerDialog(self.session, self)
 		self.add_subwindow(self.session.logger_wiget, 'Logs')
 		logger.info('Started application')
 		logger.info('No data loaded')
@@ -123,69 +139,17 @@ class MainWindow(QtWidgets.QMainWindow):
 	def open_analysis_window(self):
 		widget_to_open = None
 		action = self.sender().text()
-		if action == "Data Viewer":
-			if self.session.data_viewer_widget is None:
-				widget_to_open = DataViewerWidget(self.session)
-			elif self.session.data_viewer_widget.isMaximized():
-				self.session.data_viewer_widget.showMinimized()
-			else:
-				self.session.data_viewer_widget.showMaximized()
-		elif action == "Thermal Tune":
-			if self.session.thermal_tune_widget is None:
-				widget_to_open = ThermalTuneWidget(self.session)
-			elif self.session.thermal_tune_widget.isMaximized():
-				self.session.thermal_tune_widget.showMinimized()
-			else:
-				self.session.thermal_tune_widget.showMaximized()
-		elif action == "Elasticity Fit":
-			if self.session.hertz_fit_widget is None:
-				widget_to_open = HertzFitWidget(self.session)
-			elif self.session.hertz_fit_widget.isMaximized():
-				self.session.hertz_fit_widget.showMinimized()
-			else:
-				self.session.hertz_fit_widget.showMaximized()
-		elif action == "Viscoelasticity Fit":
-			if self.session.ting_fit_widget is None:
-				widget_to_open = TingFitWidget(self.session)
-			elif self.session.ting_fit_widget.isMaximized():
-				self.session.ting_fit_widget.showMinimized()
-			else:
-				self.session.ting_fit_widget.showMaximized()
-		elif action == "Piezo Characterization":
-			if self.session.piezo_char_widget is None:
-				widget_to_open = PiezoCharWidget(self.session)
-			elif self.session.piezo_char_widget.isMaximized():
-				self.session.piezo_char_widget.showMinimized()
-			else:
-				self.session.piezo_char_widget.showMaximized()
-		elif action == "Viscous Drag":
-			if self.session.vdrag_widget is None:
-				widget_to_open = VDragWidget(self.session)
-			elif self.session.vdrag_widget.isMaximized():
-				self.session.vdrag_widget.showMinimized()
-			else:
-				self.session.vdrag_widget.showMaximized()
-		elif action == "Microrheology":
-			if self.session.microrheo_widget is None:
-				widget_to_open = MicrorheoWidget(self.session)
-			elif self.session.microrheo_widget.isMaximized():
-				self.session.microrheo_widget.showMinimized()
+		if action in analysis_widgets:
+			module_name, class_name, session_var = analysis_widgets[action]
+			widget = getattr(self.session, session_var)
+			if widget is None:
+				# Import the widget the first time it is opened
+				widget_class = getattr(importlib.import_module(module_name), class_name)
+				widget_to_open = widget_class(self.session)
+			elif widget.isMaximized():
+				widget.showMinimized()
 			else:
-				self.session.microrheo_widget.showMaximized()
-		elif action == "Export Results":
-			if self.session.export_dialog is None:
-				widget_to_open = ExportDialog(self.session)
-			elif self.session.export_dialog.isMaximized():
-				self.session.export_dialog.showMinimized()
-			else:
-				self.session.export_dialog.showMaximized()
-		elif action == "Macrowidget":
-			if self.session.macro_widget is None:
-				widget_to_open = MacroWidget(self.session)
-			elif self.session.macro_widget.isMaximized():
-				self.session.macro_widget.showMinimized()
-			else:
-				self.session.macro_widget.showMaximized()
+				widget.showMaximized()
 		elif action == "Logs":
 			if self.session.logger_wiget is None:
 				widget_to_open = self.session.logger_wiget
@@ -226,11 +190,14 @@ class MainWindow(QtWidgets.QMainWindow):
 			self.mdi.tileSubWindows()
 		elif q.text() == "Remove All Files And Results":
 			self.remove_all_files_and_results()
+		elif q.text() == "Watch Folder":
+			self.start_watch_folder()
+		elif q.text() == "Stop Watching Folder":
+			self.stop_watch_folder()
 	
 	def getFileList(self, directory):
-		types = ('*.jpk-force', '*.jpk-force-map', '*.jpk-qi-data', '*.jpk-force.zip', '*.jpk-force-map.zip', '*.jpk-qi-data.zip', '*.spm', '*.pfc','*.tdms ')
 		dataset_files = []
-		for files in types:
+		for files in dataset_file_patterns:
 			dataset_files.extend(glob.glob(f'{directory}/**/{files}', recursive=True))
 		return dataset_files
 	
@@ -240,6 +207,8 @@ class MainWindow(QtWidgets.QMainWindow):
 		self.session.pbar_widget.set_label_sub_text('')
 		self.session.pbar_widget.show()
 		self.session.pbar_widget.set_pbar_range(0, len(filelist))
+		# Import the file readers when the first files are loaded
+		from pyfmgui.loadfiles import loadfiles
 		self.thread = QtCore.QThread()
 		self.worker = Worker(loadfiles, self.session, filelist)
 		self.worker.moveToThread(self.thread)
@@ -292,3 +261,66 @@ class MainWindow(QtWidgets.QMainWindow):
 			self.session.vdrag_widget.clear()
 		if self.session.microrheo_widget:
 			self.session.microrheo_widget.clear()
+
+	def start_watch_folder(self):
+		# Analyses that can run in watch mode, from the open analysis windows
+		analyses = {}
+		for action, (_, _, session_var) in analysis_widgets.items():
+			widget = getattr(self.session, session_var)
+			if widget is not None and hasattr(widget, 'get_compute_params'):
+				analyses[action] = widget
+		if not analyses:
+			logger.info('Open the analysis window to run in watch mode and set its parameters first')
+			return
+		dirname = QtWidgets.QFileDialog.getExistingDirectory(
+			self, 'Choose Directory To Watch', r'./'
+		)
+		if dirname == "" or dirname is None:
+			return
+		action, ok = QtWidgets.QInputDialog.getItem(
+			self, 'Watch Folder', 'Analysis of the new files:', list(analyses.keys()), 0, False
+		)
+		if not ok:
+			return
+		# The parameters set when the watch starts are used for all the files
+		self.watch_method, self.watch_params = analyses[action].get_compute_params()
+		self.watch_params['compute_all_curves'] = True
+		known_paths = [file.filemetadata['file_path'] for file in self.session.loaded_files.values()]
+		self.folder_watcher = FolderWatcher(dirname, dataset_file_patterns, known_paths)
+		self.watch_files = []
+		self.watch_timer.start(int(poll_interval * 1000))
+		logger.info(f'Watching {dirname} for new files to compute {self.watch_method}')
+		self.poll_watch_folder()
+
+	def stop_watch_folder(self):
+		if self.folder_watcher is None:
+			return
+		self.watch_timer.stop()
+		logger.info(f'Stopped watching {self.folder_watcher.dirname}')
+		self.folder_watcher = None
+		self.watch_files = []
+
+	def poll_watch_folder(self):
+		if self.folder_watcher is None:
+			return
+		self.watch_files.extend(self.folder_watcher.poll())
+		# The files completed meanwhile are computed after the current ones
+		if not self.watch_files or self.watch_thread is not None:
+			return
+		filelist, self.watch_files = self.watch_files, []
+		logger.info(f'Watch mode: found {len(filelist)} new files')
+		self.watch_thread = QtCore.QThread()
+		self.watch_worker = Worker(load_and_compute, self.session, filelist, self.watch_method, self.watch_params)
+		self.watch_worker.moveToThread(self.watch_thread)
+		self.watch_thread.started.connect(self.watch_worker.run)
+		self.watch_worker.signals.finished.connect(self.watch_oncomplete)
+		self.watch_thread.start()
+
+	def watch_oncomplete(self):
+		self.watch_thread.quit()
+		self.watch_thread.wait()
+		self.watch_thread = None
+		# Show the new files and results in the open windows
+		self.close_dialog()
+		logger.info(f'Watch mode: {self.watch_method} completed')
+		self.poll_watch_folder()
@@ -0,0 +1,59 @@
+import numpy as np
+
+import pyfmgui.const as cts
+
+class MapGeometry:
+    '''
+    Layout of a force map as displayed in the map panels.
+
+    Holds the image to display, the grid relating each pixel
+    to its curve index and the inverse index relating each
+    curve to its pixel.
+
+    :param file: loaded force volume file
+    '''
+    def __init__(self, file):
+        file_type = file.filemetadata['file_type']
+        if file_type in cts.jpk_file_extensions:
+            img = file.imagedata.get('Height(measured)', None)
+            self.img_channel = 'Height(measured)'
+            if img is None:
+                img = file.imagedata.get('Height', None)
+                self.img_channel = 'Height'
+            img = np.rot90(np.fliplr(img))
+            rows, cols = img.shape[0], img.shape[1]
+            curve_coords = np.arange(cols*rows).reshape((cols, rows))
+            curve_coords = np.rot90(np.fliplr(curve_coords))
+        else:
+            img = file.piezoimg
+            self.img_channel = 'Piezo Height'
+            rows, cols = img.shape[0], img.shape[1]
+            curve_coords = np.arange(cols*rows).reshape((cols, rows))
+        # JPK force maps are acquired following a serpentine path,
+        # reverse every other row of the grid
+        curve_coords = np.array(curve_coords)
+        if file_type == "jpk-force-map":
+            curve_coords[1::2] = curve_coords[1::2, ::-1]
+        self.img = img
+        self.shape = (rows, cols)
+        self.curve_coords = curve_coords
+        # Build inverse index relating curve index to pixel
+        curve_indices = curve_coords.ravel()
+        self.pixel_of_curve = np.full(curve_indices.max() + 1, -1, dtype=np.intp)
+        self.pixel_of_curve[curve_indices] = np.arange(curve_indices.size)
+
+    def get_pixel(self, curve_idx):
+        # Get the pixel coordinates of a curve in the map
+        return np.unravel_index(self.pixel_of_curve[curve_idx], self.curve_coords.shape)
+
+def get_map_geometry(session, file):
+    # Only force volume files have a map layout
+    if file is None or not file.isFV:
+        return None
+    # Compute the geometry once per file and reuse it in all widgets
+    file_id = file.filemetadata['Entry_filename']
+    geometry = session.map_geometries.get(file_id)
+    if geometry is None:
+        geometry = MapGeometry(file)
+        session.map_geometries[file_id] = geometry
+    return geometry
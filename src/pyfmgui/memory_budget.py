@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import time
+
+from pyfmgui.shared_arrays import is_shareable, replace_task_arrays
+
+# Memory accounting of the out-of-core processing of the maps. The
+# budget covers the data held by the computation, the curves read and
+# not fitted yet, not the memory used by the interpreters and libraries.
+
+# Seconds between two samples of the resident memory of the processes
+rss_sample_interval = 0.5
+
+def get_task_nbytes(task):
+    # Bytes of the arrays of the curves of a single curve, batch or tile task
+    arrays = {}
+    def add_array(value):
+        if is_shareable(value):
+            arrays[id(value)] = value.nbytes
+        return value
+    replace_task_arrays(task, add_array)
+    return sum(arrays.values())
+
+def get_rss_bytes(pid='self'):
+    # Resident memory of a process, None if it can not be read
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class MemoryBudget:
+    '''
+    Keeps the bytes of the curves read and not fitted yet under a budget.
+    The curves are counted twice, since they are also copied to the
+    workers, through shared memory or pickled.
+
+    :param budget_mb: memory budget in MB
+    '''
+    def __init__(self, budget_mb):
+        self.budget = budget_mb * 1e6
+        self.used = 0
+        self.peak = 0
+        # Bytes of the last curve read, to estimate the curves being read
+        self.last_nbytes = None
+        self.peak_rss = None
+        self.last_sample = 0
+
+    def add(self, nbytes):
+        self.last_nbytes = nbytes
+        self.used += 2 * nbytes
+        self.peak = max(self.peak, self.used)
+
+    def remove(self, nbytes):
+        self.used -= 2 * nbytes
+
+    def is_exceeded(self, nb_reading=0):
+        '''
+        Check if the curves in process, and the nb_reading curves being
+        read, exceed the budget. Until a curve is read only one is read at once.
+        '''
+        if self.last_nbytes is None:
+            return nb_reading > 0
+        return self.used + 2 * nb_reading * self.last_nbytes >= self.budget
+
+    def sample_rss(self):
+        # Get the resident memory of this process and its workers, at most every rss_sample_interval
+        now = time.perf_counter()
+        if now - self.last_sample < rss_sample_interval:
+            return
+        self.last_sample = now
+        rss = get_rss_bytes()
+        if rss is None:
+            return
+        for child in multiprocessing.active_children():
+            rss += get_rss_bytes(child.pid) or 0
+        self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def get_report(self):
+        return {
+            'budget_mb': self.budget / 1e6, 'peak_data_mb': self.peak / 1e6,
+            'peak_rss_mb': None if self.peak_rss is None else self.peak_rss / 1e6
+        }
+
+    def format_report(self):
+        report = self.get_report()
+        line = f"Peak memory of the curves in process: {report['peak_data_mb']:.1f} MB of {report['budget_mb']:.0f} MB"
+        if report['peak_rss_mb'] is not None:
+            line += f", peak resident memory of the processes: {report['peak_rss_mb']:.0f} MB"
+        return line
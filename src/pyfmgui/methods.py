@@ -0,0 +1,214 @@
+import numpy as np
+# Import predefined routines from PyFMRheo
+from pyfmrheo.routines.ViscousDragSteps import doViscousDragSteps
+# Import routines computing the transfer function at a single frequency
+from pyfmgui.routines import doPiezoCharacterization, doMicrorheologyFFT
+# Import routines fitting the sine waves with linear least squares
+from pyfmgui.routines import doMicrorheologySine, doMicrorheologySineBatch
+# Import routines preparing the fit data as the widgets, and reusing the lmfit models of the worker
+from pyfmgui.routines import doHertzFit, doHertzFitCached, doTingFit, doTingFitCached
+
+class AnalysisMethod:
+    '''
+    Declares how an analysis method is computed, stored and exported.
+
+    :param name: method key used in the analysis parameters
+    :param routine: function(fdc, param_dict) analysing a single curve
+    :param session_var: Session attribute holding the results of the method
+    :param result_type: name of the exported results table
+    :param unpack: function(row_dict, result) adding the columns of a curve result
+    :param columns: columns added by unpack, in the exported order
+    :param explode_columns: columns holding one value per modulation segment
+    :param map_fields: scalar fields that can be rendered as parameter maps,
+                       relating the field name to a function getting its value
+    :param batch_routine: optional function(fdcs, param_dict) analysing
+                          several curves at once and returning their results
+    :param batch_size: number of curves sent to the batch routine per task
+    :param cached_routine: optional version of routine reusing the lmfit
+                           models of the worker, used unless the model_cache
+                           parameter is False
+    :param seed_fields: fit params that can be used as initial values for
+                        the neighbouring curves, relating the name of the
+                        param in the seed to a function getting its value
+    '''
+    def __init__(self, name, routine, session_var, result_type, unpack, columns,
+                 explode_columns=(), map_fields=None, batch_routine=None, batch_size=64, cached_routine=None,
+                 seed_fields=None):
+        self.name = name
+        self.routine = routine
+        self.session_var = session_var
+        self.result_type = result_type
+        self.unpack = unpack
+        self.columns = list(columns)
+        self.explode_columns = list(explode_columns)
+        self.map_fields = map_fields or {}
+        self.batch_routine = batch_routine
+        self.batch_size = batch_size
+        self.cached_routine = cached_routine
+        self.seed_fields = seed_fields or {}
+
+# Exported attributes of the Hertz and Ting fit results
+hertz_result_fields = [
+    ('hertz_ind_geometry', 'ind_geom'),
+    ('hertz_tip_parameter', 'tip_parameter'),
+    ('hertz_apply_BEC', 'apply_bec_flag'),
+    ('hertz_BEC_model', 'bec_model'),
+    ('hertz_fit_hline_on_baseline', 'fit_hline_flag'),
+    ('hertz_delta0', 'delta0'),
+    ('hertz_E0', 'E0'),
+    ('hertz_f0', 'f0'),
+    ('hertz_slope', 'slope'),
+    ('hertz_poisson_ratio', 'poisson_ratio'),
+    ('hertz_sample_height', 'sample_height'),
+    ('hertz_MAE', 'MAE'),
+    ('hertz_MSE', 'MSE'),
+    ('hertz_RMSE', 'RMSE'),
+    ('hertz_Rsquared', 'Rsquared'),
+    ('hertz_chisq', 'chisq'),
+    ('hertz_redchi', 'redchi')
+]
+
+ting_result_fields = [
+    ('ting_ind_geometry', 'ind_geom'),
+    ('ting_tip_parameter', 'tip_parameter'),
+    ('ting_modelFt', 'modelFt'),
+    ('ting_apply_BEC', 'apply_bec_flag'),
+    ('ting_BEC_model', 'bec_model'),
+    ('ting_fit_hline_on_baseline', 'fit_hline_flag'),
+    ('ting_t0', 't0'),
+    ('ting_E0', 'E0'),
+    ('ting_tc', 'tc'),
+    ('ting_betaE', 'betaE'),
+    ('ting_f0', 'F0'),
+    ('ting_poisson_ratio', 'poisson_ratio'),
+    ('ting_vdrag', 'vdrag'),
+    ('ting_smooth_w', 'smooth_w'),
+    ('ting_idx_tm', 'idx_tm'),
+    ('ting_MAE', 'MAE'),
+    ('ting_MSE', 'MSE'),
+    ('ting_RMSE', 'RMSE'),
+    ('ting_Rsquared', 'Rsquared'),
+    ('ting_chisq', 'chisq'),
+    ('ting_redchi', 'redchi')
+]
+
+def unpack_hertz_result(row_dict, hertz_result):
+    for column, attribute in hertz_result_fields:
+        row_dict[column] = getattr(hertz_result, attribute)
+    return row_dict
+
+def unpack_ting_result(row_dict, ting_result):
+    for column, attribute in ting_result_fields:
+        row_dict[column] = getattr(ting_result, attribute)
+    return row_dict
+
+def unpack_tingfit_result(row_dict, tingfit_result):
+    # TingFit returns the Ting fit and the Hertz fit used to initialize it
+    ting_result, hertz_result = tingfit_result
+    if ting_result is not None and hertz_result is not None:
+        row_dict = unpack_hertz_result(row_dict, hertz_result)
+        row_dict = unpack_ting_result(row_dict, ting_result)
+    return row_dict
+
+def unpack_piezochar_result(row_dict, piezochar_result):
+    row_dict['frequency'] = piezochar_result[0]
+    row_dict['fi_degrees'] = piezochar_result[1]
+    row_dict['amp_quotient'] = piezochar_result[2]
+    return row_dict
+
+def unpack_vdrag_result(row_dict, vdrag_result):
+    row_dict['frequency'] = vdrag_result[0]
+    row_dict['Bh'] = vdrag_result[1]
+    row_dict['Hd_real'] = vdrag_result[2].real
+    row_dict['Hd_imag'] = vdrag_result[2].imag
+    row_dict['distances'] = vdrag_result[4]
+    row_dict['fi_degrees'] = vdrag_result[5]
+    row_dict['amp_quotient'] = vdrag_result[6]
+    return row_dict
+
+def unpack_microrheo_result(row_dict, microrheo_result):
+    row_dict['frequency'] = microrheo_result[0]
+    row_dict['G_storage'] = microrheo_result[1]
+    row_dict['G_loss'] = microrheo_result[2]
+    row_dict['losstan'] = np.array(row_dict['G_storage']) / np.array(row_dict['G_loss'])
+    row_dict['fi_degrees'] = microrheo_result[-4]
+    row_dict['amp_quotient'] = microrheo_result[-3]
+    row_dict['B(0)'] = microrheo_result[-2]
+    row_dict['w_ind'] = microrheo_result[-1]
+    return row_dict
+
+# Scalar fields that can be rendered as parameter maps
+hertz_map_fields = {
+    'E0': lambda result: result.E0,
+    'd0': lambda result: result.delta0,
+    'redchi': lambda result: result.redchi
+}
+
+ting_map_fields = {
+    'E0': lambda result: result[0].E0,
+    'betaE': lambda result: result[0].betaE,
+    'tc': lambda result: result[0].tc,
+    'redchi': lambda result: result[0].redchi,
+    'Hertz E0': lambda result: result[1].E0,
+    'd0': lambda result: result[1].delta0
+}
+
+# Converged params used as initial values for the neighbouring curves
+hertz_seed_fields = {
+    'E0': lambda result: result.E0,
+    'delta0': lambda result: result.delta0
+}
+
+ting_seed_fields = {
+    'E0': lambda result: result[0].E0,
+    'betaE': lambda result: result[0].betaE,
+    'hertz_E0': lambda result: result[1].E0,
+    'hertz_delta0': lambda result: result[1].delta0
+}
+
+microrheo_columns = ['frequency', 'G_storage', 'G_loss', 'losstan', 'fi_degrees', 'amp_quotient', 'B(0)', 'w_ind']
+microrheo_explode_columns = ['frequency', 'G_storage', 'G_loss', 'losstan', 'fi_degrees', 'amp_quotient']
+
+analysis_methods = {}
+
+def register_method(method):
+    analysis_methods[method.name] = method
+    return method
+
+def get_method(name):
+    return analysis_methods.get(name)
+
+def get_result_types():
+    # Get the exported tables, methods sharing a table are exported together
+    result_types = {}
+    for method in analysis_methods.values():
+        result_types.setdefault(method.result_type, method)
+    return result_types
+
+register_method(AnalysisMethod(
+    "HertzFit", doHertzFit, 'hertz_fit_results', 'hertz_results', unpack_hertz_result,
+    [column for column, _ in hertz_result_fields], map_fields=hertz_map_fields, cached_routine=doHertzFitCached,
+    seed_fields=hertz_seed_fields
+))
+register_method(AnalysisMethod(
+    "TingFit", doTingFit, 'ting_fit_results', 'ting_results', unpack_tingfit_result,
+    [column for column, _ in hertz_result_fields + ting_result_fields], map_fields=ting_map_fields,
+    cached_routine=doTingFitCached, seed_fields=ting_seed_fields
+))
+register_method(AnalysisMethod(
+    "PiezoChar", doPiezoCharacterization, 'piezo_char_results', 'piezochar_results', unpack_piezochar_result,
+    ['frequency', 'fi_degrees', 'amp_quotient'], explode_columns=['frequency', 'fi_degrees', 'amp_quotient']
+))
+register_method(AnalysisMethod(
+    "VDrag", doViscousDragSteps, 'vdrag_results', 'vdrag_results', unpack_vdrag_result,
+    ['frequency', 'Bh', 'Hd_real', 'Hd_imag', 'distances', 'fi_degrees', 'amp_quotient'],
+    explode_columns=['frequency', 'Bh', 'Hd_real', 'Hd_imag', 'distances', 'fi_degrees', 'amp_quotient']
+))
+register_method(AnalysisMethod(
+    "Microrheo", doMicrorheologyFFT, 'microrheo_results', 'microrheo_results', unpack_microrheo_result,
+    microrheo_columns, explode_columns=microrheo_explode_columns
+))
+register_method(AnalysisMethod(
+    "MicrorheoSine", doMicrorheologySine, 'microrheo_results', 'microrheo_results', unpack_microrheo_result,
+    microrheo_columns, explode_columns=microrheo_explode_columns, batch_routine=doMicrorheologySineBatch
+))
@@ -0,0 +1,196 @@
+import numpy as np
+from lmfit import Model, Parameters
+
+from pyfmrheo.models.geom_coeffs import get_coeff
+
+# lmfit models prepared in this process, by method and fit settings.
+# Each worker process keeps its own cache, filled by the first curve
+# fitted with some settings and reused by the following curves.
+model_cache = {}
+
+class CachedModel:
+    '''
+    lmfit Model and parameter template reused by the fits done with
+    the same settings. Only the data, initial values and bounds change
+    between fits. The model function evaluates the model object of the
+    curve being fitted, assigned to current before each fit.
+
+    :param build_func: function(cached_model) returning the model function
+    :param param_names: free parameters of the model function
+    '''
+    def __init__(self, build_func, param_names):
+        self.current = None
+        self.kwargs = {}
+        self.model = Model(build_func(self))
+        self.params = Parameters()
+        for name in param_names:
+            self.params.add(name)
+
+    def fit(self, current, data, param_values, kwargs=None, **independent_vars):
+        # Reset the initial values and bounds of the template,
+        # lmfit copies the parameters so the template is not modified.
+        for name, (value, min_value, max_value) in param_values.items():
+            self.params[name].set(value=value, min=min_value, max=max_value)
+        self.current = current
+        self.kwargs = kwargs or {}
+        try:
+            return self.model.fit(data, self.params, **independent_vars)
+        finally:
+            self.current = None
+            self.kwargs = {}
+
+def get_cached_model(key, build_func, param_names):
+    cached_model = model_cache.get(key)
+    if cached_model is None:
+        cached_model = CachedModel(build_func, param_names)
+        model_cache[key] = cached_model
+    return cached_model
+
+def clear_model_cache():
+    model_cache.clear()
+
+def hertz_force(hertz_model, indentation, delta0, E0, f0, slope=None, sample_height=None):
+    # Vectorized version of HertzModel.model
+    force = np.zeros(indentation.shape)
+    # Get the value of the contact point
+    idx = (np.abs(indentation - delta0)).argmin()
+    delta0 = indentation[idx]
+    # Get indenter shape coefficient and exponent
+    coeff, n = get_coeff(hertz_model.ind_geom, hertz_model.tip_parameter, hertz_model.poisson_ratio)
+    # Get bottom effect correction coefficients
+    if hertz_model.bec_model and sample_height:
+        bec_coeffs = hertz_model.get_bec_coeffs(sample_height, indentation)
+    else:
+        bec_coeffs = np.ones(indentation.shape)
+    contact = ~(indentation < delta0)
+    # Non contact part, a line or f0
+    if hertz_model.fit_hline_flag:
+        force[~contact] = (indentation[~contact] - delta0) * slope + f0
+    else:
+        force[~contact] = f0
+    # Hertz model on the contact part
+    force[contact] = coeff * bec_coeffs[contact] * E0 * np.power((indentation[contact] - delta0), n) + f0
+    return force
+
+def build_hertz_func(cached_model, fit_hline_flag):
+    if fit_hline_flag:
+        def hertzmodel(indentation, delta0, E0, f0, slope):
+            hertz_model = cached_model.current
+            return hertz_force(hertz_model, indentation, delta0, E0, f0, slope, hertz_model.sample_height)
+    else:
+        def hertzmodel(indentation, delta0, E0, f0):
+            hertz_model = cached_model.current
+            return hertz_force(hertz_model, indentation, delta0, E0, f0, hertz_model.slope, hertz_model.sample_height)
+    return hertzmodel
+
+def seed_param_values(param_values, seed):
+    # Replace the initial values by the values given in seed, keeping the bounds
+    for name, value in (seed or {}).items():
+        if name in param_values and np.isfinite(value):
+            param_values[name] = (value, *param_values[name][1:])
+    return param_values
+
+def fit_hertz_model(hertz_model, indentation, force, sample_height=None, seed=None):
+    '''
+    Same as HertzModel.fit, using the lmfit model cached
+    for the fit settings and the vectorized Hertz model.
+    The initial values of the params in seed replace the
+    computed ones, to start from the result of another curve.
+    '''
+    # If sample height is given, assign sample height
+    hertz_model.sample_height = sample_height
+    coeff, n = get_coeff(hertz_model.ind_geom, hertz_model.tip_parameter, hertz_model.poisson_ratio)
+    hertz_model.E0_init = np.max(force) / coeff / np.max(indentation) ** n
+    # Get the model prepared for the fit settings
+    fit_hline_flag = hertz_model.fit_hline_flag
+    key = ('HertzFit', hertz_model.ind_geom, hertz_model.bec_model, fit_hline_flag)
+    param_names = ['delta0', 'E0', 'f0', 'slope'] if fit_hline_flag else ['delta0', 'E0', 'f0']
+    cached_model = get_cached_model(key, lambda cached: build_hertz_func(cached, fit_hline_flag), param_names)
+    # Initial values and bounds of the free params
+    param_values = {
+        'delta0': (hertz_model.delta0_init, hertz_model.delta0_min, hertz_model.delta0_max),
+        'E0': (hertz_model.E0_init, hertz_model.E0_min, hertz_model.E0_max),
+        'f0': (hertz_model.f0_init, hertz_model.f0_min, hertz_model.f0_max)
+    }
+    if fit_hline_flag:
+        param_values['slope'] = (hertz_model.slope_init, hertz_model.slope_min, hertz_model.slope_max)
+    param_values = seed_param_values(param_values, seed)
+    # Do fit
+    hertz_model.n_params = len(param_names)
+    result_hertz = cached_model.fit(hertz_model, force, param_values, indentation=indentation)
+    hertz_model.nfev = result_hertz.nfev
+    # Assign fit results to model params
+    hertz_model.delta0 = result_hertz.best_values['delta0']
+    hertz_model.E0 = result_hertz.best_values['E0']
+    hertz_model.f0 = result_hertz.best_values['f0']
+    if fit_hline_flag:
+        hertz_model.slope = result_hertz.best_values['slope']
+    # Compute metrics
+    modelPredictions = hertz_force(
+        hertz_model, indentation, hertz_model.delta0, hertz_model.E0, hertz_model.f0, hertz_model.slope, sample_height
+    )
+    absError = modelPredictions - force
+    hertz_model.MAE = np.mean(absError)
+    hertz_model.SE = np.square(absError)
+    hertz_model.MSE = np.mean(hertz_model.SE)
+    hertz_model.RMSE = np.sqrt(hertz_model.MSE)
+    hertz_model.Rsquared = 1.0 - (np.var(absError) / np.var(force))
+    # Get goodness of fit params
+    a = (force - modelPredictions)**2 / force
+    hertz_model.chisq = np.sum(a[np.isfinite(a)])
+    hertz_model.redchi = hertz_model.chisq / hertz_model.n_params
+
+def build_ting_func(cached_model):
+    def tingmodel(time, E0, tc, betaE, F0):
+        return cached_model.current.model(time, E0, tc, betaE, F0, **cached_model.kwargs)
+    return tingmodel
+
+def fit_ting_model(ting_model, time, F, delta, t0, idx_tm=None, smooth_w=None, v0t=None, v0r=None, seed=None):
+    '''
+    Same as TingModel.fit, using the lmfit model cached for the fit settings.
+    The initial values of the params in seed replace the computed ones.
+    '''
+    # Define fixed params
+    ting_model.t0 = t0
+    ting_model.idx_tm = idx_tm
+    ting_model.smooth_w = smooth_w
+    ting_model.v0t = v0t
+    ting_model.v0r = v0r
+    fixed_params = {
+        't0': ting_model.t0, 'F': F, 'delta': delta,
+        'modelFt': ting_model.modelFt, 'vdrag': ting_model.vdrag, 'smooth_w': ting_model.smooth_w,
+        'idx_tm': ting_model.idx_tm, 'v0t': ting_model.v0t, 'v0r': ting_model.v0r
+    }
+    # Get the model prepared for the fit settings
+    key = ('TingFit', ting_model.ind_geom, ting_model.modelFt)
+    param_names = ['E0', 'tc', 'betaE', 'F0']
+    cached_model = get_cached_model(key, build_ting_func, param_names)
+    # Initial values and bounds of the free params
+    param_values = {
+        'E0': (ting_model.E0_init, ting_model.E0_min, ting_model.E0_max),
+        'tc': (ting_model.tc_init, ting_model.tc_min, ting_model.tc_max),
+        'betaE': (ting_model.betaE_init, ting_model.betaE_min, ting_model.betaE_max),
+        'F0': (ting_model.F0_init, ting_model.F0_min, ting_model.F0_max)
+    }
+    param_values = seed_param_values(param_values, seed)
+    # Do fit
+    ting_model.n_params = len(param_names)
+    result_ting = cached_model.fit(ting_model, F, param_values, fixed_params, time=time)
+    ting_model.nfev = result_ting.nfev
+    # Assign fit results to model params
+    ting_model.E0 = result_ting.best_values['E0']
+    ting_model.tc = result_ting.best_values['tc']
+    ting_model.betaE = result_ting.best_values['betaE']
+    ting_model.F0 = result_ting.best_values['F0']
+    # Compute metrics
+    modelPredictions = ting_model.eval(time, F, delta, t0, idx_tm, smooth_w, v0t, v0r)
+    absError = modelPredictions - F
+    ting_model.MAE = np.mean(absError)
+    ting_model.SE = np.square(absError)
+    ting_model.MSE = np.mean(ting_model.SE)
+    ting_model.RMSE = np.sqrt(ting_model.MSE)
+    ting_model.Rsquared = 1.0 - (np.var(absError) / np.var(F))
+    # Get goodness of fit params
+    a = (F - modelPredictions)**2 / F
+    ting_model.chisq = np.sum(a[np.isfinite(a)])
+    ting_model.redchi = ting_model.chisq / ting_model.n_params
@@ -0,0 +1,167 @@
+import contextlib
+import contextvars
+import cProfile
+import pstats
+import time
+import numpy as np
+
+# Spans used to tell if a computation is limited by I/O, CPU or IPC.
+# The spans recorded inside the fit spans, like poc, detrend and
+# sine_fit, are left out so that their time is only counted once.
+span_groups = {
+    'I/O': ('load_file', 'getcurve'),
+    'CPU': ('preprocess', 'fit', 'save', 'export'),
+    'IPC': ('ipc_wait',)
+}
+
+class SpanRecorder:
+    '''
+    Spans and cProfile stats of a computation, since the last time they
+    were collected. Several computations can run in the threads of a
+    process, like the jobs of the job server, each with its recorder.
+    '''
+    def __init__(self):
+        # Durations in seconds of the spans by span name
+        self.spans = {}
+        # cProfile stats received from the worker processes
+        self.profiles = []
+
+    def add_span(self, name, duration):
+        self.spans.setdefault(name, []).append(duration)
+
+    def pop_spans(self):
+        spans = self.spans
+        self.spans = {}
+        return spans
+
+    def collect(self):
+        stats = ProfileStats(self.pop_spans(), self.profiles)
+        self.profiles = []
+        return stats
+
+# Recorder of the computation running in the current thread, the spans
+# recorded outside of a computation and in the workers use the default one
+current_recorder = contextvars.ContextVar('current_recorder', default=SpanRecorder())
+
+@contextlib.contextmanager
+def recording(recorder=None):
+    '''
+    Record the spans of the enclosed code in their own recorder. The
+    threads started meanwhile use the default recorder, pass them the
+    recorder with run_recorded.
+    '''
+    recorder = recorder or SpanRecorder()
+    token = current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        current_recorder.reset(token)
+
+def run_recorded(recorder, fn, *args):
+    # Run fn(*args) in a thread of a pool recording its spans in recorder
+    with recording(recorder):
+        return fn(*args)
+
+def add_span(name, duration):
+    current_recorder.get().add_span(name, duration)
+
+@contextlib.contextmanager
+def span(name):
+    # Record the duration of the enclosed code
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - start)
+
+def pop_spans():
+    return current_recorder.get().pop_spans()
+
+def run_timed(profile, fn, *args):
+    '''
+    Run fn(*args) in a worker process and return its result together
+    with the timing of the task, so it can be aggregated in the parent.
+    If profile is True the task is also run under cProfile.
+    '''
+    # Drop spans recorded outside of a task
+    pop_spans()
+    start = time.time()
+    if profile:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(fn, *args)
+        profiler.create_stats()
+        stats = profiler.stats
+    else:
+        result = fn(*args)
+        stats = None
+    timing = {'start': start, 'end': time.time(), 'spans': pop_spans(), 'stats': stats}
+    return result, timing
+
+def record_task(submit_time, timing):
+    # Add the timing of a task run with run_timed to the spans of the computation
+    recorder = current_recorder.get()
+    for name, durations in timing['spans'].items():
+        recorder.spans.setdefault(name, []).extend(durations)
+    # Time waiting for a free worker and time to send back the result
+    recorder.add_span('queue_wait', max(timing['start'] - submit_time, 0))
+    recorder.add_span('ipc_wait', max(time.time() - timing['end'], 0))
+    if timing['stats'] is not None:
+        recorder.profiles.append(timing['stats'])
+
+def collect():
+    # Get the spans and profiles of the computation recorded since the last call
+    return current_recorder.get().collect()
+
+class StatsHolder:
+    # Allows to load a cProfile stats dictionary with pstats
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+class ProfileStats:
+    '''
+    Timing spans and cProfile stats of a computation.
+
+    :param spans: dictionary with the durations of each span
+    :param profiles: list of cProfile stats dictionaries
+    '''
+    def __init__(self, spans=None, profiles=None):
+        self.spans = spans or {}
+        self.profiles = profiles or []
+
+    def summary(self):
+        # Get count, total and percentiles in seconds of each span
+        rows = []
+        for name, durations in self.spans.items():
+            durations = np.asarray(durations)
+            p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+            rows.append((name, len(durations), durations.sum(), p50, p90, p99, durations.max()))
+        return rows
+
+    def format_summary(self):
+        lines = [f"{'Span':<12}{'Count':>7}{'Total(s)':>10}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'Max(ms)':>10}"]
+        for name, count, total, p50, p90, p99, max_duration in self.summary():
+            lines.append(
+                f"{name:<12}{count:>7}{total:>10.3f}{1e3*p50:>10.2f}{1e3*p90:>10.2f}{1e3*p99:>10.2f}{1e3*max_duration:>10.2f}"
+            )
+        # Share of the time spent in I/O, CPU and IPC
+        totals = {
+            group: sum(sum(self.spans.get(name, [])) for name in names) for group, names in span_groups.items()
+        }
+        total = sum(totals.values())
+        if total > 0:
+            lines.append(' | '.join(f'{group}: {100 * t / total:.0f}%' for group, t in totals.items()))
+        return '\n'.join(lines)
+
+    def dump_stats(self, path):
+        # Save the merged cProfile stats, readable with pstats or snakeviz
+        if not self.profiles:
+            return False
+        # Copy the first profile as pstats merges the others into it
+        stats = pstats.Stats(StatsHolder(dict(self.profiles[0])))
+        for profile in self.profiles[1:]:
+            stats.add(StatsHolder(profile))
+        stats.dump_stats(path)
+        return True
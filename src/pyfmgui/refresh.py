@@ -0,0 +1,91 @@
+from pyqtgraph.Qt import QtCore
+
+def values_equal(a, b):
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+class RefreshScheduler(QtCore.QObject):
+    '''
+    Coalesces the refresh requests of a widget.
+
+    Requests made within the refresh window are merged and
+    executed once, a pending full refresh supersedes any
+    pending partial refresh. Parameter changes only request
+    a refresh when the value of the parameter really changed.
+
+    :param full_refresh: callback redrawing all the plots of the widget
+    :param delay: refresh window in ms
+    '''
+    def __init__(self, full_refresh, delay=50, parent=None):
+        super(RefreshScheduler, self).__init__(parent)
+        self.full_refresh = full_refresh
+        self.pending = []
+        self.connections = set()
+        self.last_values = {}
+        self.refreshing = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+
+    def connect_once(self, sender, signal_name, slot):
+        # Connect the signal only if it was not connected before
+        key = (id(sender), signal_name, slot)
+        if key in self.connections:
+            return
+        self.connections.add(key)
+        getattr(sender, signal_name).connect(slot)
+
+    def watch(self, param, callback=None):
+        # Request a refresh when the value of the parameter changes
+        if callback is None:
+            callback = self.full_refresh
+        key = (id(param), 'sigValueChanged', callback)
+        if key in self.connections:
+            return
+        self.connections.add(key)
+        self.last_values[id(param)] = param.value()
+        param.sigValueChanged.connect(
+            lambda param, value: self.value_changed(param, value, callback)
+        )
+
+    def value_changed(self, param, value, callback):
+        last_value = self.last_values.get(id(param))
+        self.last_values[id(param)] = value
+        # Skip changes made by the refresh itself or not changing the value
+        if self.refreshing or values_equal(last_value, value):
+            return
+        self.request(callback)
+
+    def request(self, callback=None):
+        if callback is None:
+            callback = self.full_refresh
+        if self.full_refresh in self.pending:
+            pass
+        elif callback == self.full_refresh:
+            self.pending = [callback]
+        elif callback not in self.pending:
+            self.pending.append(callback)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def cancel(self):
+        self.timer.stop()
+        self.pending = []
+
+    def refresh_now(self):
+        # Run the full refresh at once, it supersedes the pending requests
+        self.cancel()
+        self.pending = [self.full_refresh]
+        self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        self.refreshing = True
+        try:
+            for callback in pending:
+                callback()
+        finally:
+            self.refreshing = False
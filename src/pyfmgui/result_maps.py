@@ -0,0 +1,91 @@
+import numpy as np
+
+# Import the registry declaring the fields mapped for each method
+from pyfmgui.methods import get_method
+from pyfmgui.result_store import StoredFileResults, get_field_column
+
+class ResultMap:
+    '''
+    Scatters the scalar fields of the results of a force map
+    into 2D arrays following the layout of the map.
+
+    The maps are updated incrementally, only the results appended
+    to the file results since the last update are scattered.
+
+    :param geometry: MapGeometry of the file
+    :param fields: dictionary relating field names to value getters
+    '''
+    def __init__(self, geometry, fields):
+        self.geometry = geometry
+        self.shape = geometry.curve_coords.shape
+        self.pixel_of_curve = geometry.pixel_of_curve
+        self.fields = fields
+        self.reset()
+
+    def reset(self):
+        self.file_results = None
+        self.n_scattered = 0
+        self.maps = {field: np.full(self.shape, np.nan) for field in self.fields}
+
+    def update(self, file_results):
+        # A new list of results means that the file was recomputed
+        if file_results is not self.file_results:
+            self.reset()
+            self.file_results = file_results
+        if file_results is None:
+            return
+        if isinstance(file_results, StoredFileResults):
+            self.update_stored(file_results)
+            return
+        new_results = file_results[self.n_scattered:]
+        self.n_scattered = len(file_results)
+        new_results = [
+            (curve_idx, result) for curve_idx, result in new_results
+            if result is not None and 0 <= curve_idx < self.pixel_of_curve.size
+        ]
+        if not new_results:
+            return
+        curve_indices = np.array([curve_idx for curve_idx, _ in new_results], dtype=np.intp)
+        pixels = self.pixel_of_curve[curve_indices]
+        valid = pixels >= 0
+        for field, getter in self.fields.items():
+            values = np.full(len(new_results), np.nan)
+            for i, (_, result) in enumerate(new_results):
+                try:
+                    values[i] = getter(result)
+                except Exception:
+                    continue
+            self.maps[field].flat[pixels[valid]] = values[valid]
+
+    def update_stored(self, file_results):
+        # Read the values of the fields from the columns written
+        # to disk, without loading the results of the curves
+        start = self.n_scattered
+        curve_indices = file_results.get_column('curve_idx', start).astype(np.intp)
+        self.n_scattered = start + len(curve_indices)
+        inside = (curve_indices >= 0) & (curve_indices < self.pixel_of_curve.size)
+        pixels = self.pixel_of_curve[curve_indices[inside]]
+        valid = pixels >= 0
+        for field in self.fields:
+            # Chunks written meanwhile are scattered in the next update
+            values = file_results.get_column(get_field_column(field), start)[:len(curve_indices)]
+            self.maps[field].flat[pixels[valid]] = values[inside][valid]
+
+    def get(self, field):
+        return self.maps[field]
+
+def get_result_map(session, method, file_id, geometry):
+    # Get the fields that can be mapped for the method
+    method_info = get_method(method)
+    if method_info is None or not method_info.map_fields or geometry is None:
+        return None
+    fields = method_info.map_fields
+    # Reuse the map computed for the file if the layout did not change
+    key = (method, file_id)
+    result_map = session.result_maps.get(key)
+    if result_map is None or result_map.geometry is not geometry:
+        result_map = ResultMap(geometry, fields)
+        session.result_maps[key] = result_map
+    # Scatter the results computed since the last update
+    result_map.update(getattr(session, method_info.session_var).get(file_id))
+    return result_map
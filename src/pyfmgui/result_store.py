@@ -0,0 +1,178 @@
+import itertools
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+
+# Disk-backed storage of the results of the maps computed out-of-core.
+# The results of a file are written in chunks, each chunk is a npz file
+# with a column for the curve indices, a column for each field of the
+# parameter maps and the pickled results, loaded only when needed.
+
+def get_field_column(field):
+    # Name of the column holding the values of a map field
+    return f'map_{field}'
+
+class StoredFileResults:
+    '''
+    Results of a file kept on disk, used in the session as the list of
+    (curve_idx, result) of the file. Iterating over it loads the
+    chunks one at a time.
+
+    :param dirname: directory holding the chunks
+    :param method: method computing the results
+    '''
+    def __init__(self, dirname, method):
+        self.dirname = dirname
+        self.method = method
+        self.chunks = []
+        # Curve indices of the rows of each chunk, to find a curve without loading the chunks
+        self.chunk_curves = []
+        self.nb_rows = 0
+        self.cached_chunk = None
+
+    def __getstate__(self):
+        # The chunks are read from disk when sent to the export workers
+        state = self.__dict__.copy()
+        state['cached_chunk'] = None
+        return state
+
+    def append(self, curve_results):
+        '''
+        Write a chunk with a list of (curve_idx, result).
+        '''
+        # Import the registry when the first results are saved, it imports the routines
+        from pyfmgui.methods import get_method
+        if not curve_results:
+            return
+        path = os.path.join(self.dirname, f'chunk_{len(self.chunks):06d}.npz')
+        columns = {'curve_idx': np.array([curve_idx for curve_idx, _ in curve_results], dtype=np.int64)}
+        # Get the values of the map fields, NaN for the failed curves
+        for field, getter in get_method(self.method).map_fields.items():
+            values = np.full(len(curve_results), np.nan)
+            for i, (_, result) in enumerate(curve_results):
+                if result is None or isinstance(result, Exception):
+                    continue
+                try:
+                    values[i] = getter(result)
+                except Exception:
+                    continue
+            columns[get_field_column(field)] = values
+        results = np.empty(len(curve_results), dtype=object)
+        results[:] = [result for _, result in curve_results]
+        np.savez(path, results=results, **columns)
+        self.chunks.append((path, len(curve_results)))
+        self.chunk_curves.append(columns['curve_idx'])
+        self.nb_rows += len(curve_results)
+
+    def __len__(self):
+        return self.nb_rows
+
+    def load_chunk(self, chunk_idx):
+        # Keep the last chunk loaded, the widgets look for several curves in a row
+        if self.cached_chunk is None or self.cached_chunk[0] != chunk_idx:
+            with np.load(self.chunks[chunk_idx][0], allow_pickle=True) as data:
+                rows = list(zip(data['curve_idx'].tolist(), data['results']))
+            self.cached_chunk = (chunk_idx, rows)
+        return self.cached_chunk[1]
+
+    def iter_chunks(self, start=0):
+        # Get the index of each chunk holding rows from start and the position of its first row
+        chunk_start = 0
+        for chunk_idx, (_, nb_rows) in enumerate(list(self.chunks)):
+            if chunk_start + nb_rows > start:
+                yield chunk_idx, chunk_start
+            chunk_start += nb_rows
+
+    def __iter__(self):
+        for chunk_idx, _ in self.iter_chunks():
+            yield from self.load_chunk(chunk_idx)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(*index.indices(len(self)))
+            if not indices:
+                return []
+            # Load the rows between the first and last index, in any step direction
+            start, stop = min(indices), max(indices) + 1
+            rows = []
+            for chunk_idx, chunk_start in self.iter_chunks(start):
+                if chunk_start >= stop:
+                    break
+                rows.extend(self.load_chunk(chunk_idx)[max(start - chunk_start, 0):stop - chunk_start])
+            return [rows[i - start] for i in indices]
+        if index < 0:
+            index += len(self)
+        for chunk_idx, chunk_start in self.iter_chunks(index):
+            return self.load_chunk(chunk_idx)[index - chunk_start]
+        raise IndexError('result index out of range')
+
+    def get(self, curve_idx, default=None):
+        '''
+        Get the result of a curve, loading only the chunk holding it.
+        '''
+        # The last result of the curve is the most recent one
+        for chunk_idx in reversed(range(len(self.chunk_curves))):
+            positions = np.flatnonzero(self.chunk_curves[chunk_idx] == curve_idx)
+            if len(positions):
+                return self.load_chunk(chunk_idx)[positions[-1]][1]
+        return default
+
+    def get_column(self, name, start=0):
+        '''
+        Get the values of a column from the row start, without loading the results.
+        '''
+        values = []
+        for chunk_idx, chunk_start in self.iter_chunks(start):
+            with np.load(self.chunks[chunk_idx][0]) as data:
+                values.append(data[name][max(start - chunk_start, 0):])
+        return np.concatenate(values) if values else np.zeros(0)
+
+    def delete(self):
+        self.chunks = []
+        self.chunk_curves = []
+        self.nb_rows = 0
+        self.cached_chunk = None
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+def get_curve_result(file_results, curve_idx):
+    '''
+    Get the result of a curve in the results of a file, a list of
+    (curve_idx, result) or a StoredFileResults, or None if not found.
+    '''
+    if isinstance(file_results, StoredFileResults):
+        return file_results.get(curve_idx)
+    for result_curve_idx, result in reversed(file_results):
+        if result_curve_idx == curve_idx:
+            return result
+    return None
+
+class ResultStore:
+    '''
+    Creates the StoredFileResults of the session in a temporary
+    directory, removed when the results are cleared or on exit.
+
+    :param root: directory where the temporary directory is created,
+                 the default temporary directory if None
+    '''
+    def __init__(self, root=None):
+        self.root = root
+        self.dirname = None
+        self.finalizer = None
+        self.counter = itertools.count()
+
+    def create(self, method, file_id):
+        if self.dirname is None:
+            self.dirname = tempfile.mkdtemp(prefix='pyfmgui_results_', dir=self.root)
+            self.finalizer = weakref.finalize(self, shutil.rmtree, self.dirname, True)
+        # File ids can be paths, number the directories instead
+        dirname = os.path.join(self.dirname, f'{next(self.counter):05d}_{method}')
+        os.makedirs(dirname)
+        return StoredFileResults(dirname, method)
+
+    def clear(self):
+        if self.finalizer is not None:
+            self.finalizer()
+        self.dirname = None
+        self.finalizer = None
@@ -0,0 +1,424 @@
+import copy
+import numpy as np
+
+# Import predefined routines and tools from PyFMRheo
+from pyfmrheo.utils.force_curves import get_poc_RoV_method, get_poc_regulaFalsi_method
+from pyfmrheo.utils.force_curves import correct_viscous_drag, correct_tilt, correct_offset
+from pyfmrheo.models.rheology import single_freq_models, ComputeComplexModulusSine
+from pyfmrheo.models.hertz import HertzModel
+
+from pyfmgui.spectral import transfer_function_at
+from pyfmgui.profiling import span
+from pyfmgui.model_cache import fit_hertz_model, fit_ting_model
+from pyfmgui.fit_data import prepare_hertz_fit_data, get_downsample_step
+from pyfmgui.ting_numerical import AcceleratedTingModel
+from pyfmgui.sine_fit import fit_sine_waves
+from pyfmgui.detrend import detrend_segments
+
+# Versions of the PyFMRheo routines evaluating the transfer
+# function only at the frequency of each modulation segment.
+
+def ComputePiezoLag(zheight, deflection, fs, freq, nfft=None, freq_tol=0.0001):
+    # Compute transfer function
+    _, G, gamma2, zheight_hat, deflection_hat =\
+         transfer_function_at(zheight, deflection, fs, freq, nfft=nfft, freq_tol=freq_tol)
+    # Get phase shift in degrees
+    fi = np.angle(G, deg=True)
+    # Get amplitude quotient
+    amp_quotient = np.abs(deflection_hat) / np.abs(zheight_hat)
+    return fi, amp_quotient, gamma2
+
+def ComputeComplexModulusFFT(
+    deflection, zheight, poc, k, fs, freq, ind_shape, tip_parameter,
+    wc, poisson_ratio=0.5, fi=0, amp_quotient=1, bcoef=0, nfft=None, freq_tol=0.0001
+):
+    # Correct zheight based on amplitude quotient
+    # obtained from piezo characterization routine
+    zheight = zheight * amp_quotient
+    # Get indentation and force
+    indentation = zheight - deflection - (poc[0] - poc[1])
+    force = deflection * k - (poc[1] * k)
+    # Compute transfer function
+    _, G, gamma2, _, _ =\
+         transfer_function_at(indentation, force, fs, freq, nfft=nfft, freq_tol=freq_tol)
+    # Compute G'and G''
+    model_func = single_freq_models[ind_shape]
+    G_storage, G_loss = model_func(G, wc, tip_parameter, freq, fi, bcoef, poisson_ratio)
+    return G_storage, G_loss, gamma2
+
+def get_detrended_segments(fdcs, param_dict):
+    '''
+    Get the modulation segments of several curves to analyze with their
+    zheight and deflection detrended using the rolling average method.
+    The segments of all the curves are detrended together.
+
+    Returns a list per curve of (frequency, segment, zheight, deflection, time) tuples.
+    '''
+    curves_segments = []
+    for fdc in fdcs:
+        curve_segments = []
+        for _, segment in fdc.modulation_segments:
+            frequency = segment.segment_metadata['frequency']
+            # Skip segments above the maximum frequency to analyze
+            if param_dict['max_freq'] != 0 and frequency > param_dict['max_freq']:
+                continue
+            curve_segments.append((frequency, segment))
+        curves_segments.append(curve_segments)
+    with span('detrend'):
+        detrended = iter(detrend_segments([
+            (frequency, segment.zheight, segment.vdeflection, segment.time)
+            for curve_segments in curves_segments for frequency, segment in curve_segments
+        ]))
+    return [
+        [(frequency, segment, *next(detrended)) for frequency, segment in curve_segments]
+        for curve_segments in curves_segments
+    ]
+
+def doPiezoCharacterization(fdc, param_dict):
+    results = []
+    for frequency, segment, ntra_in, ntra_out, _ in get_detrended_segments([fdc], param_dict)[0]:
+        time = segment.time
+        fs = 1 / (time[1] - time[0])
+        fi, amp_quotient, gamma2 = ComputePiezoLag(ntra_in, ntra_out, fs, frequency)
+        results.append((frequency, fi, amp_quotient, gamma2))
+    results = sorted(results, key=lambda x: int(x[0]))
+    return tuple([x[i] for x in results] for i in range(4))
+
+def get_working_indentation(fdc, param_dict):
+    # Get segment data to obtain the working indentation. The curve is
+    # left unchanged, it is processed again if a curve of its batch fails.
+    if param_dict['curve_seg'] == 'extend':
+        segment_data = copy.copy(fdc.extend_segments[0][1])
+    else:
+        # The Hertz fit gets the reversed segment, as done by PyFMRheo
+        fdc = copy.deepcopy(fdc)
+        segment_data = fdc.retract_segments[-1][1]
+        segment_data.zheight = segment_data.zheight[::-1]
+        segment_data.vdeflection = segment_data.vdeflection[::-1]
+    # Get initial estimate of PoC
+    with span('poc'):
+        if param_dict['poc_method'] == 'RoV':
+            comp_PoC = get_poc_RoV_method(
+                segment_data.zheight, segment_data.vdeflection, param_dict['poc_win'])
+        else:
+            comp_PoC = get_poc_regulaFalsi_method(
+                segment_data.zheight, segment_data.vdeflection, param_dict['sigma'])
+    poc = [comp_PoC[0], 0]
+    # Perform HertzFit to obtain refined position of PoC
+    hertz_routine = doHertzFitCached if param_dict.get('model_cache', True) else doHertzFit
+    hertz_result = hertz_routine(copy.deepcopy(fdc), param_dict)
+    poc[0] += hertz_result.delta0
+    # Get force vs indentation data
+    segment_data.get_force_vs_indentation(poc, param_dict['k'])
+    # Get working indentation from the parameters or the approach segment
+    wc = param_dict.get('wc')
+    if wc is None:
+        wc = segment_data.indentation.max()
+    return wc
+
+def get_segment_correction(param_dict, frequency, fi=0, amp_quotient=1):
+    # If piezo characterization data has been provided get fi and amp_quotient
+    # for the segment's frequency, else keep the previous values
+    if param_dict['piezo_char_data'] is not None:
+        piezoChar =  param_dict['piezo_char_data'].loc[param_dict['piezo_char_data']['frequency'] == frequency]
+        if len(piezoChar) == 0:
+            print(f"The frequency {frequency} was not found in the piezo characterization dataframe")
+        else:
+            fi = piezoChar['fi_degrees'].item() # In degrees
+            if param_dict['corr_amp']:
+                amp_quotient = piezoChar['amp_quotient'].item()
+            else:
+                amp_quotient = 1
+    return fi, amp_quotient
+
+def doMicrorheologyFFT(fdc, param_dict):
+    # Declare preset params for correcting the raw signals
+    fi = 0
+    amp_quotient = 1
+    wc = get_working_indentation(fdc, param_dict)
+    bcoef = param_dict['bcoef']
+    results = []
+    # Assume d0 as 0, since we are in contact
+    poc = [0, 0]
+    for frequency, segment, zheight, deflection, _ in get_detrended_segments([fdc], param_dict)[0]:
+        time = segment.time
+        fs = 1 / (time[1] - time[0])
+        fi, amp_quotient = get_segment_correction(param_dict, frequency, fi, amp_quotient)
+        # Get G' and G" using the transfer function method
+        G_storage, G_loss, gamma2 =\
+            ComputeComplexModulusFFT(
+                deflection, zheight, poc, param_dict['k'], fs, frequency, param_dict['contact_model'],
+                param_dict['tip_param'], wc, param_dict['poisson'], fi=fi, amp_quotient=amp_quotient, bcoef=bcoef
+            )
+        results.append((frequency, G_storage, G_loss, gamma2, fi, amp_quotient))
+    # Organize and unpack the results for the different segments
+    results = sorted(results, key=lambda x: int(x[0]))
+    return (*([x[i] for x in results] for i in range(6)), bcoef, wc)
+
+# Versions of the PyFMRheo Hertz and Ting fit routines preparing
+# the fit data as done by the preview of the widgets. The cached
+# versions reuse the lmfit models prepared by the previous curves
+# of the worker. The optional seed gives initial values of the fit
+# params, taken from the results of the neighbouring curves of a map.
+
+def prepare_hertz_fit(fdc, param_dict):
+    # Get the Hertz model to fit with the force vs indentation data to fit
+    # Get segment data
+    if param_dict['curve_seg'] == 'extend':
+        segment_data = fdc.extend_segments[0][1]
+    else:
+        segment_data = fdc.retract_segments[-1][1]
+        segment_data.zheight = segment_data.zheight[::-1]
+        segment_data.vdeflection = segment_data.vdeflection[::-1]
+    # Perform tilt correction
+    if param_dict['offset_type'] == 'percentage':
+        deltaz = segment_data.zheight.max() - segment_data.zheight.min()
+        maxoffset = segment_data.zheight.min() + deltaz * param_dict['max_offset']
+        minoffset = segment_data.zheight.min() + deltaz * param_dict['min_offset']
+    else:
+        maxoffset = param_dict['max_offset']
+        minoffset = param_dict['min_offset']
+    if param_dict['correct_tilt']:
+        segment_data.vdeflection =\
+            correct_tilt(segment_data.zheight, segment_data.vdeflection, maxoffset, minoffset)
+    else:
+        segment_data.vdeflection =\
+            correct_offset(segment_data.zheight, segment_data.vdeflection, maxoffset, minoffset)
+    # Get initial estimate of PoC
+    with span('poc'):
+        if param_dict['poc_method'] == 'RoV':
+            comp_PoC = get_poc_RoV_method(
+                segment_data.zheight, segment_data.vdeflection, param_dict['poc_win'])
+        else:
+            comp_PoC = get_poc_regulaFalsi_method(
+                segment_data.zheight, segment_data.vdeflection, param_dict['sigma'])
+    poc = [comp_PoC[0], 0]
+    # Prepare data for the fit, keeping the fit range before downsampling
+    segment_data.get_force_vs_indentation(poc, param_dict['k'])
+    force = segment_data.force - segment_data.force[0]
+    indentation, force = prepare_hertz_fit_data(segment_data.indentation, force, param_dict)
+    # Build Hertz model
+    hertz_model = HertzModel(param_dict['contact_model'], param_dict['tip_param'])
+    hertz_model.fit_hline_flag = param_dict['fit_line']
+    hertz_model.d0_init = param_dict['d0']
+    if not param_dict['auto_init_E0']:
+        hertz_model.E0_init = param_dict['E0']
+    hertz_model.f0_init = param_dict['f0']
+    if param_dict['fit_line']:
+        hertz_model.slope_init = param_dict['slope']
+    return hertz_model, indentation, force
+
+def doHertzFit(fdc, param_dict):
+    hertz_model, indentation, force = prepare_hertz_fit(fdc, param_dict)
+    hertz_model.fit(indentation, force)
+    # Return fitted model object
+    return hertz_model
+
+def doHertzFitCached(fdc, param_dict, seed=None):
+    hertz_model, indentation, force = prepare_hertz_fit(fdc, param_dict)
+    fit_hertz_model(hertz_model, indentation, force, seed=seed)
+    # Return fitted model object
+    return hertz_model
+
+def prepare_ting_fit(fdc, param_dict, seed=None, model_cache=True):
+    '''
+    Get the accelerated Ting model to fit, the result of the Hertz fit
+    refining the contact point, the time, force and indentation to fit
+    and the fixed params of the fit. The Hertz fit reuses the lmfit
+    models of the worker if model_cache is True.
+    '''
+    # Get data from the first extend segments and last retract segment
+    ext_data = fdc.extend_segments[0][1]
+    ret_data = fdc.retract_segments[-1][1]
+    # Perform tilt correction
+    height = np.r_[ext_data.zheight, ret_data.zheight]
+    deflection = np.r_[ext_data.vdeflection, ret_data.vdeflection]
+    idx = len(ext_data.zheight)
+    if param_dict['offset_type'] == 'percentage':
+        deltaz = height.max() - height.min()
+        maxoffset = height.min() + deltaz * param_dict['max_offset']
+        minoffset = height.min() + deltaz * param_dict['min_offset']
+    else:
+        maxoffset = param_dict['max_offset']
+        minoffset = param_dict['min_offset']
+    if param_dict['correct_tilt']:
+        corr_defl = correct_tilt(height, deflection, maxoffset, minoffset)
+    else:
+        corr_defl = correct_offset(height, deflection, maxoffset, minoffset)
+    ext_data.vdeflection = corr_defl[:idx]
+    ret_data.vdeflection = corr_defl[idx:]
+    # Get initial estimate of PoC
+    with span('poc'):
+        if param_dict['poc_method'] == 'RoV':
+            comp_PoC = get_poc_RoV_method(
+                ext_data.zheight, ext_data.vdeflection, param_dict['poc_win'])
+        else:
+            comp_PoC = get_poc_regulaFalsi_method(
+                ext_data.zheight, ext_data.vdeflection, param_dict['sigma'])
+    poc = [comp_PoC[0], 0]
+    # Perform HertzFit to obtain refined position of PoC
+    if model_cache:
+        hertz_seed = {name[6:]: value for name, value in seed.items() if name.startswith('hertz_')} if seed else None
+        hertz_result = doHertzFitCached(copy.deepcopy(fdc), param_dict, hertz_seed)
+    else:
+        hertz_result = doHertzFit(copy.deepcopy(fdc), param_dict)
+    hertz_d0 = hertz_result.delta0
+    hertz_E0 = hertz_result.E0
+    # Shift PoC using d0 obtained in HertzFit
+    poc[0] += hertz_d0
+    poc[1] = 0
+    # Compute force and indentation with new PoC
+    fdc.get_force_vs_indentation(poc, param_dict['k'])
+    ext_indentation = ext_data.indentation
+    ext_force = ext_data.force
+    ext_time = ext_data.time
+    ret_indentation = ret_data.indentation
+    ret_force = ret_data.force
+    ret_time = ret_data.time
+    # Add the time offset between the extend and retract
+    # segments to keep the time vector continuous
+    t_offset = np.abs(ext_data.zheight[-1] - ret_data.zheight[0]) / (ext_data.velocity * -1e-9)
+    dt = np.abs(ext_data.time[1] - ext_data.time[0])
+    if t_offset > 2*dt:
+        ret_time = ret_time + t_offset
+    # Correct for viscous drag by fitting a line on the extend and retract baselines
+    if param_dict['vdragcorr']:
+        ext_force, ret_force = correct_viscous_drag(
+            ext_indentation, ext_force, ret_indentation, ret_force,
+            poly_order=param_dict['polyordr'], speed=param_dict['rampspeed']
+        )
+    # Get the approach and retract velocities from the file header
+    # unless they should be computed by the model
+    if not param_dict['compute_v_flag']:
+        v0t = np.abs(ext_data.zheight.min() - ext_data.zheight.max())/ext_data.segment_metadata['duration']
+        v0r = np.abs(ret_data.zheight.min() - ret_data.zheight.max())/ret_data.segment_metadata['duration']
+    else:
+        v0t, v0r = None, None
+    # Prepare data for TingFit and compute initial values for tc and tm
+    idx_tc = (np.abs(ext_indentation - 0)).argmin()
+    t0 = ext_time[-1]
+    indentation = np.r_[ext_indentation, ret_indentation]
+    time = np.r_[ext_time, ret_time + t0]
+    force = np.r_[ext_force, ret_force]
+    fit_mask = indentation > (-1 * param_dict['contact_offset'])
+    tc = time[idx_tc]
+    ind_fit = indentation[fit_mask]
+    force_fit = force[fit_mask]
+    force_fit = force_fit - force_fit[0]
+    time_fit = time[fit_mask]
+    tc_fit = tc-time_fit[0]
+    time_fit = time_fit - time_fit[0] - tc_fit
+    tc_fit = 0.0
+    # Get indices to downsample signal
+    downfactor = get_downsample_step(len(time_fit), param_dict['pts_downsample'])
+    idxDown = slice(0, len(time_fit), downfactor)
+    # Compute tm and F0 using the downsampled signal
+    idx_tm = np.argmax(force_fit[idxDown])
+    f0idx = np.where(time_fit==0)[0]
+    if v0t is not None:
+        F0_init=force_fit[f0idx]-param_dict['vdrag']*v0t
+    else:
+        F0_init=force_fit[f0idx]
+    # Compute bounds for tc and F0
+    tc_max = tc_fit+downfactor/(1/(time_fit[1]-time_fit[0]))*10
+    tc_min = tc_fit-downfactor/(1/(time_fit[1]-time_fit[0]))*10
+    f0_max = F0_init+100e-12
+    f0_min = F0_init-100e-12
+    # Set params for betaE
+    if param_dict['auto_init_betaE']:
+        betaE_init = 0.05 if hertz_E0 > 10e3 else 0.25
+    else:
+        betaE_init = param_dict['fluid_exp']
+    # Avoid the singularity of the hypergeometric function
+    # at betaE = 0.5 for the paraboloid model
+    if param_dict['contact_model'] == 'paraboloid':
+        betaE_min, betaE_max = 0.01, 0.49
+    else:
+        betaE_min, betaE_max = 0.01, 0.99
+    # Build Ting model
+    ting_model = AcceleratedTingModel(param_dict['contact_model'], param_dict['tip_param'], param_dict['model_type'])
+    ting_model.E0_init = hertz_E0
+    ting_model.E0_min = hertz_E0/1000
+    ting_model.E0_max = np.inf
+    ting_model.tc_init = tc_fit
+    ting_model.tc_min = tc_min
+    ting_model.tc_max = tc_max
+    ting_model.betaE_init = betaE_init
+    ting_model.betaE_min = betaE_min
+    ting_model.betaE_max = betaE_max
+    ting_model.F0_init = F0_init[0]
+    ting_model.F0_min = f0_min[0]
+    ting_model.F0_max = f0_max[0]
+    ting_model.vdrag = param_dict['vdrag']
+    fit_data = (time_fit[idxDown], force_fit[idxDown], ind_fit[idxDown])
+    fixed_params = dict(t0=param_dict['t0'], idx_tm=idx_tm, smooth_w=param_dict['smoothing_win'], v0t=v0t, v0r=v0r)
+    return ting_model, hertz_result, fit_data, fixed_params
+
+def doTingFit(fdc, param_dict):
+    ting_model, hertz_result, fit_data, fixed_params = prepare_ting_fit(fdc, param_dict, model_cache=False)
+    ting_model.fit(*fit_data, **fixed_params)
+    # Return the results of the TingFit and HertzFit
+    return ting_model, hertz_result
+
+def doTingFitCached(fdc, param_dict, seed=None):
+    ting_model, hertz_result, fit_data, fixed_params = prepare_ting_fit(fdc, param_dict, seed)
+    fit_ting_model(ting_model, *fit_data, **fixed_params, seed=seed)
+    # Return the results of the TingFit and HertzFit
+    return ting_model, hertz_result
+
+# Version of the PyFMRheo sine fit routine solving the sine
+# fits of all the modulation segments of several curves with
+# a single linear least squares problem.
+
+def get_sine_segments(param_dict, detrended_segments):
+    # Get the detrended signals of the modulation segments to fit
+    fi = 0
+    amp_quotient = 1
+    segments = []
+    for frequency, _, zheight, deflection, time in detrended_segments:
+        fi, amp_quotient = get_segment_correction(param_dict, frequency, fi, amp_quotient)
+        # Get indentation asuming d0 = 0
+        indentation = zheight - deflection
+        segments.append((frequency, time, indentation, deflection, fi, amp_quotient))
+    return segments
+
+def doMicrorheologySineBatch(fdcs, param_dict):
+    bcoef = param_dict['bcoef']
+    # Get the working indentation and the segments of each curve
+    curves = [
+        (get_working_indentation(fdc, param_dict), get_sine_segments(param_dict, detrended_segments))
+        for fdc, detrended_segments in zip(fdcs, get_detrended_segments(fdcs, param_dict))
+    ]
+    segments = [segment for _, curve_segments in curves for segment in curve_segments]
+    # Fit the indentation and deflection waves of all the segments at once
+    ang_freqs = [2. * np.pi * segment[0] for segment in segments]
+    times = [segment[1] for segment in segments]
+    with span('sine_fit'):
+        sine_waves = fit_sine_waves(
+            ang_freqs + ang_freqs, times + times,
+            [segment[2] for segment in segments] + [segment[3] for segment in segments]
+        )
+    ind_sine_waves, defl_sine_waves = sine_waves[:len(segments)], sine_waves[len(segments):]
+    results = []
+    start = 0
+    for wc, curve_segments in curves:
+        curve_results = []
+        for i, (frequency, _, _, _, fi, amp_quotient) in enumerate(curve_segments, start):
+            ind_sine_wave, defl_sine_wave = ind_sine_waves[i], defl_sine_waves[i]
+            # Compute delta Phi, the amplitudes of the linear fit are positive
+            dPhi = defl_sine_wave.phase - ind_sine_wave.phase
+            # Get G* using the amplitude and phase from the fit
+            G = ComputeComplexModulusSine(
+                defl_sine_wave.amplitude, ind_sine_wave.amplitude, wc, dPhi, frequency, param_dict['contact_model'],
+                param_dict['tip_param'], param_dict['k'], fi=fi, amp_quotient=amp_quotient,
+                bcoef=bcoef, poisson_ratio=param_dict['poisson']
+            )
+            curve_results.append((frequency, G.real, G.imag, ind_sine_wave, defl_sine_wave, fi, amp_quotient))
+        start += len(curve_segments)
+        # Organize and unpack the results for the different segments
+        curve_results = sorted(curve_results, key=lambda x: int(x[0]))
+        results.append((*([x[i] for x in curve_results] for i in range(7)), bcoef, wc))
+    return results
+
+def doMicrorheologySine(fdc, param_dict):
+    return doMicrorheologySineBatch([fdc], param_dict)[0]
@@ -0,0 +1,181 @@
+import collections
+import concurrent.futures
+from functools import partial
+import heapq
+import itertools
+import threading
+import time
+
+class TaskQueue:
+    '''
+    Priority queue of the tasks of a computation, submitted to an
+    executor so that at most max_pending tasks are waiting or running
+    in it. The other tasks stay in the queue, where tasks with a higher
+    priority added later can still overtake them.
+
+    When the results of the tasks feed the tasks of a downstream queue,
+    no tasks are submitted while max_downstream tasks wait in the
+    downstream queue, so that this stage does not run ahead of the next.
+
+    :param executor: concurrent.futures executor running the tasks
+    :param max_pending: maximum number of tasks submitted to the executor
+    :param downstream: optional TaskQueue fed by the results of this queue
+    :param max_downstream: maximum number of tasks waiting in downstream
+    :param transport: optional SharedMemoryTransport packing the last
+                      argument of each task when it is submitted
+    :param gate: optional function returning True while no tasks
+                 should be submitted, checked before each task
+    '''
+    def __init__(self, executor, max_pending, downstream=None, max_downstream=None, transport=None, gate=None):
+        self.executor = executor
+        self.max_pending = max(max_pending, 1)
+        self.downstream = downstream
+        self.max_downstream = max(max_downstream or 0, 1)
+        self.transport = transport
+        self.gate = gate
+        self.queue = []
+        self.pending = {}
+        self.counter = itertools.count()
+
+    def put(self, priority, tag, fn, *args):
+        # Lower priorities run first, tasks with the same priority in order
+        heapq.heappush(self.queue, (priority, next(self.counter), tag, fn, args))
+
+    def is_blocked(self):
+        # Wait for the downstream queue to consume the results already produced
+        if self.downstream is not None and len(self.downstream.queue) >= self.max_downstream:
+            return True
+        return self.gate is not None and self.gate()
+
+    def submit(self):
+        # Fill the executor up to max_pending tasks
+        while self.queue and len(self.pending) < self.max_pending and not self.is_blocked():
+            _, _, tag, fn, args = heapq.heappop(self.queue)
+            if self.transport is not None:
+                # Pack the task only when it is submitted, to keep in
+                # shared memory only the tasks sent to the executor
+                args = (*args[:-1], self.transport.pack(args[-1]))
+            future = self.executor.submit(fn, *args)
+            # Keep the submission time of each task to know how long it waited
+            self.pending[future] = (tag, time.time(), args[-1] if args else None)
+
+    def finish(self, future):
+        # Get the tag and submission time of a finished task and free its transport
+        tag, submit_time, packed_task = self.pending.pop(future)
+        if self.transport is not None:
+            self.transport.release(packed_task)
+        return tag, submit_time
+
+def iter_results(task_queues):
+    '''
+    Iterate over the (task_queue, tag, result, submit_time) of the
+    finished tasks of several queues until all of them are empty,
+    including the tasks put meanwhile.
+    '''
+    for task_queue in task_queues:
+        task_queue.submit()
+    while any(task_queue.pending for task_queue in task_queues):
+        futures = {future: task_queue for task_queue in task_queues for future in task_queue.pending}
+        done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            task_queue = futures[future]
+            tag, submit_time = task_queue.finish(future)
+            yield task_queue, tag, future.result(), submit_time
+        # Submit the downstream tasks first, then read ahead
+        for task_queue in reversed(task_queues):
+            task_queue.submit()
+
+class FairScheduler:
+    '''
+    Shares an executor between the jobs of the job server. Each job
+    submits its tasks through a JobExecutor and at most max_running
+    tasks are submitted to the executor at once. The tasks of the jobs
+    with the highest priority go first, the jobs with the same priority
+    take turns, starting with the job with fewer tasks running.
+
+    :param executor: concurrent.futures executor running the tasks
+    :param max_running: maximum number of tasks submitted to the executor
+    '''
+    def __init__(self, executor, max_running):
+        self.executor = executor
+        self.max_running = max(max_running, 1)
+        # Done callbacks can run in the submitting thread, use a reentrant lock
+        self.lock = threading.RLock()
+        self.queues = {}
+        self.running = collections.Counter()
+        self.nb_running = 0
+        self.counter = itertools.count()
+
+    def create_executor(self, priority=0):
+        # Higher priorities run first
+        return JobExecutor(self, priority, next(self.counter))
+
+    def submit(self, job_executor, fn, args):
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.queues.setdefault(job_executor, collections.deque()).append((future, fn, args))
+            self.dispatch()
+        return future
+
+    def dispatch(self):
+        # Submit the waiting tasks while the executor has room for them
+        with self.lock:
+            while self.nb_running < self.max_running:
+                waiting = [job_executor for job_executor, queue in self.queues.items() if queue]
+                if not waiting:
+                    return
+                job_executor = min(
+                    waiting, key=lambda job_executor: (
+                        -job_executor.priority, self.running[job_executor], job_executor.order
+                    )
+                )
+                future, fn, args = self.queues[job_executor].popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.running[job_executor] += 1
+                self.nb_running += 1
+                try:
+                    task_future = self.executor.submit(fn, *args)
+                except Exception as error:
+                    self.task_done(job_executor, future, None, error)
+                    continue
+                task_future.add_done_callback(partial(self.task_done, job_executor, future))
+
+    def task_done(self, job_executor, future, task_future, error=None):
+        with self.lock:
+            self.running[job_executor] -= 1
+            if self.running[job_executor] <= 0:
+                del self.running[job_executor]
+            self.nb_running -= 1
+        # Pass the result of the task to the future of the job
+        if error is None and task_future.cancelled():
+            error = concurrent.futures.CancelledError()
+        elif error is None:
+            error = task_future.exception()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(task_future.result())
+        self.dispatch()
+
+    def remove(self, job_executor):
+        # Cancel the tasks of a job not submitted yet, once the job is done or failed
+        with self.lock:
+            for future, _, _ in self.queues.pop(job_executor, ()):
+                future.cancel()
+
+class JobExecutor:
+    '''
+    Executor of the tasks of a job, submitted by a FairScheduler. It
+    has the submit method used by compute in place of its own pool.
+    '''
+    def __init__(self, scheduler, priority, order):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.order = order
+
+    def submit(self, fn, *args):
+        return self.scheduler.submit(self, fn, args)
+
+    def close(self):
+        self.scheduler.remove(self)
@@ -1,3 +1,8 @@
+from pyfmgui.spectral import SpectrumCache
+from pyfmgui.detrend import DetrendCache
+from pyfmgui.profiling import ProfileStats
+from pyfmgui.result_store import ResultStore
+
 class Session:
     def __init__(self):
         self.loaded_files_paths = []
@@ -8,6 +13,13 @@ class Session:
         self.piezo_char_results = {}
         self.vdrag_results = {}
         self.microrheo_results = {}
+        self.result_maps = {}
+        self.map_geometries = {}
+        self.spectrum_cache = SpectrumCache()
+        self.detrend_cache = DetrendCache()
+        self.result_store = ResultStore()
+        self.memory_usage = None
+        self.profile_stats = ProfileStats()
         self.current_file=None
         self.map_coords = None
         self.current_curve_index=None
@@ -49,6 +61,11 @@ class Session:
         self.piezo_char_results = {}
         self.vdrag_results = {}
         self.microrheo_results = {}
+        self.result_maps = {}
+        self.map_geometries = {}
+        self.spectrum_cache.clear()
+        self.detrend_cache.clear()
+        self.result_store.clear()
     
     def remove_data_and_results(self):
         self.remove_results()
@@ -0,0 +1,158 @@
+import copy
+import os
+from multiprocessing import shared_memory
+import numpy as np
+
+from pyfmreader.utils.forcecurve import ForceCurve
+
+# Transport of the arrays of the curves sent to the fit workers through
+# shared memory. The parent copies the arrays of the curves of a task in
+# a single shared memory block and sends the curves with the arrays
+# replaced by SharedArray references. The worker attaches to the block
+# and restores the arrays as views of it, without copying them.
+
+# Offsets of the arrays in the blocks are aligned to this number of bytes
+alignment = 64
+# Directory holding the shared memory blocks on Linux
+shm_dir = '/dev/shm'
+
+class SharedArray:
+    '''
+    Reference to an array stored in a shared memory block.
+
+    :param offset: position of the array in the block in bytes
+    :param shape: shape of the array
+    :param dtype: dtype string of the array
+    '''
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    def view(self, buffer):
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=buffer, offset=self.offset)
+
+class SharedTask:
+    '''
+    Task whose curve arrays are stored in the shared memory block named block_name.
+    '''
+    def __init__(self, block_name, task):
+        self.block_name = block_name
+        self.task = task
+
+def is_shareable(value):
+    return isinstance(value, np.ndarray) and value.dtype.kind in 'biufc' and value.size > 0
+
+def replace_segment_arrays(segment, replace):
+    # Shallow copy of the segment with its arrays, also the ones in dicts, replaced
+    segment = copy.copy(segment)
+    for name, value in vars(segment).items():
+        if isinstance(value, dict):
+            setattr(segment, name, {key: replace(item) for key, item in value.items()})
+        else:
+            setattr(segment, name, replace(value))
+    return segment
+
+def replace_task_arrays(task, replace):
+    # Walk the curves of a single curve, batch or tile task
+    if isinstance(task, ForceCurve):
+        fdc = copy.copy(task)
+        for name in ('extend_segments', 'retract_segments', 'pause_segments', 'modulation_segments'):
+            segments = getattr(fdc, name, [])
+            setattr(fdc, name, [(seg_id, replace_segment_arrays(segment, replace)) for seg_id, segment in segments])
+        return fdc
+    if isinstance(task, list):
+        return [replace_task_arrays(item, replace) for item in task]
+    if isinstance(task, tuple):
+        return tuple(replace_task_arrays(item, replace) for item in task)
+    return task
+
+def get_free_shared_memory():
+    # Bytes available to create shared memory blocks, None if unknown
+    if not os.path.isdir(shm_dir):
+        return None
+    stats = os.statvfs(shm_dir)
+    return stats.f_bavail * stats.f_frsize
+
+class SharedMemoryTransport:
+    '''
+    Creates the shared memory blocks of the tasks sent to the workers and
+    owns them until release is called for the task, once it is finished
+    or cancelled. Used as a context manager, all the blocks left are
+    released on exit, also when the computation fails.
+
+    :param min_bytes: tasks with less bytes of arrays are sent pickled
+    '''
+    def __init__(self, min_bytes=1 << 16):
+        self.min_bytes = min_bytes
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release_all()
+
+    def pack(self, task):
+        '''
+        Get the task to send to the worker, a SharedTask if the arrays
+        of its curves were copied to shared memory, else the task itself.
+        '''
+        # Get the layout of the arrays in the block, each array once
+        layout = {}
+        size = 0
+        def add_array(value):
+            nonlocal size
+            if is_shareable(value) and id(value) not in layout:
+                layout[id(value)] = (value, SharedArray(size, value.shape, value.dtype.str))
+                size += -(-value.nbytes // alignment) * alignment
+            return value
+        replace_task_arrays(task, add_array)
+        # Small tasks and tasks not fitting in the free shared memory are pickled
+        free = get_free_shared_memory()
+        if size < self.min_bytes or (free is not None and 2 * size > free):
+            return task
+        try:
+            block = shared_memory.SharedMemory(create=True, size=size)
+        except OSError:
+            return task
+        self.blocks[block.name] = block
+        for value, shared_array in layout.values():
+            shared_array.view(block.buf)[...] = value
+        return SharedTask(block.name, replace_task_arrays(task, lambda value: layout.get(id(value), (value, value))[1]))
+
+    def release(self, packed_task):
+        # Free the block of a finished or cancelled task
+        if isinstance(packed_task, SharedTask):
+            block = self.blocks.pop(packed_task.block_name, None)
+            if block is not None:
+                block.close()
+                block.unlink()
+
+    def release_all(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+def run_shared_task(routine, params, packed_task):
+    '''
+    Run routine(params, task) in a worker, restoring the arrays of
+    a SharedTask as views of its shared memory block.
+    '''
+    if not isinstance(packed_task, SharedTask):
+        return routine(params, packed_task)
+    block = shared_memory.SharedMemory(name=packed_task.block_name)
+    try:
+        task = replace_task_arrays(
+            packed_task.task, lambda value: value.view(block.buf) if isinstance(value, SharedArray) else value
+        )
+        result = routine(params, task)
+        del task
+        return result
+    finally:
+        try:
+            block.close()
+        except BufferError:
+            # Results still use views of the block, it is unmapped when they are released
+            pass
@@ -0,0 +1,73 @@
+import numpy as np
+
+from pyfmrheo.models.sine import SineWave
+
+# Sine fits at a known angular frequency. The wave
+# amplitude * sin(w * t + phase) + offset is linear in
+# b_sin * sin(w * t) + b_cos * cos(w * t) + offset, so the
+# fit is an exact linear least squares problem. The normal
+# equations of all the waves are built and solved at once.
+
+class LinearSineWave(SineWave):
+    '''
+    SineWave with the params found by fit_sine_waves. The fitted
+    wave is only computed when eval is called, to plot it.
+    '''
+    def __init__(self, ang_freq, amplitude, phase, offset):
+        super().__init__(ang_freq)
+        self.amplitude = amplitude
+        self.phase = phase
+        self.offset = offset
+        self.n_params = 3
+
+def get_sums(values, starts):
+    # Sum the values of each wave, the waves are concatenated along the last axis
+    return np.add.reduceat(values, starts, axis=-1)
+
+def fit_sine_waves(ang_freqs, times, waves):
+    '''
+    Fit amplitude * sin(ang_freq * time + phase) + offset to several
+    waves, each with its own angular frequency and number of points.
+
+    :param ang_freqs: angular frequency of each wave in rad/s
+    :param times: time of each wave
+    :param waves: values of each wave
+    :return: list of LinearSineWave, one per wave
+    '''
+    if len(waves) == 0:
+        return []
+    lengths = np.array([len(wave) for wave in waves])
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    # Concatenate the waves, each point with the frequency of its wave
+    time = np.concatenate(times).astype(float)
+    wave = np.concatenate(waves).astype(float)
+    phase = np.repeat(np.asarray(ang_freqs, dtype=float), lengths) * time
+    basis = np.stack([np.sin(phase), np.cos(phase), np.ones(len(time))])
+    # Normal equations of each wave
+    lhs = get_sums(basis[:, None, :] * basis[None, :, :], starts).transpose(2, 0, 1)
+    rhs = get_sums(basis * wave, starts).T
+    b_sin, b_cos, offsets = np.linalg.solve(lhs, rhs[..., None])[..., 0].T
+    amplitudes = np.hypot(b_sin, b_cos)
+    phases = np.arctan2(b_cos, b_sin)
+    # Goodness of fit, as computed by SineWave.fit
+    abs_error = (basis * np.repeat(np.c_[b_sin, b_cos, offsets].T, lengths, axis=1)).sum(axis=0) - wave
+    squared_error = np.square(abs_error)
+    mean_error = get_sums(abs_error, starts) / lengths
+    mean_squared_error = get_sums(squared_error, starts) / lengths
+    wave_var = get_sums(wave**2, starts) / lengths - (get_sums(wave, starts) / lengths)**2
+    error_var = mean_squared_error - mean_error**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chisq_terms = squared_error / wave
+    chisq = get_sums(np.where(np.isfinite(chisq_terms), chisq_terms, 0), starts)
+    sine_waves = []
+    for i, ang_freq in enumerate(ang_freqs):
+        sine_wave = LinearSineWave(ang_freq, amplitudes[i], phases[i], offsets[i])
+        sine_wave.MAE = mean_error[i]
+        sine_wave.SE = squared_error[starts[i]:starts[i] + lengths[i]]
+        sine_wave.MSE = mean_squared_error[i]
+        sine_wave.RMSE = np.sqrt(mean_squared_error[i])
+        sine_wave.Rsquared = 1.0 - error_var[i] / wave_var[i]
+        sine_wave.chisq = chisq[i]
+        sine_wave.redchi = chisq[i] / sine_wave.n_params
+        sine_waves.append(sine_wave)
+    return sine_waves
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import numpy as np
+
+def single_bin_dft(signals, idx, nfft):
+    '''
+    Compute the bin idx of the nfft points DFT of one or several signals,
+    equivalent to fft(signal, nfft)[idx] without computing the full spectrum.
+    '''
+    signals = np.atleast_2d(signals)[:, :nfft]
+    n = np.arange(signals.shape[-1])
+    kernel = np.exp(-2j * np.pi * idx * n / nfft)
+    return signals @ kernel
+
+def transfer_function_at(input_signal, output_signal, fs, frequency, nfft=None, freq_tol=0.0001):
+    '''
+    Compute the transfer function between two signals at a single frequency.
+
+    Returns the same values as pyfmrheo's TransferFunction when a frequency
+    is given, but only evaluates the DFT bin of that frequency. The coherence
+    estimated from a single segment is always 1, hence it is not computed.
+    '''
+    from scipy.fft import fftfreq
+    # Define nfft
+    if not nfft:
+        nfft = len(output_signal)
+    # Compute deltat from sampling frequency
+    deltat = 1/fs
+    # Compute index where to find the frequency
+    idx = int(np.round(frequency / (1 / (deltat * nfft))))
+    W_idx = fftfreq(nfft, d=deltat)[idx]
+    # Check if the idx is at the right frequency
+    if not abs(frequency - W_idx) <= freq_tol:
+        print(f"The frequency found at index {W_idx} does not match with the frequency applied {frequency}")
+    input_signal_hat, output_signal_hat = single_bin_dft(
+        np.vstack([input_signal[:nfft], output_signal[:nfft]]), idx, nfft
+    )
+    G = output_signal_hat / input_signal_hat
+    return W_idx, G, 1.0, input_signal_hat, output_signal_hat
+
+def compute_psd(signals, deltat):
+    '''
+    Compute the PSD of a stack of real signals of the same length using a
+    real FFT padded to the next fast length. The DC and Nyquist bins are
+    dropped, as done in the plots. The mean of the signals is removed
+    so that the padding does not spread the DC component to other bins.
+    '''
+    from scipy.fft import rfft, rfftfreq, next_fast_len
+    signals = np.atleast_2d(signals)
+    signals = signals - signals.mean(axis=-1, keepdims=True)
+    n = signals.shape[-1]
+    nfft = next_fast_len(n, real=True)
+    signals_hat = rfft(signals, nfft, axis=-1)
+    psd = (signals_hat * np.conj(signals_hat)).real / n
+    freqs = rfftfreq(nfft, d=deltat)
+    L = slice(1, nfft // 2)
+    return freqs[L], psd[:, L]
+
+class SpectrumCache:
+    '''
+    Least recently used cache of the zheight and deflection PSDs
+    of the modulation segments displayed in the widgets.
+
+    :param maxsize: maximum number of segments kept in the cache
+    '''
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.spectra = OrderedDict()
+
+    def clear(self):
+        self.spectra.clear()
+
+    def get_segment_psds(self, file_id, curve_idx, defl_sens, height_channel, segments):
+        '''
+        Get the PSDs of a list of (seg_id, segment) modulation segments.
+
+        Returns a list with a (freqs, psd_height, psd_deflect) tuple per segment.
+        Missing segments with the same length and sampling are transformed together.
+        '''
+        keys = [(file_id, curve_idx, seg_id, defl_sens, height_channel) for seg_id, _ in segments]
+        # Group the segments not found in the cache by length and sampling
+        groups = {}
+        for key, (_, segment) in zip(keys, segments):
+            if key in self.spectra:
+                self.spectra.move_to_end(key)
+                continue
+            deltat = segment.time[1] - segment.time[0]
+            groups.setdefault((len(segment.vdeflection), deltat), []).append((key, segment))
+        for (_, deltat), group in groups.items():
+            signals = np.vstack([
+                np.vstack([segment.zheight, segment.vdeflection]) for _, segment in group
+            ])
+            freqs, psd = compute_psd(signals, deltat)
+            for i, (key, _) in enumerate(group):
+                self.spectra[key] = (freqs, psd[2*i], psd[2*i+1])
+        results = [self.spectra[key] for key in keys]
+        # Drop the least recently used segments
+        while len(self.spectra) > self.maxsize:
+            self.spectra.popitem(last=False)
+        return results
@@ -0,0 +1,139 @@
+import numpy as np
+
+from pyfmrheo.models.ting import TingModel
+from pyfmrheo.utils.signal_processing import numdiff, smooth
+
+# Numba is optional, the NumPy version is used when it is not installed
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Maximum number of elements of the matrices built by the NumPy version
+max_chunk_elements = 2**22
+
+def get_time_power(time_, betaE, c1):
+    # Get t^-betaE, the times before c1 are never used and set to 0
+    time_power = np.zeros(len(time_))
+    positive = time_ > 0
+    positive[:c1] = False
+    time_power[positive] = time_[positive] ** (-betaE)
+    return time_power
+
+def hereditary_integrals_numpy(delta_Uto_dot, delta_dot, time_, betaE, c0, nct, idx_tm):
+    '''
+    Vectorized version of the loops of TingModel.SolveNumerical,
+    without the geom_coeff * E0 factor.
+
+    The trace integral is a discrete convolution of the indentation
+    derivative with t^-betaE. The retrace integrals are computed for
+    blocks of retrace points at once, one row per point, reading
+    t^-betaE through sliding windows of the reversed times.
+    '''
+    c1 = c0 + 1
+    time_power = get_time_power(time_, betaE, c1)
+    # Trace: Ftc[i] = sum(delta_Uto_dot[c0+k] * t[c0+i-k]^-betaE) for k in 1..i-1
+    a = delta_Uto_dot[c0:c0+nct].copy()
+    a[0] = 0
+    Ftc = np.convolve(a, time_power[c0:c0+nct])[:nct]
+    # Retrace
+    Frc = np.zeros(nct)
+    js = np.arange(idx_tm + 1, idx_tm + nct)
+    if len(js) == 0:
+        return Ftc, Frc
+    ncols = max(js[-1] - c1, 2)
+    # Reversed t^-betaE padded with zeros, so that the row of j
+    # starting at column N-j+s gives t[j-1+s-m] along the row
+    N = len(time_power)
+    windows = np.lib.stride_tricks.sliding_window_view(np.r_[time_power[::-1], np.zeros(ncols + 2)], ncols)
+    delta_dot_m = delta_dot[c1 + 1:c1 + 1 + ncols]
+    delta_Uto_dot_m = delta_Uto_dot[c0 + 1:c0 + 1 + ncols]
+    rows_per_chunk = max(max_chunk_elements // ncols, 1)
+    for start in range(0, len(js), rows_per_chunk):
+        j = js[start:start + rows_per_chunk]
+        lengths = j - c1
+        # phi0[m] = sum(t[j-1-m']^-betaE * delta_dot[c1+1+m']) for m' in m..j-c1-1,
+        # t^-betaE is 0 for m' >= j-c1 so the sums can run to the last column
+        P = windows[N - j, :len(delta_dot_m)] * delta_dot_m
+        phi0 = np.cumsum(P[:, ::-1], axis=1)[:, ::-1]
+        # Find the first point of the retrace contact
+        m = np.arange(phi0.shape[1])
+        abs_phi0 = np.abs(phi0)
+        abs_phi0[m >= np.minimum(lengths, nct)[:, None]] = np.inf
+        idx_min_phi0 = np.argmin(abs_phi0, axis=1)
+        # Trapezoidal integral of delta_Uto_dot[c0+1+m] * t[j+1-m]^-betaE for m < idx_min_phi0
+        ncols_q = max(min(idx_min_phi0.max(), len(delta_Uto_dot_m)), 1)
+        Q = windows[N - 2 - j, :ncols_q] * delta_Uto_dot_m[:ncols_q]
+        Q[np.arange(ncols_q) >= idx_min_phi0[:, None]] = 0
+        rows = np.arange(len(j))
+        last = Q[rows, np.clip(idx_min_phi0 - 1, 0, None)]
+        trapz = Q.sum(axis=1) - (Q[:, 0] + last) / 2.0
+        Frc[j - idx_tm - 1] = np.where(idx_min_phi0 > 1, trapz, 0)
+    return Ftc, Frc
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def hereditary_integrals_loops(delta_Uto_dot, delta_dot, time_power, c0, nct, idx_tm):
+        # Loops of TingModel.SolveNumerical compiled with Numba
+        Ftc = np.zeros(nct)
+        for i in range(nct):
+            total = 0.0
+            for k in range(1, i):
+                total += delta_Uto_dot[c0 + k] * time_power[c0 + i - k]
+            Ftc[i] = total
+        Frc = np.zeros(nct)
+        c1 = c0 + 1
+        phi0 = np.empty(len(time_power))
+        for j in range(idx_tm + 1, idx_tm + nct):
+            length = j - c1
+            total = 0.0
+            for m in range(length - 1, -1, -1):
+                total += time_power[j - 1 - m] * delta_dot[c1 + 1 + m]
+                phi0[m] = total
+            idx_min_phi0 = 0
+            for m in range(1, min(length, nct)):
+                if abs(phi0[m]) < abs(phi0[idx_min_phi0]):
+                    idx_min_phi0 = m
+            total = 0.0
+            for m in range(idx_min_phi0 - 1):
+                q0 = delta_Uto_dot[c0 + 1 + m] * time_power[j + 1 - m]
+                q1 = delta_Uto_dot[c0 + 2 + m] * time_power[j - m]
+                total += (q0 + q1) / 2.0
+            Frc[j - idx_tm - 1] = total
+        return Ftc, Frc
+
+    def hereditary_integrals_jit(delta_Uto_dot, delta_dot, time_, betaE, c0, nct, idx_tm):
+        # Compute t^-betaE once instead of in the inner loops
+        time_power = get_time_power(time_, betaE, c0 + 1)
+        return hereditary_integrals_loops(delta_Uto_dot, delta_dot, time_power, c0, nct, idx_tm)
+else:
+    hereditary_integrals_jit = None
+
+def get_hereditary_integrals(*args):
+    # Use the compiled version if Numba is installed
+    if hereditary_integrals_jit is not None:
+        return hereditary_integrals_jit(*args)
+    return hereditary_integrals_numpy(*args)
+
+class AcceleratedTingModel(TingModel):
+    '''
+    TingModel evaluating the numerical model with the vectorized
+    or compiled hereditary integrals instead of Python loops.
+    '''
+    def SolveNumerical(self, delta, time_, geom_coeff, geom_exp, v0t, v0r, E0, betaE, F0, vdrag, smooth_w, idx_tm, idxCt, idxCr):
+        # Get the derivatives of the indentation as in TingModel.SolveNumerical
+        delta0 = delta - delta[idxCt[0]]
+        delta_Uto_dot = np.zeros(len(delta0))
+        A = smooth(np.r_[numdiff(delta0[idxCt]**geom_exp), numdiff(delta0[idxCr[0]:]**geom_exp)], smooth_w)
+        if len(A) < len(delta_Uto_dot[idxCt[0]:]):
+            A = np.append(A, A[-1])
+        delta_Uto_dot[idxCt[0]:] = A
+        delta_dot = np.zeros(len(delta0))
+        B = smooth(np.r_[numdiff(delta0[idxCt]), numdiff(delta0[idxCr[0]:])], smooth_w)
+        if len(B) < len(delta_Uto_dot[idxCt[0]:]):
+            B = np.append(B, B[-1])
+        delta_dot[idxCt[0]:] = B
+        Ftc, Frc = get_hereditary_integrals(
+            delta_Uto_dot, delta_dot, np.asarray(time_, dtype=float), float(betaE), int(idxCt[0]), len(idxCt), int(idx_tm)
+        )
+        return np.r_[geom_coeff * E0 * Ftc, geom_coeff * E0 * Frc]
@@ -5,6 +5,9 @@ import numpy as np
 from pyqtgraph.parametertree import Parameter, ParameterTree
 
 import pyfmgui.const as cts
+from pyfmgui.refresh import RefreshScheduler
+from pyfmgui.map_geometry import get_map_geometry
+from pyfmgui.widgets.lod import LevelOfDetail
 
 def summarize_metadata(current_file_metadata):
     return {
@@ -22,6 +25,7 @@ class DataViewerWidget(QtWidgets.QWidget):
         super(DataViewerWidget, self).__init__(parent)
         self.session = session
         self.session.data_viewer_widget = self
+        self.refresh = RefreshScheduler(self.updateCurve, parent=self)
         self.init_gui()
         self.updateTable()
 
@@ -69,6 +73,7 @@ class DataViewerWidget(QtWidgets.QWidget):
         self.plotItem.addItem(self.correlogram)    # display correlogram
 
         self.p1 = pg.PlotItem()
+        self.p1_lod = LevelOfDetail(self.p1)
 
         ## Put vertical label on left side
         layout.addWidget(self.tree, 0, 0, 1, 1)
@@ -86,9 +91,9 @@ class DataViewerWidget(QtWidgets.QWidget):
             x, y = int(pixels.x()), int(pixels.y())
             self.ROI.setPos(x, y)
             self.session.current_curve_index = self.session.map_coords[x,y]
-            self.updateCurve()
+            self.refresh.request()
             if self.session.hertz_fit_widget:
-                self.session.hertz_fit_widget.updatePlots()
+                self.session.hertz_fit_widget.refresh.request()
 
     def closeEvent(self, evnt):
         self.session.data_viewer_widget = None
@@ -108,8 +113,10 @@ class DataViewerWidget(QtWidgets.QWidget):
     def get_sumary_metadata():
         pass
     
-    def make_plot(self, force_curve):
+    def make_plot(self, force_curve, curve_key=None):
+        # The key of the curve lets the LevelOfDetail reuse the envelopes of its segments
         self.p1.clear()
+        self.p1_lod.clear()
         self.p1.showGrid(x=True, y=True)
         self.p1.enableAutoRange()
         self.p1.addLegend((100, 30))
@@ -132,7 +139,8 @@ class DataViewerWidget(QtWidgets.QWidget):
                 t0 = x[-1]
                 x_units = 's'
             y = getattr(segment, ykey)
-            self.p1.plot(x, y, pen=(i,n_segments), name=f"{segment.segment_type} {seg_id}")
+            curve = self.p1.plot(pen=(i,n_segments), name=f"{segment.segment_type} {seg_id}")
+            self.p1_lod.setData(curve, x, y, key=curve_key and (*curve_key, xkey, ykey, seg_id))
         self.p1.setLabel('left', ykey, 'm')
         self.p1.setLabel('bottom', xkey, x_units)
         self.p1.setTitle(f"{ykey}-{xkey}")
@@ -148,7 +156,8 @@ class DataViewerWidget(QtWidgets.QWidget):
         force_curve.preprocess_force_curve(deflection_sens, height_channel)
         if self.session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
             force_curve.shift_height()
-        self.make_plot(force_curve)
+        file_id = self.session.current_file.filemetadata['Entry_filename']
+        self.make_plot(force_curve, (file_id, idx, deflection_sens, height_channel))
     
     def updatePlots(self, item=None):
         if item is not None:
@@ -169,32 +178,17 @@ class DataViewerWidget(QtWidgets.QWidget):
             self.plotItem.setLabel('left', 'y pixels')
             self.plotItem.setLabel('bottom', 'x pixels')
             self.plotItem.addItem(self.ROI)
-            self.plotItem.scene().sigMouseClicked.connect(self.mouseMoved)
-            # create transform to center the corner element on the origin, for any assigned image:
-            if self.session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
-                img = self.session.current_file.imagedata.get('Height(measured)', None)
-                self.plotItem.setTitle("Height(measured) (μm)")
-                if img is None:
-                    img = self.session.current_file.imagedata.get('Height', None)
-                    self.plotItem.setTitle("Height (μm)")
-                img = np.rot90(np.fliplr(img))
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-                curve_coords = np.rot90(np.fliplr(curve_coords))
-            elif self.session.current_file.filemetadata['file_type'] in cts.nanoscope_file_extensions:
-                img = self.session.current_file.piezoimg
-                self.plotItem.setTitle("Piezo Height (μm)")
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
+            self.refresh.connect_once(self.plotItem.scene(), 'sigMouseClicked', self.mouseMoved)
+            # Get the cached map layout of the file
+            geometry = get_map_geometry(self.session, self.session.current_file)
+            img = geometry.img
+            self.plotItem.setTitle(f"{geometry.img_channel} (μm)")
             self.correlogram.setImage(img * 1e6)
             self.bar.setLevels((img.min() * 1e6, img.max() * 1e6))
+            rows, cols = geometry.shape
             self.plotItem.setXRange(0, cols)
             self.plotItem.setYRange(0, rows)
-            if self.session.current_file.filemetadata['file_type'] == "jpk-force-map":
-                curve_coords = np.asarray([row[::(-1)**i] for i, row in enumerate(curve_coords)])
-            self.session.map_coords = curve_coords
+            self.session.map_coords = geometry.curve_coords
             self.l.ci.layout.setColumnStretchFactor(1, 2)
 
         self.l.addItem(self.p1)
@@ -5,6 +5,15 @@ def get_params(params, method):
     # Define general parameters
     param_dict['compute_all_curves'] = params.child('General Options').child('Compute All Curves').value()
     param_dict['method'] = method
+    param_dict['profile'] = params.child('General Options').child('Profile Computation').value()
+    param_dict['model_cache'] = params.child('General Options').child('Reuse Fit Models').value()
+    param_dict['warm_start'] = params.child('General Options').child('Warm Start Fits').value()
+    param_dict['shared_memory'] = params.child('General Options').child('Shared Memory Transport').value()
+    param_dict['out_of_core'] = params.child('General Options').child('Out-of-core Processing').value()
+    param_dict['memory_budget'] = params.child('General Options').child('Memory Budget').value()
+    param_dict['job_server'] = params.child('General Options').child('Job Server').value()
+    param_dict['job_priority'] = params.child('General Options').child('Job Priority').value()
+    param_dict['cluster_agents'] = params.child('General Options').child('Cluster Agents').value()
     analysis_params = params.child('Analysis Params')
     param_dict['height_channel'] = analysis_params.child('Height Channel').value()
     param_dict['def_sens'] = analysis_params.child('Deflection Sensitivity').value() / 1e9
@@ -44,6 +53,8 @@ def get_params(params, method):
         param_dict['sigma'] = hertz_params.child('Sigma').value()
         param_dict['downsample_flag'] = hertz_params.child('Downsample Signal').value()
         param_dict['pts_downsample'] = hertz_params.child('Downsample Pts.').value()
+        param_dict['adaptive_downsample'] = hertz_params.child('Adaptive Downsample').value()
+        param_dict['downsample_tol'] = hertz_params.child('Downsample Tol.').value() / 1e2
         param_dict['auto_init_E0'] = hertz_params.child('Auto Init E0').value()
         param_dict['E0'] = hertz_params.child('Init E0').value()
         param_dict['d0'] = hertz_params.child('Init d0').value() / 1e9 #nm
@@ -58,12 +69,11 @@ def get_params(params, method):
     
     # TingFit specific parameters
     elif method == "TingFit":
-        # Define downsample for hertzfit flag
-        # Decide how to handle this in the future:
-        # - Allow user to downsample for hertz fit
-        param_dict['downsample_flag'] = False
         # Define ting params
         ting_params = params.child('Ting Fit Params')
+        # The Hertz fit used to find the PoC is downsampled uniformly
+        param_dict['downsample_flag'] = ting_params.child('Downsample Hertz Fit').value()
+        param_dict['adaptive_downsample'] = False
         param_dict['poisson'] = ting_params.child('Poisson Ratio').value()
         param_dict['poc_method'] = ting_params.child('PoC Method').value()
         param_dict['poc_win'] = ting_params.child('PoC Window').value() / 1e9 #nm
@@ -8,8 +8,16 @@ logger = logging.getLogger()
 
 import pyfmgui.const as cts
 from pyfmgui.threading import Worker
+from pyfmgui.refresh import RefreshScheduler
 from pyfmgui.compute import compute
 from pyfmgui.widgets.get_params import get_params
+from pyfmgui.widgets.resume_dialog import ask_resume
+from pyfmgui.widgets.plot_items import add_line, move_line, LegendText
+from pyfmgui.map_geometry import get_map_geometry
+from pyfmgui.fit_data import prepare_hertz_fit_data
+from pyfmgui.result_maps import get_result_map
+from pyfmgui.methods import get_method
+from pyfmgui.result_store import get_curve_result
 
 from pyfmrheo.utils.force_curves import get_poc_RoV_method, get_poc_regulaFalsi_method, correct_tilt, correct_offset
 
@@ -18,11 +26,10 @@ class HertzFitWidget(QtWidgets.QWidget):
         super(HertzFitWidget, self).__init__(parent)
         self.session = session
         self.current_file = None
-        self.min_val_line = None
-        self.max_val_line = None
-        self.offset_roi = None
+        self.height_img = None
         self.file_dict = {}
         self.session.hertz_fit_widget = self
+        self.refresh = RefreshScheduler(self.updatePlots, parent=self)
         self.init_gui()
         if self.session.loaded_files != {}:
             self.updateCombo()
@@ -45,11 +52,16 @@ class HertzFitWidget(QtWidgets.QWidget):
         self.paramTree = ParameterTree()
         self.paramTree.setParameters(self.params, showTop=False)
 
+        self.map_field_cb = QtWidgets.QComboBox()
+        self.map_field_cb.addItems(['Height', *get_method("HertzFit").map_fields.keys()])
+        self.map_field_cb.currentTextChanged.connect(self.update_map_image)
+
         self.l2 = pg.GraphicsLayoutWidget()
 
         params_layout.addWidget(self.combobox, 1)
         params_layout.addWidget(self.paramTree, 3)
         params_layout.addWidget(self.pushButton, 1)
+        params_layout.addWidget(self.map_field_cb, 1)
         params_layout.addWidget(self.l2, 2)
 
         self.l = pg.GraphicsLayoutWidget()
@@ -72,6 +84,44 @@ class HertzFitWidget(QtWidgets.QWidget):
         self.p3 = pg.PlotItem()
         self.p4 = pg.PlotItem()
 
+        # Create the plot items once, they are updated in place on each refresh
+        self.p1.addLegend()
+        self.p1_curve = self.p1.plot()
+        self.init_d0_line = add_line(self.p1, pen='y', label='Init d0', position=0.5)
+        self.hertz_d0_line = add_line(self.p1, pen='g', label='Hertz d0', position=0.7)
+        self.p2_curve = self.p2.plot()
+        self.p2_fit = self.p2.plot(pen='g', name='Fit')
+        self.p2_stats = LegendText(self.p2legend)
+        self.min_val_line = add_line(self.p2, pen='y', label='Min', position=0.7)
+        self.max_val_line = add_line(self.p2, pen='y', label='Max', position=0.7)
+        self.p3_ext = self.p3.plot()
+        self.p3_ret = self.p3.plot()
+        self.offset_roi = pg.LinearRegionItem(brush=(50,50,200,0), pen='w', movable=False)
+        self.offset_roi.setZValue(10)
+        self.offset_roi.setClipItem(self.p3_ext)
+        self.p3.addItem(self.offset_roi, ignoreBounds=True)
+        self.p4_res = self.p4.plot(pen=None, symbol='o', symbolSize=5)
+        self.clear_plots()
+
+        self.p1.setLabel('left', 'Force', 'N')
+        self.p1.setLabel('bottom', 'Indentation', 'm')
+        self.p1.setTitle("Force-Indentation")
+        self.p2.setLabel('left', 'Force', 'N')
+        self.p2.setLabel('bottom', 'Indentation', 'm')
+        self.p2.setTitle("Force-Indentation Hertz Fit")
+        self.p3.setLabel('left', 'Deflection', 'm')
+        self.p3.setLabel('bottom', 'zHeight', 'm')
+        self.p3.setTitle('Deflection-zHeight')
+        self.p4.setLabel('left', 'Residuals')
+        self.p4.setLabel('bottom', 'Indentation', 'm')
+        self.p4.setTitle("Hertz Fit Residuals")
+
+        self.l.addItem(self.p1)
+        self.l.addItem(self.p2)
+        self.l.nextRow()
+        self.l.addItem(self.p3)
+        self.l.addItem(self.p4)
+
         ## Put vertical label on left side
         main_layout.addLayout(params_layout, 1)
         main_layout.addWidget(self.l, 3)
@@ -81,8 +131,19 @@ class HertzFitWidget(QtWidgets.QWidget):
     
     def clear(self):
         self.combobox.clear()
-        self.l.clear()
+        self.clear_plots()
         self.l2.clear()
+    
+    def clear_plots(self):
+        for curve in (self.p1_curve, self.p2_curve, self.p2_fit, self.p3_ext, self.p3_ret, self.p4_res):
+            curve.setData([], [])
+        for line in (self.hertz_d0_line, self.min_val_line, self.max_val_line):
+            line.setVisible(False)
+        self.p2_stats.clear()
+
+    def get_compute_params(self):
+        # Method and params used to analyze the files found in watch mode
+        return "HertzFit", get_params(self.params, "HertzFit")
 
     def do_hertzfit(self):
         if not self.current_file:
@@ -92,6 +153,8 @@ class HertzFitWidget(QtWidgets.QWidget):
         else:
             filedict = {self.session.current_file.filemetadata['Entry_filename']:self.session.current_file}
         params = get_params(self.params, "HertzFit")
+        # Offer to resume an interrupted run of the same files
+        ask_resume(self, "HertzFit", params, filedict)
         logger.info('Started ElasticityFit...')
         logger.info(f'Processing {len(filedict)} files')
         logger.info(f'Analysis parameters used: {params}')
@@ -115,7 +178,7 @@ class HertzFitWidget(QtWidgets.QWidget):
         # Final resets
         self.pushButton.setEnabled(False) # Prevent user from starting another
         # Update the gui
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def changestep(self, step):
         self.session.pbar_widget.set_label_sub_text(step)
@@ -131,7 +194,8 @@ class HertzFitWidget(QtWidgets.QWidget):
         self.session.pbar_widget.hide()
         self.session.pbar_widget.reset_pbar()
         self.pushButton.setEnabled(True)
-        self.updatePlots()
+        self.update_map_image()
+        self.refresh.refresh_now()
         logger.info('ElasticityFit completed!')
 
     def update(self):
@@ -141,29 +205,31 @@ class HertzFitWidget(QtWidgets.QWidget):
         if self.current_file.isFV:
             self.l2.addItem(self.plotItem)
             self.plotItem.addItem(self.ROI)
-            self.plotItem.scene().sigMouseClicked.connect(self.mouseMoved)
-            # create transform to center the corner element on the origin, for any assigned image:
-            if self.session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
-                img = self.session.current_file.imagedata.get('Height(measured)', None)
-                if img is None:
-                    img = self.session.current_file.imagedata.get('Height', None)
-                img = np.rot90(np.fliplr(img))
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-                curve_coords = np.rot90(np.fliplr(curve_coords))
-            elif self.session.current_file.filemetadata['file_type'] in cts.nanoscope_file_extensions:
-                img = self.session.current_file.piezoimg
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-            self.correlogram.setImage(img)
-            if self.current_file.filemetadata['file_type'] == "jpk-force-map":
-                curve_coords = np.asarray([row[::(-1)**i] for i, row in enumerate(curve_coords)])
-            self.session.map_coords = curve_coords
+            self.refresh.connect_once(self.plotItem.scene(), 'sigMouseClicked', self.mouseMoved)
+            # Get the cached map layout of the file
+            geometry = get_map_geometry(self.session, self.current_file)
+            self.height_img = geometry.img
+            self.session.map_coords = geometry.curve_coords
+            self.update_map_image()
         self.session.current_curve_index = 0
         self.ROI.setPos(0, 0)
-        self.updatePlots()
+        self.refresh.refresh_now()
+    
+    def update_map_image(self):
+        if not self.current_file or not self.current_file.isFV or self.height_img is None:
+            return
+        field = self.map_field_cb.currentText()
+        img = self.height_img
+        if field != 'Height':
+            file_id = self.current_file.filemetadata['Entry_filename']
+            result_map = get_result_map(self.session, "HertzFit", file_id, get_map_geometry(self.session, self.current_file))
+            if result_map is not None:
+                img = result_map.get(field)
+        finite_vals = img[np.isfinite(img)]
+        if finite_vals.size == 0:
+            self.correlogram.clear()
+            return
+        self.correlogram.setImage(img, levels=(finite_vals.min(), finite_vals.max()))
     
     def file_changed(self, file_id):
         if file_id != '':
@@ -172,11 +238,14 @@ class HertzFitWidget(QtWidgets.QWidget):
             self.update()
     
     def updateCombo(self):
+        # Rebuild the list without calling file_changed, it would show the first file
+        self.combobox.blockSignals(True)
         self.combobox.clear()
         self.combobox.addItems(self.session.loaded_files.keys())
-        index = self.combobox.findText(self.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
+        index = self.combobox.findText(self.session.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
         if index >= 0:
             self.combobox.setCurrentIndex(index)
+        self.combobox.blockSignals(False)
         self.update()
     
     def mouseMoved(self,event):
@@ -188,10 +257,10 @@ class HertzFitWidget(QtWidgets.QWidget):
             x, y = int(pixels.x()), int(pixels.y())
             self.ROI.setPos(x, y)
             self.session.current_curve_index = self.session.map_coords[x,y]
-            self.updatePlots()
+            self.refresh.request()
             if self.session.data_viewer_widget is not None:
                 self.session.data_viewer_widget.ROI.setPos(x, y)
-                self.session.data_viewer_widget.updateCurve()
+                self.session.data_viewer_widget.refresh.request()
     
     def manual_override(self):
         pass
@@ -199,13 +268,6 @@ class HertzFitWidget(QtWidgets.QWidget):
     def updatePlots(self):
         if not self.current_file:
             return
-        self.l.clear()
-        self.p1.clear()
-        self.p2.clear()
-        self.p2legend.clear()
-        self.p3.clear()
-        self.p4.clear()
-
         self.hertz_E = None
         self.hertz_d0 = 0
         self.fit_data = None
@@ -242,24 +304,22 @@ class HertzFitWidget(QtWidgets.QWidget):
         # print(current_file_id)
 
         if file_hertz_result is not None:
-            for curve_indx, curve_hertz_result in file_hertz_result:
-                try:
-                    if curve_hertz_result is None:
-                        continue
-                    if curve_indx == self.session.current_curve_index:
-                        self.hertz_E = curve_hertz_result.E0
-                        self.hertz_d0 = curve_hertz_result.delta0
-                        self.hertz_f0 = curve_hertz_result.f0
-                        self.hertz_redchi = curve_hertz_result.redchi
-                        self.fit_data = curve_hertz_result
-                except Exception:
-                    continue
+            curve_hertz_result = get_curve_result(file_hertz_result, self.session.current_curve_index)
+            try:
+                if curve_hertz_result is not None:
+                    self.hertz_E = curve_hertz_result.E0
+                    self.hertz_d0 = curve_hertz_result.delta0
+                    self.hertz_f0 = curve_hertz_result.f0
+                    self.hertz_redchi = curve_hertz_result.redchi
+                    self.fit_data = curve_hertz_result
+            except Exception:
+                pass
 
         ext_data = force_curve.extend_segments[0][1]
         ret_data = force_curve.retract_segments[-1][1]
 
-        self.p3.plot(ext_data.zheight, ext_data.vdeflection)
-        self.p3.plot(ret_data.zheight, ret_data.vdeflection)
+        self.p3_ext.setData(ext_data.zheight, ext_data.vdeflection)
+        self.p3_ret.setData(ret_data.zheight, ret_data.vdeflection)
 
         if curve_seg == 'extend': self.seg_data  = ext_data
         else: self.seg_data  = ret_data
@@ -290,67 +350,46 @@ class HertzFitWidget(QtWidgets.QWidget):
 
         force_curve.get_force_vs_indentation(poc, spring_k)
 
+        # Use the retract segment in the order used by the fit
         if curve_seg == 'extend':
             self.indentation  = ext_data.indentation
             self.force = ext_data.force
-            self.force = self.force - self.force[0]
-            
         else:
-            self.indentation  = ret_data.indentation
-            self.force = ret_data.force
-            self.force = self.force - self.force[-1]
-        
-        if hertz_params.child('Downsample Signal').value():
-            pts_downsample = hertz_params.child('Downsample Pts.').value()
-            downfactor= len(self.indentation) // pts_downsample
-            idxDown = list(range(0, len(self.indentation), downfactor))
-            self.indentation = self.indentation[idxDown]
-            self.force = self.force[idxDown]
-
-        self.p1.plot(self.indentation, self.force)
-        vertical_line = pg.InfiniteLine(pos=0, angle=90, pen='y', movable=False, label='Init d0', labelOpts={'color':'y', 'position':0.5})
-        self.p1.addItem(vertical_line, ignoreBounds=True)
-        if self.hertz_d0 != 0:
-            d0_vertical_line = pg.InfiniteLine(pos=self.hertz_d0, angle=90, pen='g', movable=False, label='Hertz d0', labelOpts={'color':'g', 'position':0.7})
-            self.p1.addItem(d0_vertical_line, ignoreBounds=True)
-
-        self.p2.plot(self.indentation - self.hertz_d0, self.force)
+            self.indentation  = ret_data.indentation[::-1]
+            self.force = ret_data.force[::-1]
+        self.force = self.force - self.force[0]
 
         self.update_fit_range()
+
+        # Get the points used by the fit, as done in the computation
+        fit_indentation, fit_force = prepare_hertz_fit_data(
+            self.indentation, self.force, get_params(self.params, "HertzFit")
+        )
+
+        self.p1_curve.setData(self.indentation, self.force)
+        if self.hertz_d0 != 0:
+            move_line(self.hertz_d0_line, self.hertz_d0)
+        else:
+            self.hertz_d0_line.setVisible(False)
+
+        self.p2_curve.setData(fit_indentation - self.hertz_d0, fit_force)
  
         if self.fit_data is not None:
-            x = self.indentation
+            x = fit_indentation
             y = self.fit_data.eval(x)
-            self.p2.plot(x - self.hertz_d0, y, pen ='g', name='Fit')
-            style = pg.PlotDataItem(pen=None)
-            self.p2legend.addItem(style, f'Hertz E: {self.hertz_E:.2f} Pa')
-            self.p2legend.addItem(style, f'Hertz d0: {self.hertz_d0 + poc[0]:.3E} m')
-            self.p2legend.addItem(style, f'Red. Chi: {self.hertz_redchi:.3E}')
-            res = self.p4.plot(x - self.hertz_d0, self.fit_data.get_residuals(x, self.force), pen=None, symbol='o')
-            res.setSymbolSize(5)
-        
-        self.p1.setLabel('left', 'Force', 'N')
-        self.p1.setLabel('bottom', 'Indentation', 'm')
-        self.p1.setTitle("Force-Indentation")
-        self.p1.addLegend()
-        self.p2.setLabel('left', 'Force', 'N')
-        self.p2.setLabel('bottom', 'Indentation', 'm')
-        self.p2.setTitle("Force-Indentation Hertz Fit")
-        self.p3.setLabel('left', 'Deflection', 'm')
-        self.p3.setLabel('bottom', 'zHeight', 'm')
-        self.p3.setTitle('Deflection-zHeight')
-        self.p4.setLabel('left', 'Residuals')
-        self.p4.setLabel('bottom', 'Indentation', 'm')
-        self.p4.setTitle("Hertz Fit Residuals")
-
-        self.l.addItem(self.p1)
-        self.l.addItem(self.p2)
-        self.l.nextRow()
-        self.l.addItem(self.p3)
-        self.l.addItem(self.p4)
+            self.p2_fit.setData(x - self.hertz_d0, y)
+            self.p2_stats.setLines([
+                f'Hertz E: {self.hertz_E:.2f} Pa',
+                f'Hertz d0: {self.hertz_d0 + poc[0]:.3E} m',
+                f'Red. Chi: {self.hertz_redchi:.3E}'
+            ])
+            self.p4_res.setData(x - self.hertz_d0, self.fit_data.get_residuals(x, fit_force))
+        else:
+            self.p2_fit.setData([], [])
+            self.p2_stats.clear()
+            self.p4_res.setData([], [])
     
     def update_tilt_range(self):
-        dataItems = self.p3.listDataItems()
         analysis_params = self.params.child('Analysis Params')
         offset_type = analysis_params.child('Offset Type').value()
         if offset_type == 'percentage':
@@ -362,13 +401,6 @@ class HertzFitWidget(QtWidgets.QWidget):
         else:
             self.maxoffset = analysis_params.child('Abs. Max Offset').value() / 1e9
             self.minoffset = analysis_params.child('Abs. Min Offset').value() / 1e9
-        if self.offset_roi is not None:
-            self.p3.removeItem(self.offset_roi)
-        self.offset_roi = pg.LinearRegionItem(brush=(50,50,200,0), pen='w', movable=False)
-        self.offset_roi.setZValue(10)
-        self.offset_roi.setClipItem(dataItems[0])
-        self.p3.removeItem(self.offset_roi)
-        self.p3.addItem(self.offset_roi, ignoreBounds=True)
         self.offset_roi.setRegion([self.minoffset, self.maxoffset])
 
     def update_fit_range(self):
@@ -394,13 +426,8 @@ class HertzFitWidget(QtWidgets.QWidget):
             if max_val  == 0.0:
                 max_val = np.max(self.force)
                 hertz_params.child('Max Force').setValue(max_val * 1e9)
-        if self.min_val_line and self.max_val_line:
-            self.p2.removeItem(self.min_val_line)
-            self.p2.removeItem(self.max_val_line)
-        self.min_val_line = pg.InfiniteLine(pos=min_val, angle=angle, pen='y', movable=False, label='Min', labelOpts={'color':'y', 'position':0.7})
-        self.max_val_line = pg.InfiniteLine(pos=max_val, angle=angle, pen='y', movable=False, label='Max', labelOpts={'color':'y', 'position':0.7})
-        self.p2.addItem(self.min_val_line, ignoreBounds=True)
-        self.p2.addItem(self.max_val_line, ignoreBounds=True)
+        move_line(self.min_val_line, min_val, angle)
+        move_line(self.max_val_line, max_val, angle)
 
     def updateParams(self):
         # Updates params related to the current file
@@ -415,20 +442,24 @@ class HertzFitWidget(QtWidgets.QWidget):
         else:
             analysis_params.child('Deflection Sensitivity').setValue(self.session.global_involts)
         
-        analysis_params.child('Correct Tilt').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Offset Type').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Perc. Min Offset').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Perc. Max Offset').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Abs. Min Offset').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Abs. Max Offset').sigValueChanged.connect(self.updatePlots)
+        self.refresh.watch(analysis_params.child('Correct Tilt'))
+        self.refresh.watch(analysis_params.child('Offset Type'))
+        self.refresh.watch(analysis_params.child('Perc. Min Offset'))
+        self.refresh.watch(analysis_params.child('Perc. Max Offset'))
+        self.refresh.watch(analysis_params.child('Abs. Min Offset'))
+        self.refresh.watch(analysis_params.child('Abs. Max Offset'))
         
         hertz_params = self.params.child('Hertz Fit Params')
-        hertz_params.child('Fit Range Type').sigValueChanged.connect(self.update_fit_range)
-        hertz_params.child('Max Indentation').sigValueChanged.connect(self.update_fit_range)
-        hertz_params.child('Min Indentation').sigValueChanged.connect(self.update_fit_range)
-        hertz_params.child('Max Force').sigValueChanged.connect(self.update_fit_range)
-        hertz_params.child('Min Force').sigValueChanged.connect(self.update_fit_range)
-        hertz_params.child('Downsample Signal').sigValueChanged.connect(self.updatePlots)
-        hertz_params.child('PoC Method').sigValueChanged.connect(self.updatePlots)
-        hertz_params.child('PoC Window').sigValueChanged.connect(self.updatePlots)
-        hertz_params.child('Sigma').sigValueChanged.connect(self.updatePlots)
\ No newline at end of file
+        # The fit range changes the points displayed in the fit plot
+        self.refresh.watch(hertz_params.child('Fit Range Type'))
+        self.refresh.watch(hertz_params.child('Max Indentation'))
+        self.refresh.watch(hertz_params.child('Min Indentation'))
+        self.refresh.watch(hertz_params.child('Max Force'))
+        self.refresh.watch(hertz_params.child('Min Force'))
+        self.refresh.watch(hertz_params.child('Downsample Signal'))
+        self.refresh.watch(hertz_params.child('Downsample Pts.'))
+        self.refresh.watch(hertz_params.child('Adaptive Downsample'))
+        self.refresh.watch(hertz_params.child('Downsample Tol.'))
+        self.refresh.watch(hertz_params.child('PoC Method'))
+        self.refresh.watch(hertz_params.child('PoC Window'))
+        self.refresh.watch(hertz_params.child('Sigma'))
\ No newline at end of file
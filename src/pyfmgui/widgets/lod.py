@@ -0,0 +1,130 @@
+import numpy as np
+
+class MinMaxPyramid:
+    '''
+    Min/max envelopes of a signal at decreasing resolutions.
+
+    Level k groups factor**k consecutive samples into one bin
+    displayed by its minimum and maximum values. Levels are
+    computed from the previous one the first time they are used.
+
+    :param x: monotonic x values of the signal
+    :param y: y values of the signal
+    :param factor: number of bins of a level merged in the next level
+    '''
+    def __init__(self, x, y, factor=4):
+        self.x = x
+        self.y = y
+        self.factor = factor
+        self.levels = [(x, y, y)]
+
+    def get_level(self, k):
+        while len(self.levels) <= k:
+            self.levels.append(self.reduce(*self.levels[-1]))
+        return self.levels[k]
+
+    def reduce(self, xs, mins, maxs):
+        n = len(mins)
+        nbins = -(-n // self.factor)
+        pad = nbins * self.factor - n
+        # Repeat the last value to fill the last bin
+        if pad:
+            mins = np.concatenate([mins, np.full(pad, mins[-1])])
+            maxs = np.concatenate([maxs, np.full(pad, maxs[-1])])
+        mins = mins.reshape(nbins, self.factor).min(axis=1)
+        maxs = maxs.reshape(nbins, self.factor).max(axis=1)
+        return xs[::self.factor], mins, maxs
+
+    def get_data(self, k, i0, i1):
+        # Get the envelope at level k of the samples between i0 and i1
+        bin_size = self.factor ** k
+        b0, b1 = i0 // bin_size, -(-i1 // bin_size)
+        xs, mins, maxs = self.get_level(k)
+        if k == 0:
+            return xs[b0:b1], mins[b0:b1]
+        xs, mins, maxs = xs[b0:b1], mins[b0:b1], maxs[b0:b1]
+        return np.repeat(xs, 2), np.column_stack([mins, maxs]).ravel()
+
+class LevelOfDetail:
+    '''
+    Displays the long curves of a plot using min/max envelopes,
+    choosing the level of detail from the visible x range so that
+    zooming and panning stay interactive.
+
+    The envelopes of the last curves displayed are kept, and reused
+    when a refresh displays the same arrays or data with the same key.
+
+    :param plot: pyqtgraph PlotItem holding the curves
+    :param min_points: curves with fewer points are displayed as they are
+    :param max_pyramids: number of envelopes kept for the next refreshes
+    '''
+    def __init__(self, plot, min_points=5000, max_pyramids=64):
+        self.plot = plot
+        self.min_points = min_points
+        self.max_pyramids = max_pyramids
+        self.curves = {}
+        self.pyramids = {}
+        plot.sigXRangeChanged.connect(self.update_curves)
+
+    def get_pyramid(self, x, y, key=None):
+        # The pyramids hold their arrays, so the ids are not reused while they are kept
+        key = (id(x), id(y)) if key is None else key
+        pyramid = self.pyramids.pop(key, None)
+        if pyramid is None or len(pyramid.x) != len(x):
+            pyramid = MinMaxPyramid(x, y)
+        # Keep the pyramids used last
+        self.pyramids[key] = pyramid
+        while len(self.pyramids) > self.max_pyramids:
+            del self.pyramids[next(iter(self.pyramids))]
+        return pyramid
+
+    def setData(self, curve, x, y, key=None, **opts):
+        '''
+        Display x and y in a curve of the plot.
+
+        :param key: optional key of the data, like its file, curve and
+                    segment, to reuse its envelopes when it is displayed
+                    again from new arrays
+        '''
+        x, y = np.asarray(x), np.asarray(y)
+        # Only curves with monotonic x on a linear axis can be decimated
+        if len(x) <= self.min_points or self.plot.getAxis('bottom').logMode or np.any(np.diff(x) < 0):
+            self.curves.pop(curve, None)
+            curve.setData(x, y, **opts)
+            return
+        self.curves[curve] = [self.get_pyramid(x, y, key), None]
+        self.update_curve(curve, **opts)
+
+    def remove(self, curve):
+        self.curves.pop(curve, None)
+
+    def clear(self):
+        # Forget the curves, the pyramids are kept for the next refresh
+        self.curves = {}
+
+    def update_curves(self, *args):
+        for curve in list(self.curves):
+            self.update_curve(curve)
+
+    def update_curve(self, curve, **opts):
+        pyramid, displayed = self.curves[curve]
+        x = pyramid.x
+        vb = self.plot.getViewBox()
+        # Use the full curve while the view follows the data
+        if vb.autoRangeEnabled()[0]:
+            i0, i1 = 0, len(x)
+        else:
+            x0, x1 = vb.viewRange()[0]
+            i0 = max(int(np.searchsorted(x, x0)) - 1, 0)
+            i1 = min(int(np.searchsorted(x, x1)) + 1, len(x))
+        # Choose the coarsest level keeping about two points per pixel
+        max_points = 2 * max(int(vb.width()), 500)
+        k = 0
+        while (i1 - i0) // pyramid.factor ** k > max_points and pyramid.factor ** (k + 1) < len(x):
+            k += 1
+        bin_size = pyramid.factor ** k
+        view = (k, i0 // bin_size, -(-i1 // bin_size))
+        if view == displayed and not opts:
+            return
+        self.curves[curve][1] = view
+        curve.setData(*pyramid.get_data(k, i0, i1), **opts)
@@ -1,46 +1,149 @@
+import glob
+import os
 import sys
+import queue
+import tempfile
+import time
+import logging.handlers
 
-from PyQt5 import QtWidgets
+from PyQt5 import QtWidgets, QtCore
 
 import logging
 logger = logging.getLogger()
 
+def get_log_dir():
+    # Get the folder where the application data is saved
+    app_data_dir = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.AppDataLocation)
+    if not app_data_dir:
+        app_data_dir = tempfile.gettempdir()
+    log_dir = os.path.join(app_data_dir, 'PyFMGUI', 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+# Logs of the previous sessions kept in the log folder
+max_session_logs = 10
+
+def get_session_log_path(log_dir):
+    # Each session writes its own log, several instances can run at once
+    return os.path.join(log_dir, f'pyfmgui_{time.strftime("%Y%m%d_%H%M%S")}_{os.getpid()}.log')
+
+def prune_session_logs(log_dir, keep=max_session_logs):
+    # Delete the logs of the oldest sessions, with their rotated files
+    logs = sorted(glob.glob(os.path.join(log_dir, 'pyfmgui_*.log')), key=os.path.getmtime)
+    for log_path in logs[:-keep] if keep else logs:
+        for path in glob.glob(glob.escape(log_path) + '*'):
+            try:
+                os.remove(path)
+            except OSError:
+                # Still open by another instance on Windows
+                pass
+
 class QTextEditLogger(logging.Handler):
-    def __init__(self, parent):
+    '''
+    Log handler displaying the records in a text box.
+
+    Records can be emitted from any thread, they are queued and
+    appended to the text box in batches by a timer in the GUI thread.
+    Only the last max_lines lines are kept in the text box.
+
+    :param parent: parent widget of the text box
+    :param max_lines: maximum number of lines displayed
+    :param interval: time in ms between updates of the text box
+    '''
+    def __init__(self, parent, max_lines=5000, interval=200):
         super().__init__()
         self.widget = QtWidgets.QPlainTextEdit(parent)
         self.widget.setReadOnly(True)
+        self.widget.setMaximumBlockCount(max_lines)
+        self.max_lines = max_lines
+        self.records = queue.SimpleQueue()
+        self.timer = QtCore.QTimer(self.widget)
+        self.timer.timeout.connect(self.flush_records)
+        self.timer.start(interval)
 
     def emit(self, record):
-        msg = self.format(record)
-        self.widget.appendPlainText(msg)
+        try:
+            self.records.put(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def flush_records(self):
+        # Get all the records queued since the last update
+        msgs = []
+        while True:
+            try:
+                msgs.append(self.records.get_nowait())
+            except queue.Empty:
+                break
+        if not msgs:
+            return
+        # Older records would be dropped by the text box anyway
+        msgs = msgs[-self.max_lines:]
+        self.widget.appendPlainText('\n'.join(msgs))
 
 
 class LoggerDialog(QtWidgets.QDialog, QtWidgets.QPlainTextEdit):
-    def __init__(self, parent=None):
+    def __init__(self, session, parent=None):
         super().__init__(parent)
+        self.session = session
 
         self.logTextBox = QTextEditLogger(self)
         # You can format what is printed to text box
-        self.logTextBox.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        self.logTextBox.setFormatter(formatter)
         logger.addHandler(self.logTextBox)
+        # Keep the full log of this session in rotating files to be exported
+        log_dir = get_log_dir()
+        prune_session_logs(log_dir)
+        self.log_path = get_session_log_path(log_dir)
+        self.fileHandler = logging.handlers.RotatingFileHandler(
+            self.log_path, maxBytes=5*1024*1024, backupCount=3, encoding='utf-8'
+        )
+        self.fileHandler.setFormatter(formatter)
+        logger.addHandler(self.fileHandler)
         # You can control the logging level
         logger.setLevel(logging.INFO)
 
         self._button = QtWidgets.QPushButton(self)
         self._button.setText('Export Logs')
 
+        self.profile_button = QtWidgets.QPushButton(self)
+        self.profile_button.setText('Export Profile')
+        self.profile_button.setToolTip('Save the cProfile stats of the last computation run with Profile Computation enabled.')
+
         layout = QtWidgets.QVBoxLayout()
         # Add the new logging box widget to the layout
         layout.addWidget(self.logTextBox.widget)
-        layout.addWidget(self._button)
+        buttons_layout = QtWidgets.QHBoxLayout()
+        buttons_layout.addWidget(self._button)
+        buttons_layout.addWidget(self.profile_button)
+        layout.addLayout(buttons_layout)
         self.setLayout(layout)
 
         # Connect signal to slot
         self._button.clicked.connect(self.exportLogs)
+        self.profile_button.clicked.connect(self.exportProfile)
 
     def exportLogs(self):
         name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save File", '/', '.txt')
-        with open(name, 'w') as file:
-            text = self.logTextBox.widget.toPlainText()
-            file.write(text)    
\ No newline at end of file
+        if not name:
+            return
+        self.fileHandler.flush()
+        # Concatenate the rotated log files of this session, from the oldest to the newest
+        log_files = [f'{self.log_path}.{i}' for i in range(self.fileHandler.backupCount, 0, -1)]
+        log_files.append(self.log_path)
+        with open(name, 'w', encoding='utf-8') as file:
+            for log_file in log_files:
+                if os.path.exists(log_file):
+                    with open(log_file, encoding='utf-8') as f:
+                        file.write(f.read())
+    
+    def exportProfile(self):
+        if not self.session.profile_stats.profiles:
+            logger.info('No profile available, enable Profile Computation and run the analysis again.')
+            return
+        name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save File", '/', '.prof')
+        if not name:
+            return
+        self.session.profile_stats.dump_stats(name)
+        logger.info(f'Profile saved to {name}')
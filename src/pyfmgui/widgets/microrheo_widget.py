@@ -5,15 +5,20 @@ import pyqtgraph as pg
 from pyqtgraph.parametertree import Parameter, ParameterTree
 import numpy as np
 import pandas as pd
-from scipy.fft import fft, fftfreq
 import logging
 logger = logging.getLogger()
 
 import pyfmgui.const as cts
 from pyfmrheo.utils.signal_processing import *
 from pyfmgui.threading import Worker
+from pyfmgui.refresh import RefreshScheduler
 from pyfmgui.compute import compute
 from pyfmgui.widgets.get_params import get_params
+from pyfmgui.widgets.resume_dialog import ask_resume
+from pyfmgui.widgets.lod import LevelOfDetail
+from pyfmgui.widgets.plot_items import add_line, LegendText, CurvePool
+from pyfmgui.map_geometry import get_map_geometry
+from pyfmgui.result_store import get_curve_result
 
 from pyfmrheo.utils.force_curves import get_poc_RoV_method, get_poc_regulaFalsi_method
 
@@ -25,6 +30,7 @@ class MicrorheoWidget(QtWidgets.QWidget):
         self.current_file = None
         self.file_dict = {}
         self.session.microrheo_widget = self
+        self.refresh = RefreshScheduler(self.updatePlots, parent=self)
         self.init_gui()
         if self.session.loaded_files != {}:
             self.updateCombo()
@@ -102,6 +108,63 @@ class MicrorheoWidget(QtWidgets.QWidget):
         self.p3legend = self.p3.addLegend()
         self.p4legend = self.p4.addLegend()
 
+        # Create the plot items once, they are updated in place on each refresh
+        for plot in (self.p1, self.p2, self.p5, self.p7):
+            plot.addLegend()
+        self.p1_curves = CurvePool(self.p1, LevelOfDetail(self.p1))
+        self.p2_curves = CurvePool(self.p2, LevelOfDetail(self.p2))
+        self.p3_lod = LevelOfDetail(self.p3)
+        self.p4_lod = LevelOfDetail(self.p4)
+        self.p3_curves = CurvePool(self.p3, self.p3_lod)
+        self.p3_fits = CurvePool(self.p3, self.p3_lod)
+        self.p4_curves = CurvePool(self.p4, self.p4_lod)
+        self.p4_fits = CurvePool(self.p4, self.p4_lod)
+        self.p5_curves = CurvePool(self.p5)
+        self.p6_curve = self.p6.plot(pen='g', symbol='o', symbolBrush='g')
+        self.p7_curve = self.p7.plot()
+        self.p8_curve = self.p8.plot()
+        self.init_d0_line = add_line(self.p8, pen='y', label='Init d0', position=0.5)
+        self.p8_stats = LegendText(self.p8legend)
+        self.plots_method = None
+
+        self.p1.setLabel('left', 'zHeight', 'm')
+        self.p1.setLabel('bottom', 'Time', 's')
+        self.p1.setTitle("Modulation zHeight-Time")
+
+        self.p2.setLabel('left', 'Deflection', 'm')
+        self.p2.setLabel('bottom', 'Time', 's')
+        self.p2.setTitle("Modulation Deflection-Time")
+        
+        self.p5.setLabel('left', 'Complex Modulus', 'Pa')
+        self.p5.setLabel('bottom', 'Frequency', 'Hz')
+        self.p5.setTitle("Complex Modulus-Frequency")
+        self.p5.setLogMode(True, True)
+
+        self.p6.setLabel('left', 'Loss Tangent')
+        self.p6.setLabel('bottom', 'Frequency', 'Hz')
+        self.p6.setTitle("Loss Tangent-Frequency")
+        self.p6.setLogMode(True, False)
+
+        self.p7.setLabel('left', 'Deflection', 'm')
+        self.p7.setLabel('bottom', 'zHeight', 'm')
+        self.p7.setTitle("Approach zHeight-Deflection")
+
+        self.p8.setLabel('left', 'Force', 'N')
+        self.p8.setLabel('bottom', 'Indentation', 'm')
+        self.p8.setTitle("Approach Force-Indentation")
+        
+        self.l.addItem(self.p7)
+        self.l.addItem(self.p8)
+        self.l.nextRow()
+        self.l.addItem(self.p1)
+        self.l.addItem(self.p2)
+        self.l.nextRow()
+        self.l.addItem(self.p3)
+        self.l.addItem(self.p4)
+        self.l.nextRow()
+        self.l.addItem(self.p5)
+        self.l.addItem(self.p6)
+
         ## Put vertical label on left side
         main_layout.addLayout(params_layout, 1)
         main_layout.addWidget(self.l, 3)
@@ -111,8 +174,58 @@ class MicrorheoWidget(QtWidgets.QWidget):
     
     def clear(self):
         self.combobox.clear()
-        self.l.clear()
+        self.clear_plots()
         self.l2.clear()
+    
+    def clear_plots(self):
+        for pool in self.curve_pools():
+            pool.clear()
+        for curve in (self.p6_curve, self.p7_curve, self.p8_curve):
+            curve.setData([], [])
+        self.p8_stats.clear()
+    
+    def curve_pools(self):
+        return (
+            self.p1_curves, self.p2_curves, self.p3_curves, self.p3_fits,
+            self.p4_curves, self.p4_fits, self.p5_curves
+        )
+    
+    def set_plots_method(self, method):
+        # The content of the p3 and p4 plots depends on the method
+        if method == self.plots_method:
+            return
+        self.plots_method = method
+        if method == 'FFT':
+            self.p3.setLabel('left', 'zHeight PSD')
+            self.p3.setLabel('bottom', 'Frequency', 'Hz')
+            self.p3.setTitle("FFT")
+            self.p3.setLogMode(True, False)
+
+            self.p4.setLabel('left', 'Deflection PSD')
+            self.p4.setLabel('bottom', 'Frequency', 'Hz')
+            self.p4.setTitle("FFT")
+            self.p4.setLogMode(True, False)
+
+        elif method == 'Sine Fit':
+            self.p3.setLabel('left', 'Detrended Indentation', 'm')
+            self.p3.setLabel('bottom', 'Time', 's')
+            self.p3.setTitle("Detrended Indentation-Time")
+            self.p3.setLogMode(False, False)
+
+            self.p4.setLabel('left', 'Detrended Deflection', 'm')
+            self.p4.setLabel('bottom', 'Time', 's')
+            self.p4.setTitle("Detrended Deflection-Time")
+            self.p4.setLogMode(False, False)
+
+    def get_compute_params(self):
+        # Method and params used to analyze the files found in watch mode
+        if self.params.child('Analysis Params').child('Method').value() == "FFT":
+            methodkey = "Microrheo"
+        else:
+            methodkey = "MicrorheoSine"
+        params = get_params(self.params, methodkey)
+        params['piezo_char_data'] = self.session.piezo_char_data
+        return methodkey, params
 
     def do_hertzfit(self):
         if not self.current_file:
@@ -128,6 +241,8 @@ class MicrorheoWidget(QtWidgets.QWidget):
         self.session.microrheo_results = {}
         params = get_params(self.params, self.methodkey)
         params['piezo_char_data'] = self.session.piezo_char_data
+        # Offer to resume an interrupted run of the same files
+        ask_resume(self, self.methodkey, params, filedict)
         # compute(self.session, params, self.filedict, methodkey)
         logger.info(f'Started {self.methodkey}...')
         logger.info(f'Processing {len(filedict)} files')
@@ -153,7 +268,7 @@ class MicrorheoWidget(QtWidgets.QWidget):
         # Final resets
         self.pushButton.setEnabled(False) # Prevent user from starting another
         # Update the gui
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def changestep(self, step):
         self.session.pbar_widget.set_label_sub_text(step)
@@ -169,7 +284,7 @@ class MicrorheoWidget(QtWidgets.QWidget):
         self.session.pbar_widget.hide()
         self.session.pbar_widget.reset_pbar()
         self.pushButton.setEnabled(True)
-        self.updatePlots()
+        self.refresh.refresh_now()
         logger.info(f'{self.methodkey} completed!')
     
     def load_piezo_char(self):
@@ -201,34 +316,18 @@ class MicrorheoWidget(QtWidgets.QWidget):
         if self.current_file.isFV:
             self.l2.addItem(self.plotItem)
             self.plotItem.addItem(self.ROI)
-            self.plotItem.scene().sigMouseClicked.connect(self.mouseMoved)
-            # create transform to center the corner element on the origin, for any assigned image:
-            if self.session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
-                img = self.session.current_file.imagedata.get('Height(measured)', None)
-                if img is None:
-                    img = self.session.current_file.imagedata.get('Height', None)
-                img = np.rot90(np.fliplr(img))
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-                curve_coords = np.rot90(np.fliplr(curve_coords))
-            elif self.session.current_file.filemetadata['file_type'] in cts.nanoscope_file_extensions:
-                img = self.session.current_file.piezoimg
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
+            self.refresh.connect_once(self.plotItem.scene(), 'sigMouseClicked', self.mouseMoved)
+            # Get the cached map layout of the file
+            geometry = get_map_geometry(self.session, self.current_file)
+            img = geometry.img
             self.correlogram.setImage(img)
-            shape = img.shape
-            rows, cols = shape[0], shape[1]
+            rows, cols = geometry.shape
             self.plotItem.setXRange(0, cols)
             self.plotItem.setYRange(0, rows)
-            curve_coords = np.arange(cols*rows).reshape((cols, rows))
-            if self.session.current_file.filemetadata['file_type'] == "jpk-force-map":
-                curve_coords = np.asarray([row[::(-1)**i] for i, row in enumerate(curve_coords)])
-            self.session.map_coords = curve_coords
+            self.session.map_coords = geometry.curve_coords
         self.session.current_curve_index = 0
         self.ROI.setPos(0, 0)
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def file_changed(self, file_id):
         self.session.current_file = self.session.loaded_files[file_id]
@@ -236,11 +335,14 @@ class MicrorheoWidget(QtWidgets.QWidget):
         self.update()
     
     def updateCombo(self):
+        # Rebuild the list without calling file_changed, it would show the first file
+        self.combobox.blockSignals(True)
         self.combobox.clear()
         self.combobox.addItems(self.session.loaded_files.keys())
-        index = self.combobox.findText(self.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
+        index = self.combobox.findText(self.session.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
         if index >= 0:
             self.combobox.setCurrentIndex(index)
+        self.combobox.blockSignals(False)
         self.update()
     
     def mouseMoved(self,event):
@@ -252,10 +354,10 @@ class MicrorheoWidget(QtWidgets.QWidget):
             x, y = int(pixels.x()), int(pixels.y())
             self.ROI.setPos(x, y)
             self.session.current_curve_index = self.session.map_coords[x,y]
-            self.updatePlots()
+            self.refresh.request()
             if self.session.data_viewer_widget is not None:
                 self.session.data_viewer_widget.ROI.setPos(x, y)
-                self.session.data_viewer_widget.updateCurve()
+                self.session.data_viewer_widget.refresh.request()
     
     def manual_override(self):
         pass
@@ -271,19 +373,6 @@ class MicrorheoWidget(QtWidgets.QWidget):
         if not self.current_file:
             return
 
-        self.l.clear()
-        self.p1.clear()
-        self.p2.clear()
-        self.p3.clear()
-        self.p3legend.clear()
-        self.p4.clear()
-        self.p4legend.clear()
-        self.p5.clear()
-        self.p6.clear()
-        self.p7.clear()
-        self.p8.clear()
-        self.p8legend.clear()
-
         self.freqs = None
         self.G_storage = None
         self.G_loss = None
@@ -313,30 +402,28 @@ class MicrorheoWidget(QtWidgets.QWidget):
         modulation_segments = force_curve.modulation_segments
 
         if modulation_segments == []:
+            self.clear_plots()
             self.open_msg_box(f'No modulation segments found in file:\n {current_file_id}')
             return
 
         microrheo_result = self.session.microrheo_results.get(current_file_id, None)
 
         if microrheo_result:
-            for curve_indx, curve_microrheo_result in microrheo_result:
-                try:
-                    if curve_microrheo_result is None:
-                        continue
-                    if curve_indx == self.session.current_curve_index:
-                        # print(curve_microrheo_result)
-                        self.freqs = curve_microrheo_result[0]
-                        self.G_storage = np.array(curve_microrheo_result[1])
-                        self.G_loss = np.array(curve_microrheo_result[2])
-                        self.Loss_tan = self.G_loss / self.G_storage
-                        if method == 'Sine Fit':
-                            self.ind_results = curve_microrheo_result[3]
-                            self.defl_results = curve_microrheo_result[4]
-                except Exception:
-                    continue
+            curve_microrheo_result = get_curve_result(microrheo_result, self.session.current_curve_index)
+            try:
+                if curve_microrheo_result is not None:
+                    self.freqs = curve_microrheo_result[0]
+                    self.G_storage = np.array(curve_microrheo_result[1])
+                    self.G_loss = np.array(curve_microrheo_result[2])
+                    self.Loss_tan = self.G_loss / self.G_storage
+                    if method == 'Sine Fit':
+                        self.ind_results = curve_microrheo_result[3]
+                        self.defl_results = curve_microrheo_result[4]
+            except Exception:
+                pass
         
         ext_data = force_curve.extend_segments[0][1]
-        self.p7.plot(ext_data.zheight, ext_data.vdeflection)
+        self.p7_curve.setData(ext_data.zheight, ext_data.vdeflection)
 
         comp_PoC = [0, 0]
         if poc_method == 'RoV':
@@ -354,138 +441,75 @@ class MicrorheoWidget(QtWidgets.QWidget):
         forceapp = ext_data.force
         maxind = indapp.max()*1e9
         analysis_params.child('Computed Working Indentation').setValue(maxind)
-        self.p8.plot(indapp, forceapp)
-        vertical_line = pg.InfiniteLine(pos=0, angle=90, pen='y', movable=False, label='Init d0', labelOpts={'color':'y', 'position':0.5})
-        self.p8.addItem(vertical_line, ignoreBounds=True)
+        self.p8_curve.setData(indapp, forceapp)
 
         t0 = 0
         t0_2 = 0
         n_segments = len(modulation_segments)
+        # Key of the segments of this curve, to reuse their envelopes between refreshes
+        curve_key = (current_file_id, current_curve_indx, deflection_sens, height_channel)
+        self.set_plots_method(method)
+        for pool in self.curve_pools():
+            pool.begin()
         if method == 'FFT':
+            # Get the PSDs of the modulation segments, computed once per curve
+            segment_psds = self.session.spectrum_cache.get_segment_psds(
+                current_file_id, current_curve_indx, deflection_sens, height_channel, modulation_segments
+            )
             for i, (_, segment) in enumerate(modulation_segments):
                 time = segment.time
                 freq = segment.segment_metadata['frequency']
                 label = f"{freq} Hz"
-                deltat = time[1] - time[0]
-                nfft = len(segment.vdeflection)
-                W = fftfreq(nfft, d=deltat)
-                fft_height = fft(segment.zheight, nfft)
-                psd_height = fft_height * np.conj(fft_height) / nfft
-                fft_deflect = fft(segment.vdeflection, nfft)
-                psd_deflect = fft_deflect * np.conj(fft_deflect) / nfft
-                L = np.arange(1, np.floor(nfft/2), dtype='int')
-                self.p3.plot(W[L], psd_height[L].real, pen=(i,n_segments), name=f"{freq} Hz")
-                self.p4.plot(W[L], psd_deflect[L].real, pen=(i,n_segments), name=f"{freq} Hz")
+                W, psd_height, psd_deflect = segment_psds[i]
+                self.p3_curves.add(W, psd_height, pen=(i,n_segments), name=f"{freq} Hz")
+                self.p4_curves.add(W, psd_deflect, pen=(i,n_segments), name=f"{freq} Hz")
                 plot_time = time + t0
-                self.p1.plot(plot_time, segment.zheight, pen=(i,n_segments), name=label)
-                self.p2.plot(plot_time, segment.vdeflection, pen=(i,n_segments), name=label)
+                self.p1_curves.add(plot_time, segment.zheight, pen=(i,n_segments), name=label, key=(*curve_key, i, 'zheight'))
+                self.p2_curves.add(plot_time, segment.vdeflection, pen=(i,n_segments), name=label, key=(*curve_key, i, 'vdeflection'))
                 t0 = plot_time[-1]
-        
-            self.p3.setLabel('left', 'zHeight PSD')
-            self.p3.setLabel('bottom', 'Frequency', 'Hz')
-            self.p3.setTitle("FFT")
-            self.p3.setLogMode(True, False)
-            self.p3.addLegend()
-
-            self.p4.setLabel('left', 'Deflection PSD')
-            self.p4.setLabel('bottom', 'Frequency', 'Hz')
-            self.p4.setTitle("FFT")
-            self.p4.setLogMode(True, False)
-            self.p4.addLegend()
 
         elif method == 'Sine Fit':
+            # Get the detrended modulation segments, computed once per curve
+            detrended_segments = self.session.detrend_cache.get_detrended_segments(
+                current_file_id, current_curve_indx, deflection_sens, height_channel, modulation_segments
+            )
             for i, (_, segment) in enumerate(modulation_segments):
                 time = segment.time
                 freq = segment.segment_metadata['frequency']
                 label = f"{freq} Hz"
-                zheight, vdeflection, time_2 =\
-                    detrend_rolling_average(freq, segment.zheight, segment.vdeflection, time, 'zheight', 'deflection', [])
+                zheight, vdeflection, time_2 = detrended_segments[i]
                 indentation = zheight -  vdeflection
                 plot_time_2 = time_2 - time_2[0] + t0_2
-                self.p3.plot(plot_time_2 , indentation, pen='w')
-                self.p4.plot(plot_time_2, vdeflection, pen='w')
+                self.p3_curves.add(plot_time_2 , indentation, pen='w', key=(*curve_key, i, 'detrended indentation'))
+                self.p4_curves.add(plot_time_2, vdeflection, pen='w', key=(*curve_key, i, 'detrended vdeflection'))
                 if self.ind_results is not None and self.defl_results is not None:
                     idx = int((np.abs(np.array(self.freqs) - freq)).argmin())
                     indentation_res = self.ind_results[idx].eval(time=time_2)
                     deflection_res = self.defl_results[idx].eval(time=time_2)
-                    self.p3.plot(plot_time_2, -1 * indentation_res, pen='g')
-                    self.p4.plot(plot_time_2, deflection_res, pen='g')
+                    # Only the first fit curve is shown in the legend
+                    fit_label = "Sine Fit" if i == 0 else None
+                    self.p3_fits.add(plot_time_2, -1 * indentation_res, pen='g', name=fit_label)
+                    self.p4_fits.add(plot_time_2, deflection_res, pen='g', name=fit_label)
                 plot_time_1 = time + t0
-                self.p1.plot(plot_time_1, segment.zheight, pen=(i,n_segments), name=label)
-                self.p2.plot(plot_time_1, segment.vdeflection, pen=(i,n_segments), name=label)
+                self.p1_curves.add(plot_time_1, segment.zheight, pen=(i,n_segments), name=label, key=(*curve_key, i, 'zheight'))
+                self.p2_curves.add(plot_time_1, segment.vdeflection, pen=(i,n_segments), name=label, key=(*curve_key, i, 'vdeflection'))
                 t0 = plot_time_1[-1]
                 t0_2 = plot_time_2[-1]
-
-            self.p3.setLabel('left', 'Detrended Indentation', 'm')
-            self.p3.setLabel('bottom', 'Time', 's')
-            self.p3.setTitle("Detrended Indentation-Time")
-            self.p3.setLogMode(False, False)
-            self.p3.addLegend()
-
-            self.p4.setLabel('left', 'Detrended Deflection', 'm')
-            self.p4.setLabel('bottom', 'Time', 's')
-            self.p4.setTitle("Detrended Deflection-Time")
-            self.p4.setLogMode(False, False)
-
-            if self.ind_results is not None and self.defl_results is not None:
-                style = pg.PlotDataItem(pen='g')
-                self.p3legend.addItem(style, "Sine Fit")
-                self.p4legend.addItem(style, "Sine Fit")
          
         if self.G_storage is not None and self.G_loss is not None:
-            self.p5.plot(self.freqs, self.G_storage, pen='r', symbol='o', symbolBrush='r', name="G Storage")
-            self.p5.plot(self.freqs, self.G_loss, pen='b', symbol='o', symbolBrush='b', name="G Loss")
+            self.p5_curves.add(self.freqs, self.G_storage, pen='r', symbol='o', symbolBrush='r', name="G Storage")
+            self.p5_curves.add(self.freqs, self.G_loss, pen='b', symbol='o', symbolBrush='b', name="G Loss")
+        for pool in self.curve_pools():
+            pool.end()
         
         if self.Loss_tan is not None:
-            self.p6.plot(self.freqs, self.Loss_tan, pen='g', symbol='o', symbolBrush='g')
-        
-        self.p1.setLabel('left', 'zHeight', 'm')
-        self.p1.setLabel('bottom', 'Time', 's')
-        self.p1.setTitle("Modulation zHeight-Time")
-        self.p1.addLegend()
-
-        self.p2.setLabel('left', 'Deflection', 'm')
-        self.p2.setLabel('bottom', 'Time', 's')
-        self.p2.setTitle("Modulation Deflection-Time")
-        self.p2.addLegend()
+            self.p6_curve.setData(self.freqs, self.Loss_tan)
+        else:
+            self.p6_curve.setData([], [])
         
-        self.p5.setLabel('left', 'Complex Modulus', 'Pa')
-        self.p5.setLabel('bottom', 'Frequency', 'Hz')
-        self.p5.setTitle("Complex Modulus-Frequency")
-        self.p5.setLogMode(True, True)
-        self.p5.addLegend()
-
-        self.p6.setLabel('left', 'Loss Tangent')
-        self.p6.setLabel('bottom', 'Frequency', 'Hz')
-        self.p6.setTitle("Loss Tangent-Frequency")
-        self.p6.setLogMode(True, False)
-
-        self.p7.setLabel('left', 'Deflection', 'm')
-        self.p7.setLabel('bottom', 'zHeight', 'm')
-        self.p7.setTitle("Approach zHeight-Deflection")
-        self.p7.addLegend()
-
-        self.p8.setLabel('left', 'Force', 'N')
-        self.p8.setLabel('bottom', 'Indentation', 'm')
-        self.p8.setTitle("Approach Force-Indentation")
-        self.p8.addLegend()
-
-        style = pg.PlotDataItem(pen=None)
-        self.p8legend.addItem(style, f'Computed Working Ind.: {maxind:.2f} nm')
+        self.p8_stats.setLines([f'Computed Working Ind.: {maxind:.2f} nm'])
         if not analysis_params.child('Overwrite Working Ind.').value():
             analysis_params.child('Working Indentation').setValue(maxind)
-        
-        self.l.addItem(self.p7)
-        self.l.addItem(self.p8)
-        self.l.nextRow()
-        self.l.addItem(self.p1)
-        self.l.addItem(self.p2)
-        self.l.nextRow()
-        self.l.addItem(self.p3)
-        self.l.addItem(self.p4)
-        self.l.nextRow()
-        self.l.addItem(self.p5)
-        self.l.addItem(self.p6)
 
     def updateParams(self):
         # Updates params related to the current file
@@ -3,15 +3,19 @@ import PyQt5
 from pyqtgraph.Qt import QtGui, QtWidgets, QtCore
 import pyqtgraph as pg
 from pyqtgraph.parametertree import Parameter, ParameterTree
-from scipy.fft import fft, fftfreq
-import numpy as np
 import logging
 logger = logging.getLogger()
 
 import pyfmgui.const as cts
 from pyfmgui.threading import Worker
+from pyfmgui.refresh import RefreshScheduler
 from pyfmgui.compute import compute
 from pyfmgui.widgets.get_params import get_params
+from pyfmgui.widgets.resume_dialog import ask_resume
+from pyfmgui.widgets.lod import LevelOfDetail
+from pyfmgui.widgets.plot_items import CurvePool
+from pyfmgui.map_geometry import get_map_geometry
+from pyfmgui.result_store import get_curve_result
 
 class PiezoCharWidget(QtWidgets.QWidget):
     def __init__(self, session, parent=None):
@@ -20,6 +24,7 @@ class PiezoCharWidget(QtWidgets.QWidget):
         self.current_file = None
         self.file_dict = {}
         self.session.piezo_char_widget = self
+        self.refresh = RefreshScheduler(self.updatePlots, parent=self)
         self.init_gui()
         if self.session.loaded_files != {}:
             self.updateCombo()
@@ -71,6 +76,53 @@ class PiezoCharWidget(QtWidgets.QWidget):
         self.p6 = pg.PlotItem()
         self.p7 = pg.PlotItem()
 
+        # Create the plot items once, they are updated in place on each refresh
+        for plot in (self.p1, self.p2, self.p3, self.p4):
+            plot.addLegend()
+        self.p1_curves = CurvePool(self.p1, LevelOfDetail(self.p1))
+        self.p2_curves = CurvePool(self.p2, LevelOfDetail(self.p2))
+        self.p3_curves = CurvePool(self.p3)
+        self.p4_curves = CurvePool(self.p4)
+        self.p5_curve = self.p5.plot(symbol='o')
+        self.p6_curve = self.p6.plot(symbol='o')
+
+        self.p1.setLabel('left', 'zHeight', 'm')
+        self.p1.setLabel('bottom', 'Time', 's')
+        self.p1.setTitle("zHeight-Time")
+
+        self.p2.setLabel('left', 'Deflection', 'm')
+        self.p2.setLabel('bottom', 'Time', 's')
+        self.p2.setTitle("Deflection-Time")
+        
+        self.p3.setLabel('left', 'zHeight PSD')
+        self.p3.setLabel('bottom', 'Freq', 'Hz')
+        self.p3.setTitle("FFT")
+        self.p3.setLogMode(True, False)
+
+        self.p4.setLabel('left', 'Deflection PSD')
+        self.p4.setLabel('bottom', 'Freq', 'Hz')
+        self.p4.setTitle("FFT")
+        self.p4.setLogMode(True, False)
+
+        self.p5.setLabel('left', 'Fi', '°')
+        self.p5.setLabel('bottom', 'Frequency', 'Hz')
+        self.p5.setTitle("Fi-Frequency")
+        self.p5.setLogMode(True, False)
+
+        self.p6.setLabel('left', 'Amp Quotient')
+        self.p6.setLabel('bottom', 'Frequency', 'Hz')
+        self.p6.setTitle("Amp Quotient-Frequency")
+        self.p6.setLogMode(True, False)
+        
+        self.l.addItem(self.p1)
+        self.l.addItem(self.p2)
+        self.l.nextRow()
+        self.l.addItem(self.p3)
+        self.l.addItem(self.p4)
+        self.l.nextRow()
+        self.l.addItem(self.p5)
+        self.l.addItem(self.p6)
+
         ## Put vertical label on left side
         main_layout.addLayout(params_layout, 1)
         main_layout.addWidget(self.l, 3)
@@ -80,8 +132,18 @@ class PiezoCharWidget(QtWidgets.QWidget):
     
     def clear(self):
         self.combobox.clear()
-        self.l.clear()
+        self.clear_plots()
         self.l2.clear()
+    
+    def clear_plots(self):
+        for pool in (self.p1_curves, self.p2_curves, self.p3_curves, self.p4_curves):
+            pool.clear()
+        self.p5_curve.setData([], [])
+        self.p6_curve.setData([], [])
+
+    def get_compute_params(self):
+        # Method and params used to analyze the files found in watch mode
+        return "PiezoChar", get_params(self.params, 'PiezoChar')
 
     def do_hertzfit(self):
         if not self.current_file:
@@ -91,6 +153,8 @@ class PiezoCharWidget(QtWidgets.QWidget):
         else:
             filedict = {self.session.current_file.filemetadata['Entry_filename']:self.session.current_file}
         params = get_params(self.params, 'PiezoChar')
+        # Offer to resume an interrupted run of the same files
+        ask_resume(self, 'PiezoChar', params, filedict)
         logger.info('Started PiezoCharacterization...')
         logger.info(f'Processing {len(filedict)} files')
         logger.info(f'Analysis parameters used: {params}')
@@ -115,7 +179,7 @@ class PiezoCharWidget(QtWidgets.QWidget):
         # Final resets
         self.pushButton.setEnabled(False) # Prevent user from starting another
         # Update the gui
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def changestep(self, step):
         self.session.pbar_widget.set_label_sub_text(step)
@@ -131,7 +195,7 @@ class PiezoCharWidget(QtWidgets.QWidget):
         self.session.pbar_widget.hide()
         self.session.pbar_widget.reset_pbar()
         self.pushButton.setEnabled(True)
-        self.updatePlots()
+        self.refresh.refresh_now()
         logger.info('PiezoCharacterization completed!')
     
     def open_msg_box(self, message):
@@ -147,34 +211,18 @@ class PiezoCharWidget(QtWidgets.QWidget):
         if self.current_file.isFV:
             self.l2.addItem(self.plotItem)
             self.plotItem.addItem(self.ROI)
-            self.plotItem.scene().sigMouseClicked.connect(self.mouseMoved)
-            # create transform to center the corner element on the origin, for any assigned image:
-            if self.session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
-                img = self.session.current_file.imagedata.get('Height(measured)', None)
-                if img is None:
-                    img = self.session.current_file.imagedata.get('Height', None)
-                img = np.rot90(np.fliplr(img))
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-                curve_coords = np.rot90(np.fliplr(curve_coords))
-            elif self.session.current_file.filemetadata['file_type'] in cts.nanoscope_file_extensions:
-                img = self.session.current_file.piezoimg
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
+            self.refresh.connect_once(self.plotItem.scene(), 'sigMouseClicked', self.mouseMoved)
+            # Get the cached map layout of the file
+            geometry = get_map_geometry(self.session, self.current_file)
+            img = geometry.img
             self.correlogram.setImage(img)
-            shape = img.shape
-            rows, cols = shape[0], shape[1]
+            rows, cols = geometry.shape
             self.plotItem.setXRange(0, cols)
             self.plotItem.setYRange(0, rows)
-            curve_coords = np.arange(cols*rows).reshape((cols, rows))
-            if self.session.current_file.filemetadata['file_type'] == "jpk-force-map":
-                curve_coords = np.asarray([row[::(-1)**i] for i, row in enumerate(curve_coords)])
-            self.session.map_coords = curve_coords
+            self.session.map_coords = geometry.curve_coords
         self.session.current_curve_index = 0
         self.ROI.setPos(0, 0)
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def file_changed(self, file_id):
         self.session.current_file = self.session.loaded_files[file_id]
@@ -182,11 +230,14 @@ class PiezoCharWidget(QtWidgets.QWidget):
         self.update()
     
     def updateCombo(self):
+        # Rebuild the list without calling file_changed, it would show the first file
+        self.combobox.blockSignals(True)
         self.combobox.clear()
         self.combobox.addItems(self.session.loaded_files.keys())
-        index = self.combobox.findText(self.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
+        index = self.combobox.findText(self.session.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
         if index >= 0:
             self.combobox.setCurrentIndex(index)
+        self.combobox.blockSignals(False)
         self.update()
     
     def mouseMoved(self,event):
@@ -198,10 +249,10 @@ class PiezoCharWidget(QtWidgets.QWidget):
             x, y = int(pixels.x()), int(pixels.y())
             self.ROI.setPos(x, y)
             self.session.current_curve_index = self.session.map_coords[x,y]
-            self.updatePlots()
+            self.refresh.request()
             if self.session.data_viewer_widget is not None:
                 self.session.data_viewer_widget.ROI.setPos(x, y)
-                self.session.data_viewer_widget.updateCurve()
+                self.session.data_viewer_widget.refresh.request()
     
     def manual_override(self):
         pass
@@ -211,14 +262,6 @@ class PiezoCharWidget(QtWidgets.QWidget):
         if not self.current_file:
             return
 
-        self.l.clear()
-        self.p1.clear()
-        self.p2.clear()
-        self.p3.clear()
-        self.p4.clear()
-        self.p5.clear()
-        self.p6.clear()
-
         self.freqs = None
         self.fi = None
         self.amp_quot = None
@@ -237,88 +280,53 @@ class PiezoCharWidget(QtWidgets.QWidget):
         modulation_segs = force_curve.modulation_segments
 
         if modulation_segs == []:
+            self.clear_plots()
             self.open_msg_box(f'No modulation segments found in file:\n {current_file_id}')
             return
 
         piezo_char_result = self.session.piezo_char_results.get(current_file_id, None)
 
         if piezo_char_result:
-            for curve_indx, curve_piezo_char_result in piezo_char_result:
-                try:
-                    if curve_piezo_char_result is None:
-                        continue
-                    if curve_indx == self.session.current_curve_index:
-                        self.freqs = curve_piezo_char_result[0]
-                        self.fi = curve_piezo_char_result[1]
-                        self.amp_quot = curve_piezo_char_result[2]
-                except Exception:
-                    continue
+            curve_piezo_char_result = get_curve_result(piezo_char_result, self.session.current_curve_index)
+            try:
+                if curve_piezo_char_result is not None:
+                    self.freqs = curve_piezo_char_result[0]
+                    self.fi = curve_piezo_char_result[1]
+                    self.amp_quot = curve_piezo_char_result[2]
+            except Exception:
+                pass
         t0 = 0
         n_segments = len(modulation_segs)
+        for pool in (self.p1_curves, self.p2_curves, self.p3_curves, self.p4_curves):
+            pool.begin()
+        # Get the PSDs of the modulation segments, computed once per curve
+        segment_psds = self.session.spectrum_cache.get_segment_psds(
+            current_file_id, current_curve_indx, deflection_sens, height_channel, modulation_segs
+        )
         for i, (_, segment) in enumerate(modulation_segs):
             time = segment.time
             freq = segment.segment_metadata['frequency']
-            deltat = time[1] - time[0]
-            nfft = len(segment.vdeflection)
-            W = fftfreq(nfft, d=deltat)
-            fft_height = fft(segment.zheight, nfft)
-            psd_height = fft_height * np.conj(fft_height) / nfft
-            fft_deflect = fft(segment.vdeflection, nfft)
-            psd_deflect = fft_deflect * np.conj(fft_deflect) / nfft
-            L = np.arange(1, np.floor(nfft/2), dtype='int')
+            W, psd_height, psd_deflect = segment_psds[i]
             plot_time = time + t0
-            self.p1.plot(plot_time, segment.zheight, pen=(i,n_segments), name=f"{freq} Hz")
-            self.p2.plot(plot_time, segment.vdeflection, pen=(i,n_segments), name=f"{freq} Hz")
-            self.p3.plot(W[L], psd_height[L].real, pen=(i,n_segments), name=f"{freq} Hz")
-            self.p4.plot(W[L], psd_deflect[L].real, pen=(i,n_segments), name=f"{freq} Hz")
+            # Key of the segment, to reuse its envelopes between refreshes
+            segment_key = (current_file_id, current_curve_indx, deflection_sens, height_channel, i)
+            self.p1_curves.add(plot_time, segment.zheight, pen=(i,n_segments), name=f"{freq} Hz", key=(*segment_key, 'zheight'))
+            self.p2_curves.add(plot_time, segment.vdeflection, pen=(i,n_segments), name=f"{freq} Hz", key=(*segment_key, 'vdeflection'))
+            self.p3_curves.add(W, psd_height, pen=(i,n_segments), name=f"{freq} Hz")
+            self.p4_curves.add(W, psd_deflect, pen=(i,n_segments), name=f"{freq} Hz")
             t0 = plot_time[-1]
+        for pool in (self.p1_curves, self.p2_curves, self.p3_curves, self.p4_curves):
+            pool.end()
          
         if self.fi is not None:
-            self.p5.plot(self.freqs, self.fi, symbol='o')
+            self.p5_curve.setData(self.freqs, self.fi)
+        else:
+            self.p5_curve.setData([], [])
         
         if self.amp_quot is not None:
-            self.p6.plot(self.freqs, self.amp_quot, symbol='o')
-        
-        self.p1.setLabel('left', 'zHeight', 'm')
-        self.p1.setLabel('bottom', 'Time', 's')
-        self.p1.setTitle("zHeight-Time")
-        self.p1.addLegend()
-
-        self.p2.setLabel('left', 'Deflection', 'm')
-        self.p2.setLabel('bottom', 'Time', 's')
-        self.p2.setTitle("Deflection-Time")
-        self.p2.addLegend()
-        
-        self.p3.setLabel('left', 'zHeight PSD')
-        self.p3.setLabel('bottom', 'Freq', 'Hz')
-        self.p3.setTitle("FFT")
-        self.p3.setLogMode(True, False)
-        self.p3.addLegend()
-
-        self.p4.setLabel('left', 'Deflection PSD')
-        self.p4.setLabel('bottom', 'Freq', 'Hz')
-        self.p4.setTitle("FFT")
-        self.p4.setLogMode(True, False)
-        self.p4.addLegend()
-
-        self.p5.setLabel('left', 'Fi', '°')
-        self.p5.setLabel('bottom', 'Frequency', 'Hz')
-        self.p5.setTitle("Fi-Frequency")
-        self.p5.setLogMode(True, False)
-
-        self.p6.setLabel('left', 'Amp Quotient')
-        self.p6.setLabel('bottom', 'Frequency', 'Hz')
-        self.p6.setTitle("Amp Quotient-Frequency")
-        self.p6.setLogMode(True, False)
-        
-        self.l.addItem(self.p1)
-        self.l.addItem(self.p2)
-        self.l.nextRow()
-        self.l.addItem(self.p3)
-        self.l.addItem(self.p4)
-        self.l.nextRow()
-        self.l.addItem(self.p5)
-        self.l.addItem(self.p6)
+            self.p6_curve.setData(self.freqs, self.amp_quot)
+        else:
+            self.p6_curve.setData([], [])
 
     def updateParams(self):
         # Updates params related to the current file
@@ -0,0 +1,99 @@
+import pyqtgraph as pg
+
+def add_line(plot, pos=0, angle=90, pen='y', label=None, position=0.5):
+    # Add a persistent infinite line to a plot, ignored in the plot bounds
+    line = pg.InfiniteLine(
+        pos=pos, angle=angle, pen=pen, movable=False, label=label, labelOpts={'color':pen, 'position':position}
+    )
+    plot.addItem(line, ignoreBounds=True)
+    return line
+
+def move_line(line, pos, angle=None):
+    # Update a persistent infinite line in place
+    if angle is not None and angle != line.angle:
+        line.setAngle(angle)
+    line.setPos(pos)
+    line.setVisible(True)
+
+class LegendText:
+    '''
+    Legend entry displaying several lines of text that can be
+    updated in place, without adding or removing legend items.
+
+    :param legend: pyqtgraph LegendItem holding the entry
+    '''
+    def __init__(self, legend):
+        self.legend = legend
+        legend.addItem(pg.PlotDataItem(pen=None), '')
+        self.label = legend.items[-1][1]
+        self.legend.setVisible(False)
+
+    def setLines(self, lines):
+        self.label.setText('<br>'.join(lines))
+        self.legend.updateSize()
+        self.legend.setVisible(len(lines) > 0)
+
+    def clear(self):
+        self.setLines([])
+
+class CurvePool:
+    '''
+    Persistent curves of a plot reused between refreshes.
+
+    Curves are only created when a refresh displays more curves
+    than any previous one, unused curves are emptied and hidden.
+    Legend entries are only updated when the curve names change.
+
+    :param plot: pyqtgraph PlotItem holding the curves
+    :param lod: optional LevelOfDetail used to display long curves
+    '''
+    def __init__(self, plot, lod=None):
+        self.plot = plot
+        self.lod = lod
+        self.curves = []
+        self.names = []
+        self.n_used = 0
+
+    def begin(self):
+        self.n_used = 0
+
+    def add(self, x, y, name=None, key=None, **opts):
+        # The key of the data lets the LevelOfDetail reuse its envelopes
+        if self.n_used == len(self.curves):
+            self.curves.append(self.plot.plot())
+            self.names.append(None)
+        curve = self.curves[self.n_used]
+        if self.lod is not None:
+            self.lod.setData(curve, x, y, key=key, **opts)
+        else:
+            curve.setData(x, y, **opts)
+        curve.setVisible(True)
+        self.set_name(self.n_used, name)
+        self.n_used += 1
+        return curve
+
+    def end(self):
+        # Hide the curves not used in this refresh
+        for i in range(self.n_used, len(self.curves)):
+            if self.lod is not None:
+                self.lod.remove(self.curves[i])
+            self.curves[i].setData([], [])
+            self.curves[i].setVisible(False)
+            self.set_name(i, None)
+
+    def clear(self):
+        self.begin()
+        self.end()
+
+    def set_name(self, i, name):
+        if self.names[i] == name:
+            return
+        curve = self.curves[i]
+        legend = self.plot.legend
+        if legend is not None:
+            if self.names[i] is not None:
+                legend.removeItem(curve)
+            if name is not None:
+                legend.addItem(curve, name)
+        curve.opts['name'] = name
+        self.names[i] = name
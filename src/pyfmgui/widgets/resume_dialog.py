@@ -0,0 +1,35 @@
+import os
+from pyqtgraph.Qt import QtWidgets
+# Import logging and get global logger
+import logging
+logger = logging.getLogger()
+
+from pyfmgui.journal import find_journal
+
+def ask_resume(parent, method, params, filedict):
+    '''
+    Offer to resume the interrupted run of a method with the same params
+    and files. If accepted the journal of the run is set in the params,
+    else it is deleted.
+
+    :param parent: widget starting the computation
+    :param method: method to compute
+    :param params: analysis params of the computation
+    :param filedict: files to compute
+    '''
+    # Only the computations of all the curves of the maps are checkpointed
+    if not params['compute_all_curves']:
+        return
+    path, nb_curves = find_journal(method, params, filedict)
+    if path is None:
+        return
+    answer = QtWidgets.QMessageBox.question(
+        parent, "Resume Computation",
+        f"A {method} run of these files was interrupted after computing {nb_curves} curves.\n"
+        "Resume it and compute only the missing curves?"
+    )
+    if answer == QtWidgets.QMessageBox.Yes:
+        params['resume_journal'] = path
+    else:
+        logger.info(f"Discarded the journal of the interrupted run: {path}")
+        os.remove(path)
@@ -1,6 +1,5 @@
 import os
 import numpy as np
-import requests
 import xml.etree.ElementTree as etree
 import PyQt5
 from pyqtgraph.Qt import QtGui, QtWidgets, QtCore
@@ -221,6 +220,8 @@ class ThermalTuneWidget(QtWidgets.QWidget):
         self.selectedCantCode = self.sader_canti_list.get(self.selectedCantId, "")
     
     def SaderGCI_GetLeverList(self):
+        # Import requests only when connecting to the Sader API
+        import requests
         payload = '''<?xml version="1.0" encoding="UTF-8" ?>
         <saderrequest>
         <username>'''+self.session.sader_username+'''</username>
@@ -252,6 +253,7 @@ class ThermalTuneWidget(QtWidgets.QWidget):
     def sader_login(self):
         self.session.sader_username = self.user_name_text.text()
         self.session.sader_password = self.user_pwd_text.text()
+        import requests
         try:
             self.sader_canti_list = self.SaderGCI_GetLeverList()
             if self.sader_canti_list == {}:
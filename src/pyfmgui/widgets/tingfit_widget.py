@@ -8,8 +8,16 @@ logger = logging.getLogger()
 
 import pyfmgui.const as cts
 from pyfmgui.threading import Worker
+from pyfmgui.refresh import RefreshScheduler
 from pyfmgui.compute import compute
 from pyfmgui.widgets.get_params import get_params
+from pyfmgui.widgets.resume_dialog import ask_resume
+from pyfmgui.widgets.plot_items import add_line, move_line, LegendText
+from pyfmgui.map_geometry import get_map_geometry
+from pyfmgui.fit_data import get_downsample_step
+from pyfmgui.result_maps import get_result_map
+from pyfmgui.methods import get_method
+from pyfmgui.result_store import get_curve_result
 
 from pyfmrheo.utils.force_curves import get_poc_RoV_method, get_poc_regulaFalsi_method, correct_viscous_drag, correct_tilt, correct_offset
 
@@ -18,11 +26,10 @@ class TingFitWidget(QtWidgets.QWidget):
         super(TingFitWidget, self).__init__(parent)
         self.session = session
         self.current_file = None
-        self.min_val_line = None
-        self.max_val_line = None
-        self.offset_roi = None
+        self.height_img = None
         self.file_dict = {}
         self.session.ting_fit_widget = self
+        self.refresh = RefreshScheduler(self.updatePlots, parent=self)
         self.init_gui()
         if self.session.loaded_files != {}:
             self.updateCombo()
@@ -45,11 +52,16 @@ class TingFitWidget(QtWidgets.QWidget):
         self.paramTree = ParameterTree()
         self.paramTree.setParameters(self.params, showTop=False)
 
+        self.map_field_cb = QtWidgets.QComboBox()
+        self.map_field_cb.addItems(['Height', *get_method("TingFit").map_fields.keys()])
+        self.map_field_cb.currentTextChanged.connect(self.update_map_image)
+
         self.l2 = pg.GraphicsLayoutWidget()
 
         params_layout.addWidget(self.combobox, 1)
         params_layout.addWidget(self.paramTree, 3)
         params_layout.addWidget(self.pushButton, 1)
+        params_layout.addWidget(self.map_field_cb, 1)
         params_layout.addWidget(self.l2, 2)
 
         self.l = pg.GraphicsLayoutWidget()
@@ -72,6 +84,44 @@ class TingFitWidget(QtWidgets.QWidget):
         self.p3 = pg.PlotItem()
         self.p4 = pg.PlotItem()
 
+        # Create the plot items once, they are updated in place on each refresh
+        self.p1_ext = self.p1.plot()
+        self.p1_ret = self.p1.plot()
+        self.init_d0_line = add_line(self.p1, pen='y', label='Init d0', position=0.5)
+        self.hertz_d0_line = add_line(self.p1, pen='g', label='Hertz d0', position=0.7)
+        self.p2_curve = self.p2.plot()
+        self.p2_fit = self.p2.plot(pen='g', name='Fit')
+        self.p2_stats = LegendText(self.p2legend)
+        self.ting_tc_line = add_line(self.p2, pen='y', label='Ting tc', position=0.5)
+        self.p3.addLegend()
+        self.p3_ext = self.p3.plot()
+        self.p3_ret = self.p3.plot()
+        self.offset_roi = pg.LinearRegionItem(brush=(50,50,200,0), pen='w', movable=False)
+        self.offset_roi.setZValue(10)
+        self.offset_roi.setClipItem(self.p3_ext)
+        self.p3.addItem(self.offset_roi, ignoreBounds=True)
+        self.p4_res = self.p4.plot(pen=None, symbol='o', symbolSize=5)
+        self.clear_plots()
+
+        self.p1.setLabel('left', 'Force', 'N')
+        self.p1.setLabel('bottom', 'Indentation', 'm')
+        self.p1.setTitle("Force-Indentation")
+        self.p2.setLabel('left', 'Force', 'N')
+        self.p2.setLabel('bottom', 'Time', 's')
+        self.p2.setTitle("Force-Time Ting Fit")
+        self.p3.setLabel('left', 'Deflection', 'm')
+        self.p3.setLabel('bottom', 'zHeight', 'm')
+        self.p3.setTitle("Deflection-zHeight")
+        self.p4.setLabel('left', 'Residuals')
+        self.p4.setLabel('bottom', 'Time', 's')
+        self.p4.setTitle("Ting Fit Residuals")
+
+        self.l.addItem(self.p1)
+        self.l.addItem(self.p2)
+        self.l.nextRow()
+        self.l.addItem(self.p3)
+        self.l.addItem(self.p4)
+
         ## Put vertical label on left side
         main_layout.addLayout(params_layout, 1)
         main_layout.addWidget(self.l, 3)
@@ -81,8 +131,19 @@ class TingFitWidget(QtWidgets.QWidget):
     
     def clear(self):
         self.combobox.clear()
-        self.l.clear()
+        self.clear_plots()
         self.l2.clear()
+    
+    def clear_plots(self):
+        for curve in (self.p1_ext, self.p1_ret, self.p2_curve, self.p2_fit, self.p3_ext, self.p3_ret, self.p4_res):
+            curve.setData([], [])
+        for line in (self.hertz_d0_line, self.ting_tc_line):
+            line.setVisible(False)
+        self.p2_stats.clear()
+
+    def get_compute_params(self):
+        # Method and params used to analyze the files found in watch mode
+        return "TingFit", get_params(self.params, "TingFit")
 
     def do_hertzfit(self):
         if not self.current_file:
@@ -92,6 +153,8 @@ class TingFitWidget(QtWidgets.QWidget):
         else:
             filedict = {self.session.current_file.filemetadata['Entry_filename']:self.session.current_file}
         params = get_params(self.params, "TingFit")
+        # Offer to resume an interrupted run of the same files
+        ask_resume(self, "TingFit", params, filedict)
         # compute(self.session, params,  self.filedict, "TingFit")
         logger.info('Started ViscoelasticityFit...')
         logger.info(f'Processing {len(filedict)} files')
@@ -117,8 +180,7 @@ class TingFitWidget(QtWidgets.QWidget):
         # Final resets
         self.pushButton.setEnabled(False) # Prevent user from starting another
         # Update the gui
-        self.updatePlots()
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def changestep(self, step):
         self.session.pbar_widget.set_label_sub_text(step)
@@ -134,7 +196,8 @@ class TingFitWidget(QtWidgets.QWidget):
         self.session.pbar_widget.hide()
         self.session.pbar_widget.reset_pbar()
         self.pushButton.setEnabled(True)
-        self.updatePlots()
+        self.update_map_image()
+        self.refresh.refresh_now()
         logger.info('ViscoelasticityFit completed!')
 
     def update(self):
@@ -144,34 +207,34 @@ class TingFitWidget(QtWidgets.QWidget):
         if self.current_file.isFV:
             self.l2.addItem(self.plotItem)
             self.plotItem.addItem(self.ROI)
-            self.plotItem.scene().sigMouseClicked.connect(self.mouseMoved)
-            # create transform to center the corner element on the origin, for any assigned image:
-            if self.session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
-                img = self.session.current_file.imagedata.get('Height(measured)', None)
-                if img is None:
-                    img = self.session.current_file.imagedata.get('Height', None)
-                img = np.rot90(np.fliplr(img))
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-                curve_coords = np.rot90(np.fliplr(curve_coords))
-            elif self.session.current_file.filemetadata['file_type'] in cts.nanoscope_file_extensions:
-                img = self.session.current_file.piezoimg
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-            self.correlogram.setImage(img)
-            shape = img.shape
-            rows, cols = shape[0], shape[1]
+            self.refresh.connect_once(self.plotItem.scene(), 'sigMouseClicked', self.mouseMoved)
+            # Get the cached map layout of the file
+            geometry = get_map_geometry(self.session, self.current_file)
+            self.height_img = geometry.img
+            rows, cols = geometry.shape
             self.plotItem.setXRange(0, cols)
             self.plotItem.setYRange(0, rows)
-            curve_coords = np.arange(cols*rows).reshape((cols, rows))
-            if self.current_file.filemetadata['file_type'] == "jpk-force-map":
-                curve_coords = np.asarray([row[::(-1)**i] for i, row in enumerate(curve_coords)])
-            self.session.map_coords = curve_coords
+            self.session.map_coords = geometry.curve_coords
+            self.update_map_image()
         self.session.current_curve_index = 0
         self.ROI.setPos(0, 0)
-        self.updatePlots()
+        self.refresh.refresh_now()
+    
+    def update_map_image(self):
+        if not self.current_file or not self.current_file.isFV or self.height_img is None:
+            return
+        field = self.map_field_cb.currentText()
+        img = self.height_img
+        if field != 'Height':
+            file_id = self.current_file.filemetadata['Entry_filename']
+            result_map = get_result_map(self.session, "TingFit", file_id, get_map_geometry(self.session, self.current_file))
+            if result_map is not None:
+                img = result_map.get(field)
+        finite_vals = img[np.isfinite(img)]
+        if finite_vals.size == 0:
+            self.correlogram.clear()
+            return
+        self.correlogram.setImage(img, levels=(finite_vals.min(), finite_vals.max()))
     
     def file_changed(self, file_id):
         self.session.current_file = self.session.loaded_files[file_id]
@@ -179,11 +242,14 @@ class TingFitWidget(QtWidgets.QWidget):
         self.update()
     
     def updateCombo(self):
+        # Rebuild the list without calling file_changed, it would show the first file
+        self.combobox.blockSignals(True)
         self.combobox.clear()
         self.combobox.addItems(self.session.loaded_files.keys())
-        index = self.combobox.findText(self.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
+        index = self.combobox.findText(self.session.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
         if index >= 0:
             self.combobox.setCurrentIndex(index)
+        self.combobox.blockSignals(False)
         self.update()
     
     def mouseMoved(self,event):
@@ -195,23 +261,16 @@ class TingFitWidget(QtWidgets.QWidget):
             x, y = int(pixels.x()), int(pixels.y())
             self.ROI.setPos(x, y)
             self.session.current_curve_index = self.session.map_coords[x,y]
-            self.updatePlots()
+            self.refresh.request()
             if self.session.data_viewer_widget is not None:
                 self.session.data_viewer_widget.ROI.setPos(x, y)
-                self.session.data_viewer_widget.updateCurve()
+                self.session.data_viewer_widget.refresh.request()
 
     def updatePlots(self):
 
         if not self.current_file:
             return
 
-        self.l.clear()
-        self.p1.clear()
-        self.p2.clear()
-        self.p2legend.clear()
-        self.p3.clear()
-        self.p4.clear()
-
         self.hertz_E = None
         self.hertz_d0 = 0
         self.ting_d0 = 0
@@ -249,30 +308,27 @@ class TingFitWidget(QtWidgets.QWidget):
         file_ting_result = self.session.ting_fit_results.get(current_file_id, None)
 
         if file_ting_result:
-            for curve_indx, result in file_ting_result:
-                try:
-                    if result is None:
-                        continue
-                    else:
-                        curve_ting_result, curve_hertz_result = result
-                    if curve_indx == self.session.current_curve_index:
-                        self.ting_E = curve_ting_result.E0
-                        self.ting_exp = curve_ting_result.betaE
-                        self.ting_tc = curve_ting_result.tc
-                        self.ting_redchi = curve_ting_result.redchi
-                        self.ting_f0 = curve_ting_result.F0
-                        self.hertz_E = curve_hertz_result.E0
-                        self.hertz_d0 = curve_hertz_result.delta0
-                        self.hertz_redchi = curve_hertz_result.redchi
-                        self.fit_data = curve_ting_result
-                except Exception:
-                    continue
+            result = get_curve_result(file_ting_result, self.session.current_curve_index)
+            try:
+                if result is not None:
+                    curve_ting_result, curve_hertz_result = result
+                    self.ting_E = curve_ting_result.E0
+                    self.ting_exp = curve_ting_result.betaE
+                    self.ting_tc = curve_ting_result.tc
+                    self.ting_redchi = curve_ting_result.redchi
+                    self.ting_f0 = curve_ting_result.F0
+                    self.hertz_E = curve_hertz_result.E0
+                    self.hertz_d0 = curve_hertz_result.delta0
+                    self.hertz_redchi = curve_hertz_result.redchi
+                    self.fit_data = curve_ting_result
+            except Exception:
+                pass
 
         ext_data = force_curve.extend_segments[0][1]
         ret_data = force_curve.retract_segments[-1][1]
 
-        self.p3.plot(ext_data.zheight, ext_data.vdeflection)
-        self.p3.plot(ret_data.zheight, ret_data.vdeflection)
+        self.p3_ext.setData(ext_data.zheight, ext_data.vdeflection)
+        self.p3_ret.setData(ret_data.zheight, ret_data.vdeflection)
 
         self.sep_idx = len(ext_data.zheight)
         self.zheight = np.r_[ext_data.zheight, ret_data.zheight]
@@ -304,18 +360,17 @@ class TingFitWidget(QtWidgets.QWidget):
         else:
             poc = [0, 0]
 
-        vertical_line = pg.InfiniteLine(pos=0, angle=90, pen='y', movable=False, label='Init d0', labelOpts={'color':'y', 'position':0.5})
-        self.p1.addItem(vertical_line, ignoreBounds=True)
         if self.hertz_d0 != 0:
-            d0_vertical_line = pg.InfiniteLine(pos=self.hertz_d0, angle=90, pen='g', movable=False, label='Hertz d0', labelOpts={'color':'g', 'position':0.7})
-            self.p1.addItem(d0_vertical_line, ignoreBounds=True)
+            move_line(self.hertz_d0_line, self.hertz_d0)
             poc[0] += self.hertz_d0
+        else:
+            self.hertz_d0_line.setVisible(False)
         force_curve.get_force_vs_indentation(poc, spring_k)
         if vdragcorr:
             ext_data.force, ret_data.force = correct_viscous_drag(
                 ext_data.indentation, ext_data.force, ret_data.indentation, ret_data.force, poly_order=polyordr, speed=rampspeed)
-        self.p1.plot(ext_data.indentation, ext_data.force)
-        self.p1.plot(ret_data.indentation, ret_data.force)
+        self.p1_ext.setData(ext_data.indentation, ext_data.force)
+        self.p1_ret.setData(ret_data.indentation, ret_data.force)
         
         idx_tc = (np.abs(ext_data.indentation - 0)).argmin()
         t0 = ext_data.time[-1]
@@ -331,65 +386,45 @@ class TingFitWidget(QtWidgets.QWidget):
         tc_fit = tc-time_fit[0]
         time_fit = time_fit - time_fit[0] - tc_fit
         
-        downfactor= len(time_fit) // pts_downsample
-        idxDown = list(range(0, len(time_fit), downfactor))
+        idxDown = slice(0, len(time_fit), get_downsample_step(len(time_fit), pts_downsample))
 
-        self.p2.plot(time_fit[idxDown], force_fit[idxDown])
+        self.p2_curve.setData(time_fit[idxDown], force_fit[idxDown])
 
         self.update_tilt_range()
 
         if self.fit_data is not None:
-            self.p2.plot(
+            self.p2_fit.setData(
                 time_fit[idxDown],
                 self.fit_data.eval(
                     time_fit[idxDown], force_fit[idxDown], ind_fit[idxDown], t0=t0_scaling,
                     idx_tm=self.fit_data.idx_tm, smooth_w=self.fit_data.smooth_w,
                     v0t=self.fit_data.v0t, v0r=self.fit_data.v0r
-                ), pen ='g', name='Fit')
-            vertical_line_tinc_tc = pg.InfiniteLine(
-                pos=self.ting_tc, angle=90, pen='y', movable=False, label='Ting tc', labelOpts={'color':'y', 'position':0.5}
-            )
-            self.p2.addItem(vertical_line_tinc_tc, ignoreBounds=True)
-            style = pg.PlotDataItem(pen=None)
-            self.p2legend.addItem(style, f'Hertz E: {self.hertz_E:.2f} Pa')
-            self.p2legend.addItem(style, f'Hertz d0: {self.hertz_d0 + poc[0]:.3E} m')
-            self.p2legend.addItem(style, f'Hertz Red. Chi: {self.hertz_redchi:.3E}')
-            self.p2legend.addItem(style, f'Ting E: {self.ting_E:.2f} Pa')
-            self.p2legend.addItem(style, f'Ting Fluid. Exp.: {self.ting_exp:.3f}')
-            self.p2legend.addItem(style, f'Ting tc: {self.ting_tc+tc_fit:.2f} s')
-            self.p2legend.addItem(style, f'Ting Red. Chi: {self.ting_redchi:.3E}')
-            res = self.p4.plot(
+                ))
+            move_line(self.ting_tc_line, self.ting_tc)
+            self.p2_stats.setLines([
+                f'Hertz E: {self.hertz_E:.2f} Pa',
+                f'Hertz d0: {self.hertz_d0 + poc[0]:.3E} m',
+                f'Hertz Red. Chi: {self.hertz_redchi:.3E}',
+                f'Ting E: {self.ting_E:.2f} Pa',
+                f'Ting Fluid. Exp.: {self.ting_exp:.3f}',
+                f'Ting tc: {self.ting_tc+tc_fit:.2f} s',
+                f'Ting Red. Chi: {self.ting_redchi:.3E}'
+            ])
+            self.p4_res.setData(
                 time_fit[idxDown],
                 self.fit_data.get_residuals(
                     time_fit[idxDown], force_fit[idxDown], ind_fit[idxDown], t0=t0_scaling,
                     idx_tm=self.fit_data.idx_tm, smooth_w=self.fit_data.smooth_w,
                     v0t=self.fit_data.v0t, v0r=self.fit_data.v0r
-                ), pen=None, symbol='o')
-            res.setSymbolSize(5)
-        
-        self.p1.setLabel('left', 'Force', 'N')
-        self.p1.setLabel('bottom', 'Indentation', 'm')
-        self.p1.setTitle("Force-Indentation")
-        self.p2.setLabel('left', 'Force', 'N')
-        self.p2.setLabel('bottom', 'Time', 's')
-        self.p2.setTitle("Force-Time Ting Fit")
-        self.p3.setLabel('left', 'Deflection', 'm')
-        self.p3.setLabel('bottom', 'zHeight', 'm')
-        self.p3.addLegend()
-        self.p3.setTitle("Deflection-zHeight")
-        self.p4.setLabel('left', 'Residuals')
-        self.p4.setLabel('bottom', 'Time', 's')
-        self.p4.setTitle("Ting Fit Residuals")
-        
-        self.l.addItem(self.p1)
-        self.l.addItem(self.p2)
-        self.l.nextRow()
-        self.l.addItem(self.p3)
-        self.l.addItem(self.p4)
+                ))
+        else:
+            self.p2_fit.setData([], [])
+            self.ting_tc_line.setVisible(False)
+            self.p2_stats.clear()
+            self.p4_res.setData([], [])
     
     def update_tilt_range(self):
         zheight = self.zheight[:self.sep_idx]
-        dataItems = self.p3.listDataItems()
         analysis_params = self.params.child('Analysis Params')
         offset_type = analysis_params.child('Offset Type').value()
         if offset_type == 'percentage':
@@ -401,13 +436,6 @@ class TingFitWidget(QtWidgets.QWidget):
         else:
             self.maxoffset = analysis_params.child('Abs. Max Offset').value() / 1e9
             self.minoffset = analysis_params.child('Abs. Min Offset').value() / 1e9
-        if self.offset_roi is not None:
-            self.p3.removeItem(self.offset_roi)
-        self.offset_roi = pg.LinearRegionItem(brush=(50,50,200,0), pen='w', movable=False)
-        self.offset_roi.setZValue(10)
-        self.offset_roi.setClipItem(dataItems[0])
-        self.p3.removeItem(self.offset_roi)
-        self.p3.addItem(self.offset_roi, ignoreBounds=True)
         self.offset_roi.setRegion([self.minoffset, self.maxoffset])
 
 
@@ -424,9 +452,9 @@ class TingFitWidget(QtWidgets.QWidget):
         else:
             analysis_params.child('Deflection Sensitivity').setValue(self.session.global_involts)
         
-        analysis_params.child('Correct Tilt').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Offset Type').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Perc. Min Offset').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Perc. Max Offset').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Abs. Min Offset').sigValueChanged.connect(self.updatePlots)
-        analysis_params.child('Abs. Max Offset').sigValueChanged.connect(self.updatePlots)
\ No newline at end of file
+        self.refresh.watch(analysis_params.child('Correct Tilt'))
+        self.refresh.watch(analysis_params.child('Offset Type'))
+        self.refresh.watch(analysis_params.child('Perc. Min Offset'))
+        self.refresh.watch(analysis_params.child('Perc. Max Offset'))
+        self.refresh.watch(analysis_params.child('Abs. Min Offset'))
+        self.refresh.watch(analysis_params.child('Abs. Max Offset'))
\ No newline at end of file
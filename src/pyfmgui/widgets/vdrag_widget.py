@@ -3,16 +3,20 @@ import PyQt5
 from pyqtgraph.Qt import QtGui, QtWidgets, QtCore
 import pyqtgraph as pg
 from pyqtgraph.parametertree import Parameter, ParameterTree
-import numpy as np
 import pandas as pd
-from scipy.fft import fft, fftfreq
 import logging
 logger = logging.getLogger()
 
 import pyfmgui.const as cts
 from pyfmgui.threading import Worker
+from pyfmgui.refresh import RefreshScheduler
 from pyfmgui.compute import compute
 from pyfmgui.widgets.get_params import get_params
+from pyfmgui.widgets.resume_dialog import ask_resume
+from pyfmgui.widgets.lod import LevelOfDetail
+from pyfmgui.widgets.plot_items import CurvePool
+from pyfmgui.map_geometry import get_map_geometry
+from pyfmgui.result_store import get_curve_result
 
 class VDragWidget(QtWidgets.QWidget):
     def __init__(self, session, parent=None):
@@ -21,6 +25,7 @@ class VDragWidget(QtWidgets.QWidget):
         self.current_file = None
         self.file_dict = {}
         self.session.vdrag_widget = self
+        self.refresh = RefreshScheduler(self.updatePlots, parent=self)
         self.init_gui()
         if self.session.loaded_files != {}:
             self.updateCombo()
@@ -93,6 +98,51 @@ class VDragWidget(QtWidgets.QWidget):
         self.p6 = pg.PlotItem()
         self.p7 = pg.PlotItem()
 
+        # Create the plot items once, they are updated in place on each refresh
+        for plot in (self.p1, self.p2, self.p3, self.p4, self.p5):
+            plot.addLegend()
+        self.p1_curves = CurvePool(self.p1, LevelOfDetail(self.p1))
+        self.p2_curves = CurvePool(self.p2, LevelOfDetail(self.p2))
+        self.p3_curves = CurvePool(self.p3)
+        self.p4_curves = CurvePool(self.p4)
+        self.p5_curves = CurvePool(self.p5)
+        self.p6_curve = self.p6.plot(symbol='o')
+
+        self.p1.setLabel('left', 'zHeight', 'm')
+        self.p1.setLabel('bottom', 'Time', 's')
+        self.p1.setTitle("zHeight-Time")
+
+        self.p2.setLabel('left', 'Deflection', 'm')
+        self.p2.setLabel('bottom', 'Time', 's')
+        self.p2.setTitle("Deflection-Time")
+        
+        self.p3.setLabel('left', 'zHeight PSD')
+        self.p3.setLabel('bottom', 'Freq', 'Hz')
+        self.p3.setTitle("FFT")
+        self.p3.setLogMode(True, False)
+
+        self.p4.setLabel('left', 'Deflection PSD')
+        self.p4.setLabel('bottom', 'Freq', 'Hz')
+        self.p4.setTitle("FFT")
+        self.p4.setLogMode(True, False)
+
+        self.p5.setLabel('left', 'Hd')
+        self.p5.setLabel('bottom', 'Distance', 'm')
+        self.p5.setTitle("Hd-Distance")
+
+        self.p6.setLabel('left', 'Bh', 'Ns/m')
+        self.p6.setLabel('bottom', 'Distance', 'm')
+        self.p6.setTitle("Bh-Distances")
+        
+        self.l.addItem(self.p1)
+        self.l.addItem(self.p2)
+        self.l.nextRow()
+        self.l.addItem(self.p3)
+        self.l.addItem(self.p4)
+        self.l.nextRow()
+        self.l.addItem(self.p5)
+        self.l.addItem(self.p6)
+
         ## Put vertical label on left side
         main_layout.addLayout(params_layout, 1)
         main_layout.addWidget(self.l, 3)
@@ -102,8 +152,19 @@ class VDragWidget(QtWidgets.QWidget):
     
     def clear(self):
         self.combobox.clear()
-        self.l.clear()
+        self.clear_plots()
         self.l2.clear()
+    
+    def clear_plots(self):
+        for pool in (self.p1_curves, self.p2_curves, self.p3_curves, self.p4_curves, self.p5_curves):
+            pool.clear()
+        self.p6_curve.setData([], [])
+
+    def get_compute_params(self):
+        # Method and params used to analyze the files found in watch mode
+        params = get_params(self.params, "VDrag")
+        params['piezo_char_data'] = self.session.piezo_char_data
+        return "VDrag", params
 
     def do_hertzfit(self):
         if not self.current_file:
@@ -114,6 +175,8 @@ class VDragWidget(QtWidgets.QWidget):
             filedict = {self.session.current_file.filemetadata['Entry_filename']:self.session.current_file}
         params = get_params(self.params, "VDrag")
         params['piezo_char_data'] = self.session.piezo_char_data
+        # Offer to resume an interrupted run of the same files
+        ask_resume(self, "VDrag", params, filedict)
         # compute(self.session, params,  self.filedict, "VDrag")
         logger.info('Started VDrag...')
         logger.info(f'Processing {len(filedict)} files')
@@ -139,7 +202,7 @@ class VDragWidget(QtWidgets.QWidget):
         # Final resets
         self.pushButton.setEnabled(False) # Prevent user from starting another
         # Update the gui
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def changestep(self, step):
         self.session.pbar_widget.set_label_sub_text(step)
@@ -155,7 +218,7 @@ class VDragWidget(QtWidgets.QWidget):
         self.session.pbar_widget.hide()
         self.session.pbar_widget.reset_pbar()
         self.pushButton.setEnabled(True)
-        self.updatePlots()
+        self.refresh.refresh_now()
         logger.info('VDrag completed!')
     
     def load_piezo_char(self):
@@ -187,34 +250,18 @@ class VDragWidget(QtWidgets.QWidget):
         if self.current_file.isFV:
             self.l2.addItem(self.plotItem)
             self.plotItem.addItem(self.ROI)
-            self.plotItem.scene().sigMouseClicked.connect(self.mouseMoved)
-            # create transform to center the corner element on the origin, for any assigned image:
-            if self.session.current_file.filemetadata['file_type'] in cts.jpk_file_extensions:
-                img = self.session.current_file.imagedata.get('Height(measured)', None)
-                if img is None:
-                    img = self.session.current_file.imagedata.get('Height', None)
-                img = np.rot90(np.fliplr(img))
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
-                curve_coords = np.rot90(np.fliplr(curve_coords))
-            elif self.session.current_file.filemetadata['file_type'] in cts.nanoscope_file_extensions:
-                img = self.session.current_file.piezoimg
-                shape = img.shape
-                rows, cols = shape[0], shape[1]
-                curve_coords = np.arange(cols*rows).reshape((cols, rows))
+            self.refresh.connect_once(self.plotItem.scene(), 'sigMouseClicked', self.mouseMoved)
+            # Get the cached map layout of the file
+            geometry = get_map_geometry(self.session, self.current_file)
+            img = geometry.img
             self.correlogram.setImage(img)
-            shape = img.shape
-            rows, cols = shape[0], shape[1]
+            rows, cols = geometry.shape
             self.plotItem.setXRange(0, cols)
             self.plotItem.setYRange(0, rows)
-            curve_coords = np.arange(cols*rows).reshape((cols, rows))
-            if self.session.current_file.filemetadata['file_type'] == "jpk-force-map":
-                curve_coords = np.asarray([row[::(-1)**i] for i, row in enumerate(curve_coords)])
-            self.session.map_coords = curve_coords
+            self.session.map_coords = geometry.curve_coords
         self.session.current_curve_index = 0
         self.ROI.setPos(0, 0)
-        self.updatePlots()
+        self.refresh.refresh_now()
     
     def file_changed(self, file_id):
         self.session.current_file = self.session.loaded_files[file_id]
@@ -222,11 +269,14 @@ class VDragWidget(QtWidgets.QWidget):
         self.update()
     
     def updateCombo(self):
+        # Rebuild the list without calling file_changed, it would show the first file
+        self.combobox.blockSignals(True)
         self.combobox.clear()
         self.combobox.addItems(self.session.loaded_files.keys())
-        index = self.combobox.findText(self.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
+        index = self.combobox.findText(self.session.current_file.filemetadata['Entry_filename'], QtCore.Qt.MatchFlag.MatchContains)
         if index >= 0:
             self.combobox.setCurrentIndex(index)
+        self.combobox.blockSignals(False)
         self.update()
     
     def mouseMoved(self,event):
@@ -238,10 +288,10 @@ class VDragWidget(QtWidgets.QWidget):
             x, y = int(pixels.x()), int(pixels.y())
             self.ROI.setPos(x, y)
             self.session.current_curve_index = self.session.map_coords[x,y]
-            self.updatePlots()
+            self.refresh.request()
             if self.session.data_viewer_widget is not None:
                 self.session.data_viewer_widget.ROI.setPos(x, y)
-                self.session.data_viewer_widget.updateCurve()
+                self.session.data_viewer_widget.refresh.request()
     
     def manual_override(self):
         pass
@@ -257,14 +307,6 @@ class VDragWidget(QtWidgets.QWidget):
         if not self.current_file:
             return
 
-        self.l.clear()
-        self.p1.clear()
-        self.p2.clear()
-        self.p3.clear()
-        self.p4.clear()
-        self.p5.clear()
-        self.p6.clear()
-
         self.Bh = None
         self.Hd = None
 
@@ -281,95 +323,60 @@ class VDragWidget(QtWidgets.QWidget):
         modulation_segs = force_curve.modulation_segments
 
         if modulation_segs == []:
+            self.clear_plots()
             self.open_msg_box(f'No modulation segments found in file:\n {current_file_id}')
             return
 
         vdrag_result = self.session.vdrag_results.get(current_file_id, None)
 
         if vdrag_result:
-            for curve_indx, curve_vdrag_result in vdrag_result:
-                try:
-                    if curve_vdrag_result is None:
-                        continue
-                    if curve_indx == self.session.current_curve_index:
-                        self.Bh = curve_vdrag_result[1]
-                        self.Hd = curve_vdrag_result[2]
-                        distances = curve_vdrag_result[4]
-                except Exception:
-                    continue
+            curve_vdrag_result = get_curve_result(vdrag_result, self.session.current_curve_index)
+            try:
+                if curve_vdrag_result is not None:
+                    self.Bh = curve_vdrag_result[1]
+                    self.Hd = curve_vdrag_result[2]
+                    distances = curve_vdrag_result[4]
+            except Exception:
+                pass
         
         curve_segments = force_curve.get_segments()
         
         t0 = 0
         n_segments = len(curve_segments)
+        for pool in (self.p1_curves, self.p2_curves, self.p3_curves, self.p4_curves, self.p5_curves):
+            pool.begin()
+        # Get the PSDs of the modulation segments, computed once per curve
+        segment_psds = dict(zip(
+            [seg_id for seg_id, _ in modulation_segs],
+            self.session.spectrum_cache.get_segment_psds(
+                current_file_id, current_curve_indx, deflection_sens, height_channel, modulation_segs
+            )
+        ))
         for i, (seg_id, segment) in enumerate(curve_segments):
             time = segment.time
             plot_time = time + t0
             if segment.segment_type == 'Modulation':
                 freq = segment.segment_metadata['frequency']
-                deltat = time[1] - time[0]
-                nfft = len(segment.vdeflection)
-                W = fftfreq(nfft, d=deltat)
-                fft_height = fft(segment.zheight, nfft)
-                psd_height = fft_height * np.conj(fft_height) / nfft
-                fft_deflect = fft(segment.vdeflection, nfft)
-                psd_deflect = fft_deflect * np.conj(fft_deflect) / nfft
-                L = np.arange(1, np.floor(nfft/2), dtype='int')
-                self.p1.plot(plot_time, segment.zheight, pen=(i,n_segments), name=f"{freq} Hz")
-                self.p2.plot(plot_time, segment.vdeflection, pen=(i,n_segments), name=f"{freq} Hz")
-                self.p3.plot(W[L], psd_height[L].real, pen=(i,n_segments), name=f"{freq} Hz")
-                self.p4.plot(W[L], psd_deflect[L].real, pen=(i,n_segments), name=f"{freq} Hz")
+                W, psd_height, psd_deflect = segment_psds[seg_id]
+                self.p1_curves.add(plot_time, segment.zheight, pen=(i,n_segments), name=f"{freq} Hz")
+                self.p2_curves.add(plot_time, segment.vdeflection, pen=(i,n_segments), name=f"{freq} Hz")
+                self.p3_curves.add(W, psd_height, pen=(i,n_segments), name=f"{freq} Hz")
+                self.p4_curves.add(W, psd_deflect, pen=(i,n_segments), name=f"{freq} Hz")
             else:
-                self.p1.plot(plot_time, segment.zheight, pen=(i,n_segments), name=f"{segment.segment_type} {seg_id}")
-                self.p2.plot(plot_time, segment.vdeflection, pen=(i,n_segments), name=f"{segment.segment_type} {seg_id}")
+                self.p1_curves.add(plot_time, segment.zheight, pen=(i,n_segments), name=f"{segment.segment_type} {seg_id}")
+                self.p2_curves.add(plot_time, segment.vdeflection, pen=(i,n_segments), name=f"{segment.segment_type} {seg_id}")
             t0 = plot_time[-1]
         
         if self.Hd is not None:
-            self.p5.plot(distances, self.Hd.real, pen='r', symbol='o', symbolBrush='r', name='Hd Real')
-            self.p5.plot(distances, self.Hd.imag, pen='b', symbol='o', symbolBrush='b', name='Hd Imag')
+            self.p5_curves.add(distances, self.Hd.real, pen='r', symbol='o', symbolBrush='r', name='Hd Real')
+            self.p5_curves.add(distances, self.Hd.imag, pen='b', symbol='o', symbolBrush='b', name='Hd Imag')
+        for pool in (self.p1_curves, self.p2_curves, self.p3_curves, self.p4_curves, self.p5_curves):
+            pool.end()
         
         if self.Bh is not None:
-            self.p6.plot(distances, self.Bh, symbol='o')
-        
-        self.p1.setLabel('left', 'zHeight', 'm')
-        self.p1.setLabel('bottom', 'Time', 's')
-        self.p1.setTitle("zHeight-Time")
-        self.p1.addLegend()
-
-        self.p2.setLabel('left', 'Deflection', 'm')
-        self.p2.setLabel('bottom', 'Time', 's')
-        self.p2.setTitle("Deflection-Time")
-        self.p2.addLegend()
-        
-        self.p3.setLabel('left', 'zHeight PSD')
-        self.p3.setLabel('bottom', 'Freq', 'Hz')
-        self.p3.setTitle("FFT")
-        self.p3.setLogMode(True, False)
-        self.p3.addLegend()
-
-        self.p4.setLabel('left', 'Deflection PSD')
-        self.p4.setLabel('bottom', 'Freq', 'Hz')
-        self.p4.setTitle("FFT")
-        self.p4.setLogMode(True, False)
-        self.p4.addLegend()
-
-        self.p5.setLabel('left', 'Hd')
-        self.p5.setLabel('bottom', 'Distance', 'm')
-        self.p5.setTitle("Hd-Distance")
-        self.p5.addLegend()
-
-        self.p6.setLabel('left', 'Bh', 'Ns/m')
-        self.p6.setLabel('bottom', 'Distance', 'm')
-        self.p6.setTitle("Bh-Distances")
-        
-        self.l.addItem(self.p1)
-        self.l.addItem(self.p2)
-        self.l.nextRow()
-        self.l.addItem(self.p3)
-        self.l.addItem(self.p4)
-        self.l.nextRow()
-        self.l.addItem(self.p5)
-        self.l.addItem(self.p6)
+            self.p6_curve.setData(distances, self.Bh)
+        else:
+            self.p6_curve.setData([], [])
 
     def updateParams(self):
         # Updates params related to the current file
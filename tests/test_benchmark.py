@@ -0,0 +1,20 @@
+import concurrent.futures
+import pickle
+
+import numpy as np
+
+from pyfmgui.benchmark import CountingExecutor
+
+def test_counting_executor_counts_tasks_and_results():
+    data = np.arange(1000.)
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        counting_executor = CountingExecutor(executor)
+        future = counting_executor.submit(np.cumsum, data)
+        result = future.result()
+        failed = counting_executor.submit(np.reshape, data, 7)
+        error = failed.exception()
+    expected = len(pickle.dumps((np.cumsum, (data,)))) + len(pickle.dumps(result))
+    expected += len(pickle.dumps((np.reshape, (data, 7)))) + len(pickle.dumps(error))
+    assert counting_executor.pickled_bytes == expected
+    # The executor tells compute its capacity, a pool of processes has none
+    assert getattr(counting_executor, 'capacity', None) is None
@@ -0,0 +1,46 @@
+import types
+import numpy as np
+
+from pyfmgui.compute import FitTaskBuilder, analyze_fdc, analyze_fdc_batch, analyze_fdc_tile
+
+def get_geometry(rows, cols):
+    # Map whose curves are numbered row by row
+    return types.SimpleNamespace(curve_coords=np.arange(rows * cols).reshape(rows, cols))
+
+def test_tile_ready_when_all_curves_added():
+    builder = FitTaskBuilder({'method': 'HertzFit', 'warm_start': True}, 16, get_geometry(4, 4))
+    read_order = builder.get_read_order(16)
+    assert sorted(read_order) == list(range(16))
+    # The curves of a tile are read one after the other
+    first_tile = builder.tiles[0]
+    assert read_order[:len(first_tile)] == [curve_idx for _, curve_idx in first_tile]
+    # Add the curves of the first tile in reverse order, the last one fails
+    curves = [curve_idx for _, curve_idx in first_tile]
+    for curve_idx in reversed(curves[1:]):
+        assert builder.add(curve_idx, f'fdc {curve_idx}') == []
+    tasks = builder.add(curves[0], None)
+    assert len(tasks) == 1
+    fn, tile = tasks[0]
+    assert fn is analyze_fdc_tile
+    # The tile keeps the order of its pixels without the failed curve
+    assert tile == [(pixel, f'fdc {curve_idx}') for pixel, curve_idx in first_tile[1:]]
+
+def test_failed_tile_gives_no_task():
+    builder = FitTaskBuilder({'method': 'HertzFit', 'warm_start': True}, 16, get_geometry(4, 4))
+    tasks = [task for _, curve_idx in builder.tiles[0] for task in builder.add(curve_idx, None)]
+    assert tasks == []
+
+def test_curves_without_batch_routine():
+    builder = FitTaskBuilder({'method': 'HertzFit'}, 4)
+    assert list(builder.get_read_order(4)) == [0, 1, 2, 3]
+    assert builder.add(0, 'fdc 0') == [(analyze_fdc, 'fdc 0')]
+    assert builder.add(1, None) == []
+    assert builder.flush() == []
+
+def test_batches():
+    builder = FitTaskBuilder({'method': 'MicrorheoSine'}, 10)
+    builder.batch_size = 4
+    tasks = [task for curve_idx in range(10) for task in builder.add(curve_idx, f'fdc {curve_idx}')]
+    tasks += builder.flush()
+    assert [fn for fn, _ in tasks] == [analyze_fdc_batch] * 3
+    assert [len(batch) for _, batch in tasks] == [4, 4, 2]
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from pyfmrheo.utils.signal_processing import detrend_rolling_average
+from pyfmgui.detrend import DetrendCache, detrend_segments
+
+def get_segment(rng, frequency, nb_points, nb_periods=10):
+    # Drifting sine modulation of the piezo and the deflection
+    time = np.arange(1, nb_points + 1) / nb_points * nb_periods / frequency
+    in_signal = 1e-6 + 2e-8 * np.sin(2 * np.pi * frequency * time) + 1e-9 * time + rng.normal(size=nb_points) * 1e-10
+    out_signal = 3e-7 + 1e-8 * np.sin(2 * np.pi * frequency * time + 0.3) + rng.normal(size=nb_points) * 1e-10
+    return frequency, in_signal, out_signal, time
+
+@pytest.fixture
+def segments():
+    rng = np.random.default_rng(0)
+    # Segments sharing their length and window are detrended together
+    return [
+        get_segment(rng, frequency, nb_points) for frequency, nb_points in
+        [(1, 2000), (10, 2000), (100, 2000), (3.3, 1501), (0.5, 500), (10, 2000)]
+    ]
+
+def test_detrend_segments_match_pyfmrheo(segments):
+    detrended = detrend_segments(segments)
+    for segment, (in_signal, out_signal, time) in zip(segments, detrended):
+        expected_in, expected_out, expected_time = detrend_rolling_average(*segment, 'zheight', 'deflection', [])
+        np.testing.assert_allclose(in_signal, expected_in, rtol=0, atol=1e-9 * np.ptp(expected_in))
+        np.testing.assert_allclose(out_signal, expected_out, rtol=0, atol=1e-9 * np.ptp(expected_out))
+        np.testing.assert_array_equal(time, expected_time)
+
+def test_short_segment_falls_back_to_linear_detrend():
+    rng = np.random.default_rng(1)
+    # A window longer than half the segment leaves no point detrended
+    segment = get_segment(rng, 1, 100, nb_periods=1)
+    (in_signal, out_signal, time), = detrend_segments([segment])
+    expected_in, expected_out, expected_time = detrend_rolling_average(*segment, 'zheight', 'deflection', [])
+    np.testing.assert_allclose(in_signal, expected_in)
+    np.testing.assert_allclose(out_signal, expected_out)
+    np.testing.assert_array_equal(time, expected_time)
+
+def test_detrend_cache_keeps_recent_segments(segments):
+    class Segment:
+        def __init__(self, frequency, zheight, vdeflection, time):
+            self.segment_metadata = {'frequency': frequency}
+            self.zheight = zheight
+            self.vdeflection = vdeflection
+            self.time = time
+    cache = DetrendCache(maxsize=4)
+    curve_segments = [(seg_id, Segment(*segment)) for seg_id, segment in enumerate(segments[:3])]
+    first = cache.get_detrended_segments('map', 0, 100, 'zheight', curve_segments)
+    assert len(cache.segments) == 3
+    # The cached signals are returned for the segments already detrended
+    second = cache.get_detrended_segments('map', 0, 100, 'zheight', curve_segments)
+    assert all(a is b for a, b in zip(first, second))
+    cache.get_detrended_segments('map', 1, 100, 'zheight', curve_segments)
+    assert len(cache.segments) == 4
@@ -0,0 +1,88 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from pyfmgui import distributed
+from pyfmgui.distributed import ClusterExecutor
+
+authkey = 'test-cluster-key'
+
+# The tasks are unpickled by the workers of the agents, which import this module
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(os.path.dirname(tests_dir), 'src')
+
+def slow_square(delay, x):
+    time.sleep(delay)
+    return x * x
+
+def kill_agent(x):
+    # Kill the agent running the worker, as if its machine was lost
+    os.kill(os.getppid(), signal.SIGKILL)
+    time.sleep(10)
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_agent():
+    # Run an agent with one worker and wait for it to listen
+    port = get_free_port()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([src_dir, tests_dir]))
+    env[distributed.authkey_variable] = authkey
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'pyfmgui.distributed', '--port', str(port), '--workers', '1'],
+        env=env, stderr=subprocess.PIPE, text=True, start_new_session=True
+    )
+    for line in process.stderr:
+        if 'listening' in line:
+            break
+    return process, ('127.0.0.1', port)
+
+@pytest.fixture
+def start_agents():
+    processes = []
+    def start_agents(nb_agents):
+        agents = [start_agent() for _ in range(nb_agents)]
+        processes.extend(process for process, _ in agents)
+        return processes, [address for _, address in agents]
+    yield start_agents
+    for process in processes:
+        # Also stop the workers of the agents killed by the tests. Their
+        # resource tracker ignores SIGTERM and frees their semaphores.
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+def test_tasks_of_a_lost_agent_sent_to_the_others(start_agents, monkeypatch):
+    monkeypatch.setenv(distributed.authkey_variable, authkey)
+    processes, addresses = start_agents(2)
+    executor = ClusterExecutor(addresses, timeout=10)
+    assert executor.capacity == 4
+    futures = [executor.submit(slow_square, 0.1, x) for x in range(30)]
+    # Kill an agent once the tasks are running on both agents
+    futures[0].result(timeout=30)
+    processes[0].kill()
+    assert [future.result(timeout=60) for future in futures] == [x * x for x in range(30)]
+    assert executor.capacity == 2
+    executor.shutdown()
+
+def test_task_fails_after_max_retries(start_agents, monkeypatch):
+    monkeypatch.setattr(distributed, 'max_retries', 1)
+    _, addresses = start_agents(3)
+    executor = ClusterExecutor(addresses, authkey=authkey.encode(), timeout=10)
+    # The task kills each agent it is sent to, it is sent a second time and then fails
+    future = executor.submit(kill_agent, 0)
+    with pytest.raises(ConnectionError):
+        future.result(timeout=60)
+    assert sum(agent.alive for agent in executor.agents) == 1
+    # The agent left still computes the other tasks
+    assert executor.submit(slow_square, 0, 3).result(timeout=30) == 9
+    executor.shutdown()
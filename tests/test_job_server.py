@@ -0,0 +1,127 @@
+import concurrent.futures
+import grp
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from pyfmgui import job_client, job_server, journal
+from pyfmgui.benchmark import SyntheticFile, get_benchmark_params
+from pyfmgui.job_client import JobClient, get_key
+from pyfmgui.scheduler import FairScheduler
+
+key = 'test-key'
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, 'get_journal_dir', lambda: str(tmp_path))
+    server = job_server.create_server(0, 1, max_jobs=1, key=key)
+    # Run the fits in threads of the test process
+    server.job_server.executor.shutdown()
+    server.job_server.executor = concurrent.futures.ThreadPoolExecutor(2)
+    server.job_server.scheduler = FairScheduler(server.job_server.executor, 4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.job_server.shutdown()
+
+def get_client(server, key=key):
+    return JobClient(f'127.0.0.1:{server.server_address[1]}', key=key)
+
+def load_synthetic_files(monkeypatch, loaded=None, release=None):
+    # Load a small synthetic map for any path, recording the paths loaded
+    def load_job_file(path):
+        if loaded is not None:
+            loaded.append(path)
+        if release is not None and path == 'block':
+            release.wait(30)
+        file = SyntheticFile(2, 200)
+        file.filemetadata['Entry_filename'] = path
+        return path, file
+    monkeypatch.setattr(job_server, 'load_job_file', load_job_file)
+
+def wait_for(client, job_id):
+    for state in client.iter_progress(job_id):
+        pass
+    return state
+
+def test_submit_and_get_results(server, monkeypatch):
+    load_synthetic_files(monkeypatch)
+    client = get_client(server)
+    params = get_benchmark_params('HertzFit', SyntheticFile(2, 200))
+    job_id = client.submit(['a'], 'HertzFit', params, name='test job')
+    state = wait_for(client, job_id)
+    assert state['state'] == 'done', state['error']
+    assert client.get_job(job_id)['name'] == 'test job'
+    # Pickled results signed with the key, and the rows of the table
+    results = client.get_results(job_id)
+    assert sorted(curve_idx for curve_idx, _ in results['a']) == [0, 1, 2, 3]
+    assert len(client.get_results(job_id, pickled=False)) == 4
+
+def test_requests_without_the_key_are_rejected(server):
+    with pytest.raises(RuntimeError, match='401'):
+        get_client(server, key='wrong').list_jobs()
+    with pytest.raises(RuntimeError, match='401'):
+        get_client(server, key=' ').submit(['a'], 'HertzFit', {})
+    assert server.job_server.jobs == {}
+
+def test_queued_jobs_by_priority_and_cancelled(server, monkeypatch):
+    loaded = []
+    release = threading.Event()
+    load_synthetic_files(monkeypatch, loaded, release)
+    client = get_client(server)
+    params = get_benchmark_params('HertzFit', SyntheticFile(2, 200))
+    # The first job runs and holds the only running slot of the server
+    block_id = client.submit(['block'], 'HertzFit', params)
+    while not loaded:
+        time.sleep(0.01)
+    low_id = client.submit(['low'], 'HertzFit', params, priority=0)
+    cancelled_id = client.submit(['cancelled'], 'HertzFit', params, priority=10)
+    high_id = client.submit(['high'], 'HertzFit', params, priority=5)
+    assert client.cancel(cancelled_id)['state'] == 'cancelled'
+    # Running jobs can not be cancelled
+    with pytest.raises(RuntimeError, match='409'):
+        client.cancel(block_id)
+    release.set()
+    for job_id in (block_id, low_id, high_id):
+        assert wait_for(client, job_id)['state'] == 'done'
+    assert loaded == ['block', 'high', 'low']
+    assert client.get_job(cancelled_id)['state'] == 'cancelled'
+
+def test_finished_jobs_evicted(server, monkeypatch):
+    load_synthetic_files(monkeypatch)
+    client = get_client(server)
+    params = get_benchmark_params('HertzFit', SyntheticFile(2, 200))
+    old_id = client.submit(['old'], 'HertzFit', params)
+    fetched_id = client.submit(['fetched'], 'HertzFit', params)
+    kept_id = client.submit(['kept'], 'HertzFit', params)
+    for job_id in (old_id, fetched_id, kept_id):
+        assert wait_for(client, job_id)['state'] == 'done'
+    # Jobs finished too long ago and results fetched a while ago are forgotten
+    server.job_server.jobs[old_id].finish_time -= job_server.finished_job_ttl + 1
+    client.get_results(fetched_id)
+    server.job_server.jobs[fetched_id].fetch_time -= job_server.fetched_job_ttl + 1
+    assert [state['id'] for state in client.list_jobs()] == [kept_id]
+    with pytest.raises(RuntimeError, match='404'):
+        client.get_job(old_id)
+
+def test_key_shared_with_a_group(tmp_path, monkeypatch):
+    path = str(tmp_path / 'shared' / 'job_server.key')
+    group = grp.getgrgid(os.getgid()).gr_name
+    shared_key = get_key(create=True, path=path, group=group)
+    info = os.stat(path)
+    assert stat.S_IMODE(info.st_mode) == 0o640
+    assert info.st_gid == os.getgid()
+    # The clients find the key file in the environment
+    monkeypatch.setenv(job_client.key_path_variable, path)
+    assert get_key() == shared_key
+    assert JobClient(1234).key == shared_key
+
+def test_key_of_the_user_only_readable_by_the_user(tmp_path):
+    path = str(tmp_path / 'job_server.key')
+    get_key(create=True, path=path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
@@ -0,0 +1,53 @@
+import os
+import types
+
+from pyfmgui import journal
+from pyfmgui.journal import ComputeJournal, find_journal, read_journal
+
+def get_filedict():
+    file = types.SimpleNamespace(filemetadata={'file_path': '/data/map.jpk-force-map'})
+    return {'map': file}
+
+def get_params():
+    return {'method': 'HertzFit', 'poisson': 0.5, 'shared_memory': True}
+
+def test_truncate_and_resume(tmp_path):
+    path = str(tmp_path / 'HertzFit_run.journal')
+    filedict = get_filedict()
+    run_journal = ComputeJournal(path, 'HertzFit', get_params(), filedict)
+    run_journal.append([('map', 0, 'result 0'), ('map', 1, 'result 1')])
+    # Failed curves are not kept
+    run_journal.append([('map', 2, ValueError('fit failed'), 'error')])
+    run_journal.append([('map', 3, 'result 3')])
+    # Simulate a crash cutting the last record
+    run_journal.file.write(b'\x80\x04\x95 cut')
+    run_journal.close()
+    header, results, valid_size = read_journal(path)
+    assert header['params'] == {'method': 'HertzFit', 'poisson': 0.5}
+    assert results == {'map': {0: 'result 0', 1: 'result 1', 3: 'result 3'}}
+    # Resuming removes the cut record before appending the new results
+    resumed, restored = ComputeJournal.resume(path, 'HertzFit', get_params(), filedict)
+    assert restored == results
+    assert os.path.getsize(path) == valid_size
+    resumed.append([('map', 2, 'result 2')])
+    resumed.close()
+    _, results, _ = read_journal(path)
+    assert results == {'map': {0: 'result 0', 1: 'result 1', 2: 'result 2', 3: 'result 3'}}
+
+def test_find_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, 'get_journal_dir', lambda: str(tmp_path))
+    filedict = get_filedict()
+    run_journal = ComputeJournal.create('HertzFit', get_params(), filedict)
+    run_journal.append([('map', 0, 'result 0')])
+    run_journal.close()
+    # The way the curves are sent to the workers does not change the run
+    params = dict(get_params(), shared_memory=False, out_of_core=True, memory_budget=512)
+    assert find_journal('HertzFit', params, filedict) == (run_journal.path, 1)
+    assert find_journal('HertzFit', dict(params, poisson=0.3), filedict) == (None, 0)
+    assert find_journal('TingFit', params, filedict) == (None, 0)
+
+def test_completed_run_deletes_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, 'get_journal_dir', lambda: str(tmp_path))
+    with ComputeJournal.create('HertzFit', get_params(), get_filedict()) as run_journal:
+        run_journal.append([('map', 0, 'result 0')])
+    assert list(tmp_path.iterdir()) == []
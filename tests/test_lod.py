@@ -0,0 +1,96 @@
+import numpy as np
+
+from pyfmgui.widgets.lod import LevelOfDetail, MinMaxPyramid
+
+class FakeSignal:
+    def connect(self, slot):
+        pass
+
+class FakeAxis:
+    logMode = False
+
+class FakeViewBox:
+    # View box of 500 pixels following the data or showing an x range
+    def __init__(self):
+        self.x_range = None
+
+    def autoRangeEnabled(self):
+        return (self.x_range is None, True)
+
+    def viewRange(self):
+        return [self.x_range, [0, 1]]
+
+    def width(self):
+        return 500
+
+class FakePlot:
+    def __init__(self):
+        self.sigXRangeChanged = FakeSignal()
+        self.vb = FakeViewBox()
+
+    def getAxis(self, name):
+        return FakeAxis()
+
+    def getViewBox(self):
+        return self.vb
+
+class FakeCurve:
+    def setData(self, x, y, **opts):
+        self.x, self.y = x, y
+
+def test_envelope_bounds_the_samples():
+    y = np.random.default_rng(0).normal(size=1001)
+    x = np.arange(len(y), dtype=float)
+    pyramid = MinMaxPyramid(x, y)
+    # The samples themselves at level 0
+    xs, ys = pyramid.get_data(0, 100, 700)
+    assert np.array_equal(xs, x[100:700]) and np.array_equal(ys, y[100:700])
+    # Bins of 16 samples covering the range, each shown by its min and max
+    xs, ys = pyramid.get_data(2, 100, 700)
+    b0, b1 = 100 // 16, -(-700 // 16)
+    assert len(xs) == len(ys) == 2 * (b1 - b0)
+    for j, b in enumerate(range(b0, b1)):
+        samples = y[16 * b:16 * (b + 1)]
+        assert xs[2 * j] == x[16 * b]
+        assert ys[2 * j] == samples.min() and ys[2 * j + 1] == samples.max()
+    assert ys.min() <= y[100:700].min() and ys.max() >= y[100:700].max()
+    # The last bin only holds the last sample
+    _, mins, maxs = pyramid.get_level(1)
+    assert len(mins) == 251 and mins[-1] == maxs[-1] == y[-1]
+
+def test_level_chosen_from_the_visible_range():
+    plot = FakePlot()
+    lod = LevelOfDetail(plot)
+    x = np.arange(100000, dtype=float)
+    curve = FakeCurve()
+    lod.setData(curve, x, np.sin(x))
+    # The full curve in bins of 4**4 samples, at most two points per pixel
+    assert len(curve.x) == 2 * -(-len(x) // 4 ** 4) <= 2 * 1000
+    # Zooming shows the samples themselves
+    plot.vb.x_range = [1000, 1900]
+    lod.update_curves()
+    assert np.array_equal(curve.x, x[999:1901])
+    # Short curves are displayed as they are
+    lod.setData(curve, x[:100], x[:100])
+    assert len(curve.x) == 100 and curve not in lod.curves
+
+def test_envelopes_reused_between_refreshes():
+    lod = LevelOfDetail(FakePlot(), max_pyramids=2)
+    x = np.arange(10000, dtype=float)
+    y = np.cos(x)
+    curve = FakeCurve()
+    lod.setData(curve, x, y)
+    pyramid = lod.curves[curve][0]
+    # The same arrays, in a curve of the next refresh
+    lod.clear()
+    lod.setData(FakeCurve(), x, y)
+    assert lod.get_pyramid(x, y) is pyramid
+    # New arrays of the same data, given by their key
+    lod.setData(curve, x + 0, y, key=('file', 0, 'zheight'))
+    keyed = lod.curves[curve][0]
+    lod.setData(curve, x + 0, y, key=('file', 0, 'zheight'))
+    assert lod.curves[curve][0] is keyed
+    lod.setData(curve, x + 0, y, key=('file', 1, 'zheight'))
+    assert lod.curves[curve][0] is not keyed
+    # Only the last pyramids used are kept
+    assert len(lod.pyramids) == 2
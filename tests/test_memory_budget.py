@@ -0,0 +1,44 @@
+import concurrent.futures
+
+import pytest
+
+from pyfmgui import compute, journal
+from pyfmgui.benchmark import NullCallback, SyntheticFile, get_benchmark_params
+from pyfmgui.memory_budget import MemoryBudget, get_task_nbytes
+from pyfmgui.session import Session
+
+def test_budget_counts_the_curves_being_read():
+    budget = MemoryBudget(1)
+    # Only one curve is read until the size of the curves is known
+    assert not budget.is_exceeded(0)
+    assert budget.is_exceeded(1)
+    budget.add(100e3)
+    assert budget.used == 200e3
+    assert not budget.is_exceeded(3)
+    assert budget.is_exceeded(4)
+    budget.remove(100e3)
+    assert budget.used == 0
+    assert budget.get_report()['peak_data_mb'] == pytest.approx(0.2)
+
+@pytest.mark.parametrize('method, warm_start', [('MicrorheoSine', False), ('HertzFit', False), ('HertzFit', True)])
+def test_out_of_core_peak_within_budget(tmp_path, monkeypatch, method, warm_start):
+    monkeypatch.setattr(journal, 'get_journal_dir', lambda: str(tmp_path))
+    file = SyntheticFile(8, 300, mod_freqs=(10,) if method == 'MicrorheoSine' else (), mod_npts=500)
+    session = Session()
+    session.loaded_files[file.filemetadata['Entry_filename']] = file
+    session.current_file = file
+    session.current_curve_index = 0
+    params = get_benchmark_params(method, file)
+    curve_mb = get_task_nbytes(compute.prepare_map_fdc(file, params, 0)) / 1e6
+    # Budget of a few curves, each counted twice
+    budget_mb = 6 * curve_mb
+    params.update({'warm_start': warm_start, 'out_of_core': True, 'memory_budget': budget_mb, 'shared_memory': False})
+    callback = NullCallback()
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        compute.compute(session, params, dict(session.loaded_files), method, callback, callback, callback, executor)
+    results = compute.get_method_to_session_vars(session)[method][file.filemetadata['Entry_filename']]
+    assert len(results) == 64
+    # A tile is fitted once all its curves are read, it is the largest task
+    max_task_mb = 2 * curve_mb * (compute.get_tile_size(64)**2 if warm_start else 1)
+    assert session.memory_usage['peak_data_mb'] <= budget_mb + max_task_mb
+    session.result_store.clear()
@@ -0,0 +1,41 @@
+import copy
+
+import numpy as np
+import pytest
+
+from pyfmgui import compute
+from pyfmgui.benchmark import SyntheticFile, get_benchmark_params
+from pyfmgui.model_cache import clear_model_cache, model_cache
+
+def get_fitted_values(method, result):
+    if method == 'TingFit':
+        ting_result, hertz_result = result
+        return [ting_result.E0, ting_result.betaE, hertz_result.delta0]
+    return [result.E0, result.delta0]
+
+@pytest.mark.parametrize('method, betaE, settings', [
+    ('HertzFit', 0, [
+        {}, {'fit_line': True}, {'contact_model': 'cone', 'tip_param': 35},
+        {'downsample_flag': True, 'pts_downsample': 100}
+    ]),
+    ('TingFit', 0.2, [{}, {'downsample_flag': True, 'pts_downsample': 100}, {'contact_offset': 2e-6}]),
+])
+def test_cached_models_fit_as_the_uncached_routines(method, betaE, settings):
+    clear_model_cache()
+    file = SyntheticFile(2, 500, betaE=betaE)
+    params = get_benchmark_params(method, file)
+    # Fit the curves in a row, changing the settings between the fits,
+    # so that each cached model is reused after fits with other settings
+    for curve_idx in range(3):
+        fdc = compute.prepare_map_fdc(file, params, curve_idx)
+        for fit_settings in settings:
+            values = {}
+            for model_cache_flag in (True, False):
+                fit_params = dict(params, model_cache=model_cache_flag, **fit_settings)
+                result = compute.analyze_fdc(fit_params, copy.deepcopy(fdc))
+                assert len(result) == 3, result
+                values[model_cache_flag] = get_fitted_values(method, result[2])
+            np.testing.assert_allclose(values[True], values[False], rtol=1e-6)
+            # The curves fitted are not kept by the cached models
+            assert all(cached.current is None and cached.kwargs == {} for cached in model_cache.values())
+    clear_model_cache()
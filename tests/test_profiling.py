@@ -0,0 +1,20 @@
+from pyfmgui import profiling
+from pyfmgui.profiling import ProfileStats
+
+def test_nested_spans_counted_once():
+    recorder = profiling.SpanRecorder()
+    with profiling.recording(recorder):
+        profiling.add_span('getcurve', 1.0)
+        # The poc span is recorded inside the fit span
+        profiling.add_span('poc', 0.5)
+        profiling.add_span('fit', 1.0)
+        profiling.add_span('ipc_wait', 2.0)
+    stats = recorder.collect()
+    assert sorted(stats.spans) == ['fit', 'getcurve', 'ipc_wait', 'poc']
+    summary = stats.format_summary()
+    assert summary.splitlines()[-1] == 'I/O: 25% | CPU: 25% | IPC: 50%'
+    # The nested spans are still listed
+    assert any(line.startswith('poc ') for line in summary.splitlines())
+
+def test_empty_summary():
+    assert len(ProfileStats().format_summary().splitlines()) == 1
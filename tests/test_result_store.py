@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from pyfmgui.result_store import ResultStore, get_curve_result, get_field_column
+
+@pytest.fixture
+def stored_results(tmp_path):
+    store = ResultStore(str(tmp_path))
+    file_results = store.create('HertzFit', 'map')
+    rows = [(curve_idx, f'result {curve_idx}') for curve_idx in range(9)]
+    # Chunks of 3, 4 and 2 rows
+    for start, stop in [(0, 3), (3, 7), (7, 9)]:
+        file_results.append(rows[start:stop])
+    yield file_results, rows
+    store.clear()
+
+def test_len_and_iter(stored_results):
+    file_results, rows = stored_results
+    assert len(file_results) == len(rows)
+    assert list(file_results) == rows
+
+@pytest.mark.parametrize('index', [
+    slice(None), slice(2, 5), slice(3, 7), slice(5, None), slice(None, -2), slice(-4, -1),
+    slice(1, 9, 3), slice(None, None, -1), slice(8, 0, -2), slice(6, 6), slice(20, 30)
+])
+def test_slicing(stored_results, index):
+    file_results, rows = stored_results
+    assert file_results[index] == rows[index]
+
+def test_indexing(stored_results):
+    file_results, rows = stored_results
+    for index in [0, 2, 3, 6, 7, 8, -1, -9]:
+        assert file_results[index] == rows[index]
+    with pytest.raises(IndexError):
+        file_results[9]
+
+def test_get_loads_only_the_chunk_of_the_curve(stored_results):
+    file_results, _ = stored_results
+    # A curve computed again has its last result
+    file_results.append([(4, 'result 4 again')])
+    file_results.cached_chunk = None
+    assert file_results.get(4) == 'result 4 again'
+    assert file_results.cached_chunk[0] == 3
+    assert file_results.get(1) == 'result 1'
+    assert file_results.cached_chunk[0] == 0
+    assert file_results.get(42) is None
+    assert get_curve_result(file_results, 8) == 'result 8'
+    assert get_curve_result([(8, 'first'), (8, 'second')], 8) == 'second'
+
+def test_get_column(stored_results):
+    file_results, _ = stored_results
+    assert np.array_equal(file_results.get_column('curve_idx'), np.arange(9))
+    assert np.array_equal(file_results.get_column('curve_idx', start=5), np.arange(5, 9))
+    # The map fields of results that can not be read are NaN
+    assert np.isnan(file_results.get_column(get_field_column('E0'))).all()
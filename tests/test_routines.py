@@ -0,0 +1,60 @@
+import copy
+
+import numpy as np
+import pytest
+from pyfmrheo.models.hertz import HertzModel
+
+from pyfmgui import routines
+from pyfmgui.benchmark import SyntheticFile, get_benchmark_params
+from pyfmgui.fit_data import prepare_hertz_fit_data
+from pyfmgui.ting_numerical import AcceleratedTingModel
+
+def get_curves(method, nb_curves=3, npts=1000, betaE=0):
+    file = SyntheticFile(2, npts, betaE=betaE)
+    params = get_benchmark_params(method, file)
+    fdcs = []
+    for curve_idx in range(nb_curves):
+        fdc = file.getcurve(curve_idx)
+        fdc.preprocess_force_curve(params['def_sens'], params['height_channel'])
+        fdcs.append(fdc)
+    return fdcs, params
+
+@pytest.fixture
+def fit_range_params():
+    fdcs, params = get_curves('HertzFit', 1)
+    # Fit range and adaptive downsampling, as set in the widget
+    params.update(
+        fit_range_type='indentation', min_ind=0, max_ind=200e-9,
+        downsample_flag=True, pts_downsample=50, adaptive_downsample=True, downsample_tol=0.001
+    )
+    return fdcs[0], params
+
+@pytest.mark.parametrize('model_cache', [False, True])
+def test_hertz_fit_uses_the_points_of_the_preview(monkeypatch, fit_range_params, model_cache):
+    fdc, params = fit_range_params
+    prepared = []
+    def spy_prepare(indentation, force, param_dict):
+        prepared.append((indentation, force, *prepare_hertz_fit_data(indentation, force, param_dict)))
+        return prepared[-1][2:]
+    fitted = []
+    monkeypatch.setattr(routines, 'prepare_hertz_fit_data', spy_prepare)
+    monkeypatch.setattr(HertzModel, 'fit', lambda model, indentation, force: fitted.append((indentation, force)))
+    monkeypatch.setattr(routines, 'fit_hertz_model', lambda model, indentation, force, seed=None: fitted.append((indentation, force)))
+    routine = routines.doHertzFitCached if model_cache else routines.doHertzFit
+    routine(copy.deepcopy(fdc), params)
+    # Both routines fit the points shown by the preview of the widget
+    assert len(prepared) == 1 and len(fitted) == 1
+    full_indentation, _, indentation, force = prepared[0]
+    np.testing.assert_array_equal(fitted[0][0], indentation)
+    np.testing.assert_array_equal(fitted[0][1], force)
+    # The fit range and the adaptive downsampling removed points
+    assert indentation.max() <= 200e-9
+    assert len(indentation) < len(full_indentation)
+
+@pytest.mark.parametrize('routine', [routines.doTingFit, routines.doTingFitCached])
+def test_ting_fit_uses_the_accelerated_model(routine):
+    fdcs, params = get_curves('TingFit', 1, npts=500, betaE=0.2)
+    ting_model, hertz_result = routine(copy.deepcopy(fdcs[0]), params)
+    assert isinstance(ting_model, AcceleratedTingModel)
+    assert isinstance(hertz_result, HertzModel)
+    assert np.isfinite(ting_model.E0) and np.isfinite(ting_model.betaE)
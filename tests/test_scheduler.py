@@ -0,0 +1,97 @@
+import concurrent.futures
+
+from pyfmgui.scheduler import FairScheduler, TaskQueue
+
+class RecordingExecutor:
+    # Executor keeping the tasks submitted without running them
+    def __init__(self):
+        self.submitted = []
+        self.futures = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args[0])
+        self.futures.append(concurrent.futures.Future())
+        return self.futures[-1]
+
+def test_tasks_submitted_by_priority():
+    executor = RecordingExecutor()
+    task_queue = TaskQueue(executor, max_pending=3)
+    for priority, name in [(2, 'a'), (1, 'b'), (1, 'c'), (0, 'd')]:
+        task_queue.put(priority, name, print, name)
+    task_queue.submit()
+    # Lower priorities first, tasks with the same priority in order
+    assert executor.submitted == ['d', 'b', 'c']
+    # A task with a higher priority put later overtakes the waiting tasks
+    task_queue.put(0, 'e', print, 'e')
+    task_queue.finish(next(iter(task_queue.pending)))
+    task_queue.submit()
+    assert executor.submitted == ['d', 'b', 'c', 'e']
+
+def test_max_pending():
+    executor = RecordingExecutor()
+    task_queue = TaskQueue(executor, max_pending=2)
+    for i in range(5):
+        task_queue.put(0, i, print, i)
+    task_queue.submit()
+    assert executor.submitted == [0, 1]
+    tag, _ = task_queue.finish(next(iter(task_queue.pending)))
+    assert tag == 0
+    task_queue.submit()
+    assert executor.submitted == [0, 1, 2]
+
+def test_downstream_back_pressure():
+    executor = RecordingExecutor()
+    downstream = TaskQueue(executor, max_pending=10)
+    upstream = TaskQueue(executor, max_pending=10, downstream=downstream, max_downstream=2)
+    for i in range(3):
+        upstream.put(0, i, print, f'read {i}')
+    # No reads while the downstream queue holds max_downstream tasks
+    downstream.put(0, 'fit', print, 'fit 0')
+    downstream.put(0, 'fit', print, 'fit 1')
+    upstream.submit()
+    assert executor.submitted == []
+    # The reads resume once the downstream tasks are submitted
+    downstream.submit()
+    upstream.submit()
+    assert executor.submitted == ['fit 0', 'fit 1', 'read 0', 'read 1', 'read 2']
+
+def test_gate_blocks_submission():
+    executor = RecordingExecutor()
+    blocked = [True]
+    task_queue = TaskQueue(executor, max_pending=10, gate=lambda: blocked[0])
+    task_queue.put(0, 0, print, 0)
+    task_queue.submit()
+    assert executor.submitted == []
+    blocked[0] = False
+    task_queue.submit()
+    assert executor.submitted == [0]
+
+def test_fair_scheduler_priorities():
+    executor = RecordingExecutor()
+    scheduler = FairScheduler(executor, max_running=2)
+    first, low, other_low, high = [scheduler.create_executor(priority) for priority in (0, 0, 0, 5)]
+    futures = [first.submit(print, f'first {i}') for i in range(2)]
+    futures += [low.submit(print, f'low {i}') for i in range(2)]
+    futures += [other_low.submit(print, f'other {i}') for i in range(2)]
+    futures += [high.submit(print, 'high 0')]
+    assert executor.submitted == ['first 0', 'first 1']
+    # Finish the submitted tasks one by one
+    for i in range(7):
+        executor.futures[i].set_result(i)
+    # The job with the highest priority first, then the jobs with the
+    # same priority take turns
+    assert executor.submitted == ['first 0', 'first 1', 'high 0', 'low 0', 'other 0', 'low 1', 'other 1']
+    assert [future.result() for future in futures] == [0, 1, 3, 5, 4, 6, 2]
+
+def test_fair_scheduler_cancels_the_queued_tasks_of_a_job():
+    executor = RecordingExecutor()
+    scheduler = FairScheduler(executor, max_running=1)
+    job, other_job = scheduler.create_executor(), scheduler.create_executor()
+    running = job.submit(print, 'job 0')
+    queued = job.submit(print, 'job 1')
+    other = other_job.submit(print, 'other 0')
+    job.close()
+    assert queued.cancelled() and not running.cancelled()
+    executor.futures[0].set_result(0)
+    assert executor.submitted == ['job 0', 'other 0']
+    assert running.result() == 0 and not other.done()
@@ -0,0 +1,72 @@
+import concurrent.futures
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from pyfmgui import compute
+from pyfmgui.benchmark import SyntheticFile, get_benchmark_params
+from pyfmgui.scheduler import FairScheduler, TaskQueue
+from pyfmgui.shared_arrays import SharedMemoryTransport, SharedTask, run_shared_task, shm_dir
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(shm_dir), reason='The shared memory blocks are not files')
+
+def get_curves(nb_curves):
+    file = SyntheticFile(4, 300)
+    params = get_benchmark_params('HertzFit', file)
+    return [compute.prepare_map_fdc(file, params, curve_idx) for curve_idx in range(nb_curves)]
+
+def get_blocks_left(names):
+    return [name for name in names if os.path.exists(os.path.join(shm_dir, name))]
+
+def get_zheight(params, fdc):
+    return fdc.extend_segments[0][1].zheight.copy()
+
+def test_blocks_released_when_the_computation_fails():
+    fdcs = get_curves(3)
+    names = []
+    with pytest.raises(RuntimeError):
+        with SharedMemoryTransport(min_bytes=0) as transport:
+            for fdc in fdcs:
+                packed_task = transport.pack(fdc)
+                assert isinstance(packed_task, SharedTask)
+                names.append(packed_task.block_name)
+            # The workers restore the arrays of the curves
+            zheight = run_shared_task(get_zheight, None, packed_task)
+            assert np.array_equal(zheight, fdcs[-1].extend_segments[0][1].zheight)
+            assert get_blocks_left(names) == names
+            raise RuntimeError('Fit failed')
+    assert transport.blocks == {}
+    assert get_blocks_left(names) == []
+
+def test_blocks_of_cancelled_tasks_released():
+    fdcs = get_curves(4)
+    started = threading.Event()
+    release = threading.Event()
+    def wait(params, fdc):
+        started.set()
+        release.wait(30)
+    with SharedMemoryTransport(min_bytes=0) as transport, concurrent.futures.ThreadPoolExecutor(1) as executor:
+        # A job of the job server running one task at once, the others wait in the scheduler
+        job_executor = FairScheduler(executor, max_running=1).create_executor()
+        task_queue = TaskQueue(job_executor, max_pending=4, transport=transport)
+        for curve_idx, fdc in enumerate(fdcs):
+            task_queue.put(0, curve_idx, run_shared_task, wait, None, fdc)
+        task_queue.submit()
+        names = [packed_task.block_name for _, _, packed_task in task_queue.pending.values()]
+        assert len(names) == 4 and get_blocks_left(names) == names
+        started.wait(30)
+        # The job fails, the tasks not started are cancelled
+        job_executor.close()
+        cancelled = [future for future in task_queue.pending if future.cancelled()]
+        assert len(cancelled) == 3
+        for future in cancelled:
+            task_queue.finish(future)
+        assert len(get_blocks_left(names)) == 1
+        release.set()
+        running = next(iter(task_queue.pending))
+        running.result(30)
+        task_queue.finish(running)
+        assert transport.blocks == {}
+    assert get_blocks_left(names) == []
@@ -0,0 +1,36 @@
+import numpy as np
+
+from pyfmrheo.models.sine import SineWave
+from pyfmgui.sine_fit import fit_sine_waves
+
+def test_fit_sine_waves_match_pyfmrheo():
+    rng = np.random.default_rng(0)
+    ang_freqs, times, waves = [], [], []
+    # Waves with different frequencies, lengths, amplitudes and offsets
+    for frequency, nb_points, amplitude, phase, offset in [
+        (1, 1000, 2e-8, 0.3, 1e-6), (10, 1500, 5e-9, -1.2, 0), (100, 800, 1e-9, 2.5, -3e-7)
+    ]:
+        ang_freq = 2 * np.pi * frequency
+        time = np.arange(nb_points) / nb_points * 5 / frequency
+        wave = amplitude * np.sin(ang_freq * time + phase) + offset + rng.normal(size=nb_points) * amplitude / 20
+        ang_freqs.append(ang_freq)
+        times.append(time)
+        waves.append(wave)
+    sine_waves = fit_sine_waves(ang_freqs, times, waves)
+    assert len(sine_waves) == 3
+    for ang_freq, time, wave, sine_wave in zip(ang_freqs, times, waves, sine_waves):
+        # Initial values of doMicrorheologySine
+        expected = SineWave(ang_freq)
+        expected.amplitude_init = np.std(wave) * 2**0.5
+        expected.phase_init = 0.
+        expected.offset_init = np.mean(wave)
+        expected.fit(time, wave)
+        scale = np.abs(expected.amplitude)
+        # Same fitted wave, the phase is only defined modulo 2 pi
+        np.testing.assert_allclose(sine_wave.eval(time), expected.eval(time), rtol=0, atol=1e-4 * scale)
+        np.testing.assert_allclose(abs(sine_wave.amplitude), scale, rtol=1e-4)
+        np.testing.assert_allclose(sine_wave.Rsquared, expected.Rsquared, rtol=1e-6)
+        np.testing.assert_allclose(sine_wave.MSE, expected.MSE, rtol=1e-4)
+
+def test_no_waves():
+    assert fit_sine_waves([], [], []) == []
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from pyfmrheo.models.ting import TingModel
+from pyfmgui import ting_numerical
+from pyfmgui.ting_numerical import AcceleratedTingModel
+
+def get_curve(npts):
+    # Indentation at constant speed, retracted slower than approached
+    time = np.linspace(0, 0.3, npts)
+    idx_tm = npts // 2
+    tm = time[idx_tm]
+    delta = np.where(time <= tm, 2e-6 * time, 2e-6 * tm - 1e-6 * (time - tm))
+    force = np.clip(delta, 0, None)**1.5 * 1e3
+    return time, force, delta, idx_tm
+
+def eval_model(model_class, betaE, npts=600):
+    time, force, delta, idx_tm = get_curve(npts)
+    model = model_class('paraboloid', 5e-6, 'numerical')
+    return model.model(time, 2000, 0.02, betaE, 0, 0, force, delta, 'numerical', 0, idx_tm, 1, None, None)
+
+@pytest.mark.parametrize('betaE', [0.05, 0.2, 0.45])
+@pytest.mark.parametrize('max_chunk_elements', [2**22, 1000])
+def test_numpy_integrals_match_pyfmrheo(monkeypatch, betaE, max_chunk_elements):
+    monkeypatch.setattr(ting_numerical, 'hereditary_integrals_jit', None)
+    # Small chunks compute the retrace a few rows at a time
+    monkeypatch.setattr(ting_numerical, 'max_chunk_elements', max_chunk_elements)
+    expected = eval_model(TingModel, betaE)
+    np.testing.assert_allclose(eval_model(AcceleratedTingModel, betaE), expected, rtol=1e-10, atol=1e-12 * np.abs(expected).max())
+
+@pytest.mark.skipif(ting_numerical.numba is None, reason='Numba is not installed')
+@pytest.mark.parametrize('betaE', [0.05, 0.2, 0.45])
+def test_compiled_integrals_match_pyfmrheo(betaE):
+    expected = eval_model(TingModel, betaE)
+    np.testing.assert_allclose(eval_model(AcceleratedTingModel, betaE), expected, rtol=1e-10, atol=1e-12 * np.abs(expected).max())